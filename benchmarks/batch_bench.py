@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare the records per second of numeric pipelines in row mode, with the stages of dw, and in batch
+mode, with the stages of dw.batch on NumPy arrays and on array.array. The lines are converted into
+batches by the first batch stage in batch mode, and the results are checked to be the same.
+
+    $ PYTHONPATH=src python3 benchmarks/batch_bench.py [RECORDS] [BATCH_SIZE]
+"""
+
+import random
+import sys
+import time
+
+import dw
+import dw.batch
+
+
+def _timed(f, *args) -> tuple:
+    start: float = time.perf_counter()
+    result: object = f(*args)
+    return result, time.perf_counter() - start
+
+
+def main(records: int = 1_000_000, batch_size: int = 65536):
+    rng: random.Random = random.Random(0)
+    lines: list = [f"{rng.random():.6f}" for _ in range(records)]
+    threshold: float = 0.5
+
+    row_pipelines: dict = {
+        "map|filter|sorted": lambda: lines | dw.map(float) | dw.filter(lambda x: x > threshold) | dw.sorted(),
+        "map|head": lambda: lines | dw.map(float) | dw.head(records // 2),
+        "map|tail": lambda: lines | dw.map(float) | dw.tail(10),
+        "map|map|count": lambda: lines | dw.map(float) | dw.map(lambda x: x * 10 // 1) | dw.count(),
+        "map|sample": lambda: lines | dw.map(float) | dw.sample(100, seed=0),
+        "map x4|filter|tail": lambda: (lines | dw.map(float) | dw.map(lambda x: x * 2) | dw.map(lambda x: x - 1)
+                                       | dw.map(abs) | dw.filter(lambda x: x < threshold) | dw.tail(10)),
+    }
+
+    def batch_pipelines(vectorize: bool) -> dict:
+        # with NumPy, the functions are called with whole arrays at once
+        def lines_() -> dw.IterableMonad:
+            return lines | dw.batch.batches(batch_size, vectorize=vectorize)
+
+        return {
+            "map|filter|sorted": lambda: lines_() | dw.batch.map(float) | dw.batch.filter(lambda x: x > threshold, vectorized=vectorize) | dw.batch.sorted(),
+            "map|head": lambda: lines_() | dw.batch.map(float) | dw.batch.head(records // 2),
+            "map|tail": lambda: lines_() | dw.batch.map(float) | dw.batch.tail(10),
+            "map|map|count": lambda: lines_() | dw.batch.map(float) | dw.batch.map(lambda x: x * 10 // 1, vectorized=vectorize) | dw.batch.count(),
+            "map|sample": lambda: lines_() | dw.batch.map(float) | dw.batch.sample(100, seed=0),
+            "map x4|filter|tail": lambda: (lines_() | dw.batch.map(float) | dw.batch.map(lambda x: x * 2, vectorized=vectorize) | dw.batch.map(lambda x: x - 1, vectorized=vectorize)
+                                           | dw.batch.map(abs, vectorized=vectorize) | dw.batch.filter(lambda x: x < threshold, vectorized=vectorize) | dw.batch.tail(10)),
+        }
+
+    modes: list = [("array.array", batch_pipelines(False))]
+    if dw.batch._numpy() is not None:
+        modes.insert(0, ("NumPy", batch_pipelines(True)))
+    print(f"{records:,} records, batches of {batch_size:,}, records per second")
+    print(f"{'pipeline':<18} | {'row':>12} | " + " | ".join(f"{name:>20}" for name, _ in modes))
+    for name, row_pipeline in row_pipelines.items():
+        expected, row = _timed(list, row_pipeline())
+        columns: list = []
+        for _, pipelines in modes:
+            result, seconds = _timed(list, pipelines[name]())
+            assert result == expected, name
+            columns.append(f"{records / seconds:>12,.0f} ({row / seconds:>4.1f}x)")
+        print(f"{name:<18} | {records / row:>12,.0f} | " + " | ".join(columns))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Measure a cat | grep | sorted | uniq report over a log file without a cache, on the first run with a
+dw.cache.ResultCache, which writes its output, and on the runs after, which replay it. Content identity
+hashes the file on every run, and is measured too.
+
+    $ PYTHONPATH=src python3 benchmarks/cache_bench.py [LINES] [RUNS]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+import dw
+from dw.cache import ResultCache
+
+
+def main(lines: int = 1_000_000, runs: int = 5):
+    rng: random.Random = random.Random(0)
+    with tempfile.TemporaryDirectory() as d:
+        path: str = os.path.join(d, "access.log")
+        with open(path, "w") as f:
+            for idx in range(lines):
+                level: str = rng.choice(("INFO", "INFO", "INFO", "WARN", "ERROR"))
+                f.write(f"{idx:08d} {level} user{rng.randrange(10000)} /page/{rng.randrange(100)}\n")
+
+        def report(cache: ResultCache = None) -> list:
+            return list(dw.cat(path, cache=cache) | dw.grep("ERROR") | dw.map(lambda line: line.split()[2])
+                        | dw.sorted() | dw.uniq())
+
+        def timed(cache: ResultCache = None) -> tuple:
+            start: float = time.perf_counter()
+            result: list = report(cache)
+            return result, time.perf_counter() - start
+
+        expected, seconds = timed()
+        print(f"{lines:,} lines, {os.path.getsize(path) / 1024 / 1024:.1f} MiB, {len(expected):,} lines of output")
+        print(f"{'no cache':<22}: {seconds:.3f} sec")
+        for identity in ("stat", "content"):
+            cache: ResultCache = ResultCache(os.path.join(d, f"cache-{identity}"), identity=identity)
+            result, first = timed(cache)
+            assert result == expected and cache.misses == 1
+            replays: list = []
+            for _ in range(runs):
+                result, seconds = timed(cache)
+                assert result == expected
+                replays.append(seconds)
+            assert cache.hits == runs
+            replay: float = min(replays)
+            print(f"{identity + ' first run':<22}: {first:.3f} sec")
+            print(f"{identity + ' replay':<22}: {replay:.3f} sec ({first / replay:.0f}x faster, best of {runs})")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare cat | grep | tee over an ASCII log in text mode and in binary mode.
+
+    $ PYTHONPATH=src python3 benchmarks/cat_bench.py [LINES]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import dw
+
+
+def main(lines: int = 2_000_000):
+    with tempfile.TemporaryDirectory() as d:
+        log: str = os.path.join(d, "access.log")
+        with open(log, "w") as f:
+            for idx in range(lines):
+                level: str = "ERROR" if idx % 97 == 0 else "INFO"
+                f.write(f"2022-01-01T00:00:{idx % 60:02d} {level} request id={idx} path=/api/v1/items/{idx % 1000}\n")
+        size_mb: float = os.path.getsize(log) / 2**20
+        out: str = os.path.join(d, "out.log")
+
+        start: float = time.perf_counter()
+        dw.cat(log) | dw.grep("ERROR") | dw.tee(out) | dw.do_nothing > dw.DEV_NULL
+        text: float = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dw.cat(log, b=True) | dw.grep(b"ERROR") | dw.tee(out, b=True) | dw.do_nothing > dw.DEV_NULL
+        binary: float = time.perf_counter() - start
+
+        print(f"{lines:,} lines, {size_mb:.1f} MiB")
+        print(f"text   : {text:.3f} sec {size_mb / text:8.1f} MiB/s")
+        print(f"binary : {binary:.3f} sec {size_mb / binary:8.1f} MiB/s ({text / binary:.2f}x)")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
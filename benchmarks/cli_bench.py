@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Measure the startup of the dw command: the import time that each subcommand adds to the interpreter,
+from -X importtime, the heavy modules it imports, and its wall time. Exit with status 1 if the import
+time of dw head exceeds BUDGET_MS milliseconds.
+
+    $ PYTHONPATH=src python3 benchmarks/cli_bench.py [RUNS] [BUDGET_MS]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# the dw console script does the same
+_DW: list = [sys.executable, "-c", "import sys, dw; sys.exit(dw.main_cli())"]
+_COMMANDS: tuple = (
+    ("head", "-n", "1"),
+    ("sort", "-n"),
+    ("grep", "ERROR"),
+    ("sample", "-k", "1"),
+    ("csv", "to_markdown"),
+)
+_HEAVY_MODULES: tuple = ("re", "random", "csv", "logging", "argparse", "getopt", "subprocess", "threading")
+_INPUT: bytes = b"a,b\n1,ERROR\n2,ok\n"
+
+
+def _import_times(stderr: str) -> dict:
+    """
+    Return {module: self microseconds} from the output of -X importtime.
+    """
+    times: dict = {}
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "self [us]" not in line:
+            self_us, _, module = line[len("import time:"):].split("|")
+            times[module.strip()] = int(self_us)
+    return times
+
+
+def main(runs: int = 20, budget_ms: int = 10):
+    env: dict = dict(os.environ)
+    # write the bytecode caches first, as an installed package has them
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    for command in _COMMANDS:
+        subprocess.run(_DW + list(command), input=_INPUT, stdout=subprocess.DEVNULL, env=env, check=True)
+    baseline: dict = _import_times(subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"],
+                                                  capture_output=True, text=True, env=env).stderr)
+
+    def wall_time(args: list) -> float:
+        seconds: list = []
+        for _ in range(runs):
+            start: float = time.perf_counter()
+            subprocess.run(args, input=_INPUT, stdout=subprocess.DEVNULL, env=env, check=True)
+            seconds.append(time.perf_counter() - start)
+        return statistics.median(seconds)
+
+    interpreter: float = wall_time([sys.executable, "-c", "pass"])
+    print(f"python -c pass: {interpreter * 1000:.1f} ms (median of {runs} runs)")
+    print(f"{'command':<18} | {'import ms':>9} | {'wall ms':>7} | heavy modules imported")
+    over_budget: bool = False
+    for command in _COMMANDS:
+        result = subprocess.run(_DW[:1] + ["-X", "importtime"] + _DW[1:] + list(command),
+                                input=_INPUT, capture_output=True, env=env, check=True)
+        times: dict = _import_times(result.stderr.decode())
+        import_ms: float = sum(us for module, us in times.items() if module not in baseline) / 1000
+        heavy: list = [module for module in _HEAVY_MODULES if module in times and module not in baseline]
+        wall: float = wall_time(_DW + list(command))
+        print(f"{' '.join(('dw',) + command):<18} | {import_ms:>9.1f} | {wall * 1000:>7.1f} | {', '.join(heavy)}")
+        if command[0] == "head" and import_ms > budget_ms:
+            over_budget = True
+    if over_budget:
+        print(f"dw head imports for more than the budget of {budget_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare records/sec of a 10-stage per-record pipeline with and without compiled mode.
+
+    $ PYTHONPATH=src python3 benchmarks/compiled_bench.py
+"""
+
+import time
+
+import dw
+
+
+def run(size: int, compiled: bool) -> float:
+    sink: list = []
+    m = dw.cat(range(size), compiled=compiled) \
+        | dw.map(lambda x: x + 1) | dw.filter(lambda x: x % 7 != 0) | dw.do_nothing \
+        | dw.map(str) | dw.grep("[0-8]$") | dw.do_nothing \
+        | dw.map(len) | dw.filter(None) | dw.tee(sink) | dw.head(size)
+    start: float = time.perf_counter()
+    for _ in m:
+        pass
+    return size / (time.perf_counter() - start)
+
+
+def main():
+    print(f"{'records':>10} | {'plain rec/s':>12} | {'compiled rec/s':>14} | {'speedup':>7}")
+    for size in (100_000, 1_000_000):
+        plain: float = run(size, compiled=False)
+        compiled: float = run(size, compiled=True)
+        print(f"{size:>10} | {plain:>12,.0f} | {compiled:>14,.0f} | {compiled / plain:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare cat over a gzip compressed log with decompression inline and in a helper thread,
+in text mode and in binary mode. Pass a larger LINES (e.g. 30000000 for about 2.5 GiB) to
+measure multi GB files. The helper thread only helps when more than one core is available.
+
+    $ PYTHONPATH=src python3 benchmarks/compressed_bench.py [LINES]
+"""
+
+import gzip
+import os
+import sys
+import tempfile
+import time
+
+import dw
+
+
+def main(lines: int = 3_000_000):
+    with tempfile.TemporaryDirectory() as d:
+        log: str = os.path.join(d, "access.log.gz")
+        with gzip.open(log, "wt", compresslevel=6) as f:
+            for idx in range(lines):
+                level: str = "ERROR" if idx % 97 == 0 else "INFO"
+                f.write(f"2022-01-01T00:00:{idx % 60:02d} {level} request id={idx} path=/api/v1/items/{idx % 1000}\n")
+        size_mb: float = os.path.getsize(log) / 2**20
+        print(f"{lines:,} lines, {size_mb:.1f} MiB compressed, {os.cpu_count()} cpus")
+
+        for binary in (False, True):
+            pattern: object = b"ERROR" if binary else "ERROR"
+            seconds: dict = {}
+            for decompress_in_thread in (False, True):
+                start: float = time.perf_counter()
+                dw.cat(log, b=binary, decompress_in_thread=decompress_in_thread) | dw.grep(pattern) > dw.DEV_NULL
+                seconds[decompress_in_thread] = time.perf_counter() - start
+            mode: str = "binary" if binary else "text"
+            print(f"{mode:<6} inline    : {seconds[False]:.3f} sec")
+            print(f"{mode:<6} in thread : {seconds[True]:.3f} sec ({seconds[False] / seconds[True]:.2f}x)")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare the memory per retained row and the read time of csv.DictReader, csv.reader and dw.csv.cat
+on a wide CSV file, and the time to access one typed column.
+
+    $ PYTHONPATH=src python3 benchmarks/csv_bench.py [ROWS] [COLUMNS]
+"""
+
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import dw
+import dw.csv
+
+
+def _measured(f):
+    """
+    Return the result of f, the bytes it keeps allocated and the seconds it takes.
+    """
+    tracemalloc.start()
+    start: float = time.perf_counter()
+    result: object = f()
+    seconds: float = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, seconds
+
+
+def main(rows: int = 100_000, columns: int = 50):
+    rng: random.Random = random.Random(0)
+    with tempfile.TemporaryDirectory() as d:
+        path: str = os.path.join(d, "wide.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow([f"column{idx}" for idx in range(columns)])
+            for _ in range(rows):
+                writer.writerow([f"{rng.random():.4f}"] + [rng.choice((str(rng.randrange(100000)), f"{rng.random():.4f}", rng.choice(("tokyo", "osaka", ""))))
+                                                           for _ in range(columns - 1)])
+
+        def dict_reader() -> list:
+            with open(path, newline="") as f:
+                return list(csv.DictReader(f))
+
+        def tuple_reader() -> list:
+            with open(path, newline="") as f:
+                reader = csv.reader(f)
+                next(reader)
+                return [tuple(fields) for fields in reader]
+
+        def dw_csv() -> list:
+            return list(dw.csv.cat(path, types={"column0": float}))
+
+        print(f"{rows:,} rows x {columns} columns, {os.path.getsize(path) / rows:.0f} bytes per line")
+        print(f"{'reader':<16} | {'bytes per row':>13} | {'read sec':>8} | {'column0 sec':>11}")
+        baseline: int = None
+        for name, f in (("csv.DictReader", dict_reader), ("csv.reader tuple", tuple_reader), ("dw.csv.cat", dw_csv)):
+            result, size, seconds = _measured(f)
+            baseline = baseline or size
+            start: float = time.perf_counter()
+            if name == "csv.DictReader":
+                total: float = sum(float(row["column0"]) for row in result if row["column0"])
+            elif name == "csv.reader tuple":
+                total: float = sum(float(row[0]) for row in result if row[0])
+            else:
+                total: float = sum(row["column0"] for row in result if row["column0"] is not None)
+            access: float = time.perf_counter() - start
+            print(f"{name:<16} | {size / rows:>13,.0f} | {seconds:>8.3f} | {access:>11.3f}  ({size / baseline:.0%} of DictReader, sum {total:.1f})")
+            del result
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
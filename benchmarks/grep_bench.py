@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare grep with many patterns against searching each pattern in turn.
+
+    $ PYTHONPATH=src python3 benchmarks/grep_bench.py
+"""
+
+import random
+import re
+import time
+
+import dw
+
+
+def one_by_one(records: list, patterns: list, fixed_strings: bool) -> int:
+    compiled: list = [re.compile(re.escape(p) if fixed_strings else p) for p in patterns]
+    return sum(1 for r in records if any(c.search(r) for c in compiled))
+
+
+def main():
+    random.seed(0)
+    records: list = [f"2022-01-01 GET /items/{random.randrange(10**6)} from 10.0.{random.randrange(256)}.{random.randrange(256)} ua=agent{random.randrange(10**5)}"
+                     for _ in range(20_000)]
+    print(f"{'patterns':>8} | {'mode':<6} | {'one by one':>10} | {'dw.grep':>8} | {'speedup':>7}")
+    for size in (10, 100, 10_000):
+        literals: list = [f"agent{random.randrange(10**5)}x" for _ in range(size)] + ["agent12345"]
+        for fixed_strings, patterns in ((True, literals), (False, [p.replace("agent", "age.t") for p in literals])):
+            start: float = time.perf_counter()
+            expected: int = one_by_one(records, patterns, fixed_strings)
+            baseline: float = time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual: int = sum(1 for _ in records | dw.grep(*patterns, F=fixed_strings))
+            elapsed: float = time.perf_counter() - start
+            assert actual == expected
+            print(f"{size:>8} | {'-F' if fixed_strings else 'regex':<6} | {baseline:>10.3f} | {elapsed:>8.3f} | {baseline / elapsed:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
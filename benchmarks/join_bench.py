@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare joining a stream of orders with customers by a dict built by hand, by dw.join in memory,
+by dw.join partitioned on disk (grace hash join) and by dw.join(merge=True) of sorted inputs.
+
+    $ PYTHONPATH=src python3 benchmarks/join_bench.py [ORDERS] [CUSTOMERS]
+"""
+
+import random
+import sys
+import time
+
+import dw
+
+
+def _timed(f, *args, **kwargs):
+    start: float = time.perf_counter()
+    result: object = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(orders: int = 1_000_000, customers: int = 100_000):
+    rng: random.Random = random.Random(0)
+    order_records: list = [(rng.randrange(customers * 2), idx, rng.random()) for idx in range(orders)]
+    customer_records: list = [(idx, f"customer{idx}") for idx in range(customers)]
+    key = lambda record: record[0]
+
+    def by_hand() -> list:
+        table: dict = {}
+        for customer in customer_records:
+            table.setdefault(customer[0], []).append(customer)
+        return [(order, customer) for order in order_records for customer in table.get(order[0], ())]
+
+    expected, hand = _timed(by_hand)
+    print(f"{orders:,} orders x {customers:,} customers, {len(expected):,} pairs")
+    print(f"dict by hand          : {hand:.3f} sec")
+
+    result, seconds = _timed(list, iter(order_records) | dw.join(customer_records, key=key))
+    assert result == expected
+    print(f"join                  : {seconds:.3f} sec ({hand / seconds:.2f}x)")
+
+    result, seconds = _timed(list, iter(order_records) | dw.join(customer_records, key=key, S=customers // 10))
+    assert sorted(result) == sorted(expected)
+    print(f"{f'join S={customers // 10:,}':<22}: {seconds:.3f} sec ({hand / seconds:.2f}x)")
+
+    sorted_orders: list = sorted(order_records, key=key)
+    expected = sorted(expected)
+    result, seconds = _timed(list, sorted_orders | dw.join(customer_records, key=key, merge=True))
+    assert sorted(result) == expected
+    print(f"join merge=True       : {seconds:.3f} sec ({hand / seconds:.2f}x), inputs sorted beforehand")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare None-aware sorts with comparator functions (functools.cmp_to_key) and with tuple keys,
+for one value per record and for rows with mixed ascending and descending columns.
+
+    $ PYTHONPATH=src python3 benchmarks/none_aware_bench.py [RECORDS]
+"""
+
+import functools
+import random
+import sys
+import time
+
+import dw
+
+
+def _timed(f, *args, **kwargs):
+    start: float = time.perf_counter()
+    result: object = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(records: int = 1_000_000):
+    rng: random.Random = random.Random(0)
+    values: list = [None if rng.random() < 0.1 else rng.randrange(records) for _ in range(records)]
+
+    expected, comparator = _timed(sorted, values, key=functools.cmp_to_key(dw._compare))
+    result, tuple_key = _timed(sorted, values, key=dw.none_aware_key_func)
+    assert result == expected
+    print(f"{records:,} values, 10% None")
+    print(f"cmp_to_key(_compare)  : {comparator:.3f} sec")
+    print(f"none_aware_key_func   : {tuple_key:.3f} sec ({comparator / tuple_key:.1f}x)")
+
+    rows: list = [(rng.choice([None, "tokyo", "osaka", "kyoto", "nagoya"]),
+                   None if rng.random() < 0.1 else rng.randrange(1000),
+                   rng.choice([None, "a", "b", "c", "d"])) for _ in range(records)]
+    columns: tuple = (0, (1, "desc"), (2, "desc", "last"))
+
+    def compare(a: tuple, b: tuple) -> int:
+        # the comparator a user would write for the columns above
+        c: int = dw._compare(a[0], b[0])
+        if c == 0:
+            c = -dw._compare(a[1], b[1])
+        if c == 0 and a[2] != b[2]:
+            c = 1 if a[2] is None else -1 if b[2] is None else (1 if a[2] < b[2] else -1)
+        return c
+
+    expected, comparator = _timed(sorted, rows, key=functools.cmp_to_key(compare))
+    result, key = _timed(sorted, rows, key=dw.columns_key(*columns))
+    assert result == expected
+    result, passes = _timed(list, rows | dw.sort_by(*columns))
+    assert result == expected
+    print(f"{records:,} rows, columns {columns}")
+    print(f"cmp_to_key(comparator): {comparator:.3f} sec")
+    print(f"columns_key           : {key:.3f} sec ({comparator / key:.1f}x)")
+    print(f"sort_by               : {passes:.3f} sec ({comparator / passes:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
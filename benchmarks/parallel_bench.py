@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Measure how dw.map scales with the number of workers for a CPU-heavy function.
+
+    $ PYTHONPATH=src python3 benchmarks/parallel_bench.py
+"""
+
+import os
+import time
+
+import dw
+
+
+def parse(line: str) -> int:
+    total: int = 0
+    for field in line.split(","):
+        for c in field:
+            total = (total * 31 + ord(c)) % 1_000_003
+    return total
+
+
+def run(records: list, **kwargs) -> float:
+    start: float = time.perf_counter()
+    for _ in records | dw.map(parse, **kwargs):
+        pass
+    return len(records) / (time.perf_counter() - start)
+
+
+def main():
+    records: list = [",".join(str(x * y) for y in range(20)) for x in range(100_000)]
+    sequential: float = run(records)
+    print(f"{'mode':<28} | {'rec/s':>10} | {'speedup':>7}")
+    print(f"{'sequential':<28} | {sequential:>10,.0f} | {1:>6.2f}x")
+    for executor in ("thread", "process"):
+        workers: int = 1
+        while workers <= (os.cpu_count() or 1):
+            rate: float = run(records, workers=workers, batch_size=1024, executor=executor)
+            print(f"{executor + ' workers=' + str(workers):<28} | {rate:>10,.0f} | {rate / sequential:>6.2f}x")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare dw.pivot.pivot with NumPy, in pure Python, with spills, and a dict of per-group lists built
+by hand, over records of (group, int, float).
+
+    $ PYTHONPATH=src python3 benchmarks/pivot_bench.py [RECORDS] [GROUPS]
+"""
+
+import random
+import sys
+import time
+
+from dw.pivot import _numpy, pivot
+
+
+def _timed(f, *args, **kwargs):
+    start: float = time.perf_counter()
+    result: object = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(records: int = 2_000_000, groups: int = 1000):
+    rng: random.Random = random.Random(0)
+    rows: list = [(rng.randrange(groups), rng.randrange(1000), rng.random()) for _ in range(records)]
+    formulas: list = ["n=count()", "sum(1)", "min(1)", "max(2)", "mean(2)"]
+
+    def by_hand() -> list:
+        table: dict = {}
+        for row in rows:
+            state = table.get(row[0])
+            if state is None:
+                table[row[0]] = [1, row[1], row[1], row[2], row[2]]
+            else:
+                state[0] += 1
+                state[1] += row[1]
+                if row[1] < state[2]:
+                    state[2] = row[1]
+                if row[2] > state[3]:
+                    state[3] = row[2]
+                state[4] += row[2]
+        return [{0: g, "n": n, "sum_1": s, "min_1": lo, "max_2": hi, "mean_2": total / n} for g, (n, s, lo, hi, total) in table.items()]
+
+    expected, hand = _timed(by_hand)
+    print(f"{records:,} records, {groups:,} groups, formulas {formulas}")
+    print(f"dict by hand          : {hand:.3f} sec")
+    python_result, python = _timed(list, rows | pivot(0, formulas=formulas, vectorize=False))
+    assert [{k: v for k, v in r.items() if k != "mean_2"} for r in python_result] == [{k: v for k, v in r.items() if k != "mean_2"} for r in expected]
+    print(f"pivot pure Python     : {python:.3f} sec ({hand / python:.2f}x)")
+    if _numpy() is not None:
+        result, seconds = _timed(list, rows | pivot(0, formulas=formulas, vectorize=True))
+        assert result == python_result
+        print(f"pivot NumPy           : {seconds:.3f} sec ({hand / seconds:.2f}x)")
+    else:
+        print("pivot NumPy           : numpy is not installed")
+    result, seconds = _timed(list, rows | pivot(0, formulas=formulas, S=groups // 10))
+    assert sorted(result, key=lambda r: r[0]) == sorted(python_result, key=lambda r: r[0])
+    print(f"{f'pivot S={groups // 10:,}':<22}: {seconds:.3f} sec ({hand / seconds:.2f}x)")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare cat | grep | count over one log file with dw.scan in 1, 2, 4, ... worker processes,
+up to the number of cpus.
+
+    $ PYTHONPATH=src python3 benchmarks/scan_bench.py [LINES]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import dw
+
+
+def main(lines: int = 3_000_000):
+    with tempfile.TemporaryDirectory() as d:
+        log: str = os.path.join(d, "access.log")
+        with open(log, "w") as f:
+            for idx in range(lines):
+                level: str = "ERROR" if idx % 97 == 0 else "INFO"
+                f.write(f"2022-01-01T00:00:{idx % 60:02d} {level} request id={idx} path=/api/v1/items/{idx % 1000}\n")
+        size_mb: float = os.path.getsize(log) / 2**20
+        cpus: int = os.cpu_count() or 1
+        print(f"{lines:,} lines, {size_mb:.1f} MiB, {cpus} cpus")
+
+        start: float = time.perf_counter()
+        expected: list = list(dw.cat(log) | dw.grep("ERROR") | dw.map(lambda line: line[-3:]) | dw.count())
+        sequential: float = time.perf_counter() - start
+        print(f"cat      : {sequential:.3f} sec")
+
+        workers: int = 1
+        while True:
+            start = time.perf_counter()
+            result: list = list(dw.scan(log, dw.grep("ERROR"), dw.map(lambda line: line[-3:]), dw.count(), workers=workers))
+            seconds: float = time.perf_counter() - start
+            assert result == expected
+            print(f"scan x{workers:<3}: {seconds:.3f} sec ({sequential / seconds:.2f}x)")
+            if workers >= cpus:
+                break
+            workers = min(2 * workers, cpus)
+        if cpus == 1:
+            start = time.perf_counter()
+            list(dw.scan(log, dw.grep("ERROR"), dw.map(lambda line: line[-3:]), dw.count(), workers=2))
+            seconds = time.perf_counter() - start
+            print(f"scan x2  : {seconds:.3f} sec ({sequential / seconds:.2f}x, oversubscribed)")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
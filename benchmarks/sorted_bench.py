@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare in-memory dw.sorted with the spill-to-disk mode (buffer_size).
+
+    $ PYTHONPATH=src python3 benchmarks/sorted_bench.py
+"""
+
+import random
+import time
+import tracemalloc
+
+import dw
+
+
+def measure(records: list, **kwargs) -> tuple:
+    tracemalloc.start()
+    start: float = time.perf_counter()
+    for _ in records | dw.sorted(**kwargs):
+        pass
+    elapsed: float = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    print(f"{'records':>10} | {'mode':<22} | {'sec':>8} | {'peak MiB':>9}")
+    for size in (10_000, 100_000, 1_000_000):
+        records: list = [f"{random.random():.12f}" for _ in range(size)]
+        for label, kwargs in (("in-memory", {}),
+                              ("buffer_size=10000", {"buffer_size": 10_000}),
+                              ("buffer_size=100000", {"buffer_size": 100_000})):
+            elapsed, peak = measure(records, **kwargs)
+            print(f"{size:>10} | {label:<22} | {elapsed:>8.3f} | {peak / 2**20:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
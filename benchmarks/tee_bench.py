@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Compare writing short lines to a file one record per write call and in batches.
+
+    $ PYTHONPATH=src python3 benchmarks/tee_bench.py [LINES]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import dw
+
+
+def main(lines: int = 5_000_000):
+    records: list = [f"{x:08d}" for x in range(lines)]
+    with tempfile.TemporaryDirectory() as d:
+        path: str = os.path.join(d, "out.txt")
+        print(f"{lines:,} lines")
+        for binary in (False, True):
+            for flush_size in (1, 64, 1024, 16384):
+                start: float = time.perf_counter()
+                records | dw.tee(path, b=binary, flush_size=flush_size) > dw.DEV_NULL
+                elapsed: float = time.perf_counter() - start
+                print(f"{'binary' if binary else 'text':<6} flush_size={flush_size:<6}: {elapsed:.3f} sec {lines / elapsed:>12,.0f} lines/s")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -11,17 +11,26 @@
 
 __version__ = "0.4.0"
 
-from collections.abc import Iterable, Callable, Sequence, Set
+from collections.abc import Iterable, Callable, Sequence, Set, MutableSequence, MutableSet
 import io
-import logging
 import os
-import re
 import sys
 
 # Logger
-_LOGGER: logging.Logger = logging.getLogger(__name__)
+# logging and re are imported where they are used, so that the dw command starts fast
 _LOG_FORMAT: str = '%(asctime)s |  %(levelname)-7s | %(message)s (%(filename)s L%(lineno)s %(name)s)'
 
+
+def __getattr__(name: str) -> object:
+    # dw._LOGGER, dw.logging and dw.re are still there for code that uses them, imported when first used
+    if name == "_LOGGER":
+        import logging
+        return logging.getLogger(__name__)
+    if name in ("logging", "re"):
+        import importlib
+        return importlib.import_module(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 ################################################################################
 
 
@@ -50,8 +59,83 @@ class Monad(object):
 
 class IterableMonad(Monad):
 
+    # The iterable given to the stage that created this monad, and that stage.
+    # They are recorded by bind so that the next bind can rewrite stage pairs.
+    upstream: Iterable = None
+    stage: Callable = None
+    # (file names, encoding, binary) if this monad is cat(..., memory_map=True) over local files.
+    memory_map_spec: tuple = None
+    # (index, file names, encoding, binary, buffer_size) if this monad is cat(..., index=...) over local files.
+    index_spec: tuple = None
+    # (file names, encoding, binary, sleep_interval, follow) if this monad is cat over local files.
+    follow_spec: tuple = None
+    # The dw.cache.ResultCache given to cat, and the stages and files that the output of this monad
+    # depends on, or None if it cannot be cached.
+    cache: object = None
+    lineage: tuple = None
+
+    def __init__(self, iterable: Iterable[object] = [], compiled: bool = False, profiler: object = None):
+        """
+        If compiled is True, consecutive per-record stages (map, filter, grep, head, do_nothing and
+        tee to a list, a set or a callable) are merged into a single loop per record.
+        If a dw.profile.Profiler is given, the stages bound to this monad record their stats in it.
+        """
+        super().__init__(iterable)
+        self.compiled: bool = compiled
+        self.profiler: object = profiler
+        if profiler is not None:
+            self.iterable = profiler.profile(iterable, "source")
+
     def bind(self, monadic_func: Callable) -> object:
-        new_iterable_monad: IterableMonad = super().bind(monadic_func)
+        source: IterableMonad = self
+        stage: Callable = monadic_func
+
+        sort_spec: tuple = getattr(self.stage, "sort_spec", None)
+        if sort_spec is not None:
+            # sorted(...) | head(n) and sorted(...) | tail(n) only need n records of the sorted output.
+            # The sorted stage has not started yet because it is a generator.
+            key, reverse = sort_spec
+            if getattr(monadic_func, "head_n", None) is not None:
+                source, stage = IterableMonad(self.upstream), topk(monadic_func.head_n, key=key, reverse=reverse)
+            elif getattr(monadic_func, "tail_n", None) is not None:
+                source, stage = IterableMonad(self.upstream), topk(monadic_func.tail_n, key=key, reverse=reverse, last=True)
+
+        if self.memory_map_spec is not None:
+            # tail and reversed can walk memory mapped files backwards from EOF instead of reading them through
+            if getattr(monadic_func, "tail_n", None) is not None:
+                stage = _memory_mapped_reversed(*self.memory_map_spec, n=monadic_func.tail_n)
+            elif getattr(monadic_func, "reverses", False):
+                stage = _memory_mapped_reversed(*self.memory_map_spec)
+
+        if self.follow_spec is not None and getattr(monadic_func, "tail_n", None) is not None:
+            # tail(n, follow=True) and tail after cat(..., follow=True) print the last n lines and follow the files
+            file_names, encoding, binary, sleep_interval, follow = self.follow_spec
+            if follow or getattr(monadic_func, "follows", False):
+                stage = _followed_tail(file_names, encoding, binary, sleep_interval, monadic_func.tail_n)
+
+        if self.index_spec is not None and getattr(monadic_func, "grep_spec", None) is not None:
+            # grep reads only the blocks of indexed files that can match
+            stage = _indexed_grep(*self.index_spec, monadic_func)
+
+        if self.compiled and source is self:
+            record_steps: tuple = getattr(stage, "record_steps", None)
+            upstream_record_steps: tuple = getattr(self.stage, "record_steps", None)
+            if record_steps is not None and upstream_record_steps is not None:
+                source, stage = IterableMonad(self.upstream), _compile_record_steps(upstream_record_steps + record_steps)
+
+        new_iterable_monad: IterableMonad = super(IterableMonad, source).bind(stage)
+        if isinstance(new_iterable_monad, IterableMonad):
+            new_iterable_monad.upstream = source.iterable
+            new_iterable_monad.stage = stage
+            new_iterable_monad.compiled = self.compiled
+            new_iterable_monad.profiler = self.profiler
+            if self.cache is not None:
+                new_iterable_monad.cache = self.cache
+                new_iterable_monad.lineage = self.cache.extended(self.lineage, monadic_func)
+            if self.profiler is not None:
+                if source is not self:
+                    self.profiler.discard(self.iterable)
+                new_iterable_monad.iterable = self.profiler.profile(new_iterable_monad.iterable, *_describe_stage(stage))
 
         if getattr(monadic_func, "sink_to_be_redirected_to", None):
             # if redirect is sandwitched by parentheses like ["a", "b"] | (grep("a") > []), this block is called
@@ -64,14 +148,30 @@ class IterableMonad(Monad):
 
         return new_iterable_monad
 
+    __or__ = bind  # Monad.__or__ is bound to Monad.bind
+
     def __iter__(self):
         # return self.iterable
-        return iter(self.iterable)
+        return iter(self._replayed())
+
+    def _replayed(self) -> Iterable[object]:
+        """
+        Return the iterable of this monad, which is read from or written to its cache if it has one.
+        """
+        if self.cache is None:
+            return self.iterable
+        return self.cache.replayed(self.lineage, self.iterable)
+
+    def _consumed(self) -> object:
+        # the monad that a sink is bound to
+        if self.cache is None:
+            return self
+        return type(self)(self._replayed(), compiled=self.compiled)
 
     def __str__(self) -> str:
         import io, os
         sio: io.StringIO = io.StringIO()
-        for obj in self.iterable:
+        for obj in self._replayed():
             sio.write(str(obj))
             sio.write("\n")
         return sio.getvalue()
@@ -79,46 +179,347 @@ class IterableMonad(Monad):
     __repr__ = __str__
 
     def redirect_to(self, sink) -> object:
-        other = self | tee(sink, append=False)
-        for _ in other:
-            pass
+        import collections
+        other = self._consumed() | tee(sink, append=False)
+        collections.deque(other, maxlen=0)
         return sink
 
     __gt__ = redirect_to  # range(5) | sort() > []
 
     def appending_redirect_to(self, sink) -> object:
-        other = self | tee(sink, append=True)
-        for _ in other:
-            pass
+        import collections
+        other = self._consumed() | tee(sink, append=True)
+        collections.deque(other, maxlen=0)
         return sink
 
     __rshift__ = appending_redirect_to  # (range(5) | sort() ) >> "filename". because >> is stronger than |.
 
-def cat(*iterables: list[Iterable], encoding="utf-8") -> IterableMonad:
+def _is_file_name(obj: object) -> bool:
+    return isinstance(obj, str) and "\n" not in obj and "\r" not in obj
+
+
+def cat(*iterables: list[Iterable], encoding="utf-8", compiled: bool = False,
+        b: bool = False, binary: bool = False, buffer_size: int = 1024 * 1024,
+        memory_map: bool = False, decompress_in_thread: bool = False, index: object = None,
+        f: bool = False, follow: bool = False, s: float = None, sleep_interval: float = 1.0,
+        profiler: object = None, cache: object = None) -> IterableMonad:
+    """
+    Concatenate files and iterables. A str without line breaks is a file name, and "-" is the standard input.
+      -b, --binary              read files as bytes in blocks of buffer_size bytes and yield lines as bytes
+                                without decoding. Lines are split at b"\n" and trailing b"\r" are removed.
+      --memory-map              mmap local files instead of reading them. Lines are split at b"\n" as in
+                                binary mode, so the encoding must be ASCII compatible. If all inputs are
+                                local files, a following tail(n) or reversed() scans backwards from EOF.
+    Files compressed with gzip, bzip2 or xz are detected by their extension or magic bytes and decompressed
+    as they are read. With decompress_in_thread, they are decompressed buffer_size bytes ahead in a helper
+    thread, which overlaps with the downstream stages because zlib, bz2 and lzma release the GIL.
+    If index, a dw.index.TrigramIndex or the path of one, is given and all inputs are local files, a following
+    grep reads only the blocks of the files that can match. The index is updated for the files first. The
+    index is not used if follow, as the lines appended later are not in it.
+      -f, --follow              output appended lines as the files grow, and never stop. Truncated and
+                                rotated files are read from the beginning, see dw.follow. All inputs must
+                                be local uncompressed files, and lines are split at b"\n" as in binary mode.
+      -s, --sleep-interval=N    with --follow, notice changes within about N seconds (default 1.0)
+    If cache, a dw.cache.ResultCache, is given and all inputs are local files, the output of the pipeline is
+    replayed from the cache while the files and the stages are unchanged, see dw.cache.
+    See IterableMonad for compiled and profiler.
+    """
+    binary = binary or b
+    follow = follow or f
+    sleep_interval = s or sleep_interval
+    local_files: bool = all(_is_file_name(iterable) and iterable != STDIO for iterable in iterables)
+    if follow and not (local_files and all(not os.path.exists(iterable) or _compression(iterable, reading=True) is None
+                                           for iterable in iterables)):
+        raise ValueError("follow needs local uncompressed files.")
 
     def _cat() -> Iterable[str]:
         for iterable in iterables:
-            if isinstance(iterable, str) and ("\n" not in iterable or "\r" not in iterable):
+            compression: object = None
+            if _is_file_name(iterable) and iterable != STDIO:
+                if not os.path.exists(iterable):
+                    raise FileNotFoundError(iterable)
+                compression = _compression(iterable, reading=True)
+
+            if compression is not None:
+                f = compression.open(iterable, "rb")
+                if decompress_in_thread:
+                    f = _ThreadedReader(f, buffer_size)
+                try:
+                    if binary:
+                        yield from _binary_lines(f, buffer_size)
+                    else:
+                        f = io.TextIOWrapper(io.BufferedReader(f, buffer_size) if decompress_in_thread else f, encoding=encoding)
+                        for line in f:
+                            yield line.rstrip("\r\n")
+                finally:
+                    f.close()
+            elif _is_file_name(iterable) and memory_map and iterable != STDIO:
+                yield from _memory_mapped_lines(iterable, encoding, binary)
+            elif _is_file_name(iterable):
                 # Assume that this is file
                 must_close: bool = False
                 if iterable == STDIO:
-                    iterable = sys.stdin
+                    iterable = sys.stdin.buffer if binary else sys.stdin
                 else:
-                    if not os.path.exists(iterable):
-                        FileNotFoundError(iterable)
-                    iterable = io.open(iterable, "rt", encoding=encoding)
+                    if binary:
+                        iterable = io.open(iterable, "rb", buffering=0)
+                    else:
+                        iterable = io.open(iterable, "rt", encoding=encoding)
                     must_close = True
                 try:
-                    for line in iterable:
-                        yield line.rstrip("\r\n")
+                    if binary:
+                        yield from _binary_lines(iterable, buffer_size)
+                    else:
+                        for line in iterable:
+                            yield line.rstrip("\r\n")
                 finally:
                     if must_close:
                         iterable.close()
+            elif isinstance(iterable, str):
+                yield from iterable.splitlines()
             else:
                 for obj in iterable:
                     yield obj
 
-    return IterableMonad(_cat())
+    if follow:
+
+        def _cat() -> Iterable[object]:
+            from dw.follow import follow_lines
+            yield from follow_lines(iterables, encoding, binary, sleep_interval, buffer_size=buffer_size)
+
+    m: IterableMonad = IterableMonad(_cat(), compiled=compiled)
+    if profiler is not None:
+        m.profiler = profiler
+        m.iterable = profiler.profile(m.iterable, "cat", _describe_call("cat", iterables, {}))
+    if memory_map and all(_is_file_name(iterable) and iterable != STDIO and os.path.exists(iterable)
+                          and _compression(iterable, reading=True) is None for iterable in iterables):
+        m.memory_map_spec = (iterables, encoding, binary)
+    if index is not None and local_files and not follow:
+        m.index_spec = (index, iterables, encoding, binary, buffer_size)
+    if local_files:
+        m.follow_spec = (iterables, encoding, binary, sleep_interval, follow)
+    if cache is not None:
+        m.cache = cache
+        if local_files and not follow:
+            m.lineage = cache.source(iterables, encoding, binary)
+    return m
+
+
+def _followed_tail(file_names: Sequence, encoding: str, binary: bool, sleep_interval: float, n: int) -> Callable:
+    """
+    Return a stage that ignores its input and yields the last n lines of file_names and then the appended lines.
+    """
+
+    @pipeable()
+    def _tail(_: Iterable) -> Iterable[object]:
+        from dw.follow import follow_lines
+        yield from follow_lines(file_names, encoding, binary, sleep_interval, n=n)
+
+    return _tail
+
+
+def _indexed_grep(index: object, file_names: Sequence, encoding: str, binary: bool, buffer_size: int,
+                  grep_stage: Callable) -> Callable:
+    """
+    Return a stage that ignores its input and applies grep_stage to the lines of file_names that index
+    can not rule out.
+    """
+
+    @pipeable()
+    def _grep(_: Iterable) -> Iterable[object]:
+        from dw.index import candidate_lines
+        yield from IterableMonad(candidate_lines(index, file_names, grep_stage.grep_spec, encoding, binary, buffer_size)) | grep_stage
+
+    return _grep
+
+
+# (module, file name extensions, magic bytes) of the compressions that cat and tee handle transparently.
+# The magic bytes of bz2 are its whole stream header with the block size and the magic of the first block
+# or of the end of the stream, so that text lines starting with "BZh" are not taken for bz2.
+_COMPRESSIONS: tuple = (
+    ("gzip", (".gz",), (b"\x1f\x8b",)),
+    ("bz2", (".bz2",), tuple(b"BZh%d%s" % (level, block) for level in range(1, 10) for block in (b"1AY&SY", b"\x17rE8P\x90"))),
+    ("lzma", (".xz", ".lzma"), (b"\xfd7zXZ\x00",)),
+)
+
+
+def _compression(file_name: str, reading: bool) -> object:
+    """
+    Return the module (gzip, bz2 or lzma) to open file_name with, or None if it is not compressed.
+    Files are detected by extension, and files to read also by magic bytes.
+    """
+    import importlib
+
+    magic: bytes = b""
+    if reading:
+        with io.open(file_name, "rb") as f:
+            magic = f.read(10)
+    lower_file_name: str = file_name.lower()
+    for module_name, extensions, module_magic in _COMPRESSIONS:
+        if lower_file_name.endswith(extensions) or (magic and magic.startswith(module_magic)):
+            return importlib.import_module(module_name)
+    return None
+
+
+class _ThreadedReader(io.RawIOBase):
+    """
+    Read blocks of buffer_size bytes from f in a helper thread, at most depth blocks ahead of the reader.
+    """
+
+    def __init__(self, f: io.IOBase, buffer_size: int, depth: int = 4):
+        import queue, threading
+
+        super().__init__()
+        self.f: io.IOBase = f
+        self.buffer_size: int = buffer_size
+        self.queue = queue.Queue(maxsize=depth)
+        self.block: bytes = b""
+        self.pos: int = 0
+        self.eof: bool = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="dw.cat", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        import queue
+
+        while not self.stopped.is_set():
+            try:
+                block: object = self.f.read(self.buffer_size)
+            except BaseException as e:
+                block = e
+            while not self.stopped.is_set():
+                try:
+                    self.queue.put(block, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if not block or isinstance(block, BaseException):
+                return
+
+    def _next_block(self) -> bool:
+        if self.pos < len(self.block):
+            return True
+        if self.eof:
+            return False
+        block: object = self.queue.get()
+        if isinstance(block, BaseException):
+            self.eof = True
+            raise block
+        if not block:
+            self.eof = True
+            return False
+        self.block = block
+        self.pos = 0
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._next_block():
+            return b""
+        if self.pos == 0 and (size < 0 or size >= len(self.block)):
+            # hand over the whole block without copying
+            block: bytes = self.block
+            self.block = b""
+            return block
+        end: int = len(self.block) if size < 0 else self.pos + size
+        chunk: bytes = self.block[self.pos:end]
+        self.pos += len(chunk)
+        return chunk
+
+    def readinto(self, b) -> int:
+        if not self._next_block():
+            return 0
+        n: int = min(len(b), len(self.block) - self.pos)
+        b[:n] = self.block[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.f.close()
+        super().close()
+
+
+def _memory_mapped_lines(file_name: str, encoding: str, binary: bool) -> Iterable[object]:
+    import mmap
+
+    with io.open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size: int = len(mm)
+            start: int = 0
+            while start < size:
+                end: int = mm.find(b"\n", start)
+                if end < 0:
+                    end = size
+                line: bytes = mm[start:end].rstrip(b"\r")
+                yield line if binary else line.decode(encoding)
+                start = end + 1
+
+
+def _memory_mapped_reversed_lines(file_names: Sequence, encoding: str, binary: bool) -> Iterable[object]:
+    import mmap
+
+    for file_name in _original_reversed(file_names):
+        with io.open(file_name, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size: int = len(mm)
+                end: int = size - 1 if mm[size - 1] == 0x0A else size
+                while True:
+                    start: int = mm.rfind(b"\n", 0, end) + 1
+                    line: bytes = mm[start:end].rstrip(b"\r")
+                    yield line if binary else line.decode(encoding)
+                    if start == 0:
+                        break
+                    end = start - 1
+
+
+def _memory_mapped_reversed(file_names: Sequence, encoding: str, binary: bool, n: int = None) -> Callable:
+    """
+    Return a stage that ignores its input and yields the lines of file_names in reverse order,
+    or only the last n lines in order if n is given.
+    """
+
+    @pipeable()
+    def _reversed(_: Iterable) -> Iterable[object]:
+        import itertools
+
+        lines: Iterable = _memory_mapped_reversed_lines(file_names, encoding, binary)
+        if n is None:
+            yield from lines
+        else:
+            last_lines: list = list(itertools.islice(lines, n))
+            lines.close()
+            yield from _original_reversed(last_lines)
+
+    return _reversed
+
+
+def _binary_lines(f: io.RawIOBase, buffer_size: int) -> Iterable[bytes]:
+    rest: bytes = b""
+    while True:
+        block: bytes = f.read(buffer_size)
+        if not block:
+            break
+        if rest:
+            block = rest + block
+        lines: list = block.split(b"\n")
+        rest = lines.pop()
+        if b"\r" in block:
+            for line in lines:
+                yield line.rstrip(b"\r")
+        else:
+            yield from lines
+    if rest:
+        yield rest.rstrip(b"\r")
 
 class MonadicFunctionWrapper(object):
     
@@ -161,9 +562,52 @@ class MonadicFunctionWrapper(object):
         return str(m2)
     __repr__ = __str__
 
-# marker decorator
 def monadic_function_returner(f: Callable):
-    return f
+    """
+    Decorator of functions that return a monadic function. It records the name and the arguments
+    of the call on the returned monadic function as stage_name and stage_args.
+    """
+    import functools
+
+    @functools.wraps(f)
+    def _f(*args, **kwargs) -> Callable:
+        mf = f(*args, **kwargs)
+        mf.stage_name = f.__name__
+        mf.stage_args = (args, kwargs)
+        return mf
+
+    return _f
+
+
+def _describe_call(name: str, args: tuple, kwargs: dict) -> str:
+
+    def _describe_arg(arg: object) -> str:
+        if callable(arg) and hasattr(arg, "__name__"):
+            return arg.__name__
+        description: str = repr(arg)
+        return description if len(description) <= 40 else description[:37] + "..."
+
+    return f"{name}({', '.join([_describe_arg(arg) for arg in args] + [f'{k}={_describe_arg(v)}' for k, v in kwargs.items()])})"
+
+
+def _describe_stage(stage: Callable) -> tuple:
+    """
+    Return the name of a stage and a description with its arguments.
+    """
+    name: str = getattr(stage, "stage_name", None) or "stage"
+    stage_args: tuple = getattr(stage, "stage_args", None)
+    if stage_args is None:
+        return name, name
+    return name, _describe_call(name, *stage_args)
+
+
+def _note_buffered(size: int) -> None:
+    """
+    Report the number of records a stage holds to the profiler, if dw.profile is in use.
+    """
+    profile = sys.modules.get("dw.profile")
+    if profile is not None:
+        profile.note_buffered(size)
 
 
 def monadic_function(monadic_function_wrapper: Callable = MonadicFunctionWrapper):
@@ -183,6 +627,7 @@ def pipeable(monad_class: IterableMonad = IterableMonad, monadic_function_wrappe
         def _monadic_f(iterable: Iterable[object]) -> IterableMonad:
             return monad_class(generator_f(iterable))
 
+        _monadic_f.stage_name = generator_f.__name__.lstrip("_")
         return _monadic_f
 
     return deco
@@ -195,85 +640,450 @@ def do_nothing(iterable: Iterable) -> Iterable[object]:
     for obj in iterable:
         yield obj
 
+do_nothing.record_steps = ()
+do_nothing.parallel_split = (do_nothing, None)
+
+################################################################################
+# Per-record stages describe themselves as record_steps, a tuple of (kind, arg) pairs:
+#   ("map", f)                       obj = f(obj)
+#   ("filter", f)                    drop obj unless f(obj)
+#   ("grep", (match_f, line_number)) drop obj unless match_f(obj), numbering the records given to grep
+#   ("head", n)                      stop after the n-th record, without reading another one
+#   ("tee", (write_f, reset_f))      write_f(obj), after calling reset_f (if not None) once at start
+# A compiled IterableMonad merges consecutive steps into one generator with a single loop.
+#
+# Stages that dw.scan can run on parts of a file in worker processes describe themselves as
+# parallel_split, a pair (worker stage, merge stage). The outputs of the worker stage for the parts are
+# concatenated in order and given to the merge stage, which is None for per-record stages.
+#
+# Stages whose output is not a function of their input and arguments set cacheable to False, and stages
+# that read files other than their input name them in source_files, see dw.cache.
+
+
+def _compile_record_steps(record_steps: tuple) -> Callable:
+    namespace: dict = {}
+    prologue: list = []
+    body: list = []
+    epilogue: list = []
+    for idx, (kind, arg) in enumerate(record_steps):
+        if kind == "map":
+            namespace[f"f{idx}"] = arg
+            body.append(f"obj = f{idx}(obj)")
+        elif kind == "filter":
+            namespace[f"f{idx}"] = bool if arg is None else arg
+            body.append(f"if not f{idx}(obj): continue")
+        elif kind == "grep":
+            match_f, line_number = arg
+            namespace[f"f{idx}"] = match_f
+            if line_number:
+                prologue.append(f"c{idx} = -1")
+                body.append(f"c{idx} += 1")
+            body.append(f"if not f{idx}(obj): continue")
+            if line_number:
+                body.append(f"obj = [c{idx}, obj]")
+        elif kind == "head":
+            if int(arg) == 0:
+                # stop before reading any record, and before the steps upstream start
+                prologue.append("return")
+            prologue.append(f"c{idx} = 0")
+            body.append(f"if c{idx} >= {int(arg)}: break")
+            body.append(f"c{idx} += 1")
+            # a followed file has no next record to stop at
+            epilogue.append(f"if c{idx} >= {int(arg)}: break")
+        elif kind == "tee":
+            write_f, reset_f = arg
+            namespace[f"f{idx}"] = write_f
+            if reset_f is not None:
+                namespace[f"r{idx}"] = reset_f
+                prologue.append(f"r{idx}()")
+            body.append(f"f{idx}(obj)")
+        else:
+            raise ValueError(f"unknown record step {kind}")
+
+    lines: list = ["def _compiled(iterable):"]
+    # the generators of unfused stages start from downstream, so the steps start in reverse order
+    for line in _original_reversed(prologue):
+        lines.append("    " + line)
+    lines.append("    for obj in iterable:")
+    lines.extend("        " + line for line in body)
+    lines.append("        yield obj")
+    lines.extend("        " + line for line in epilogue)
+    exec(compile("\n".join(lines), "<dw compiled stages>", "exec"), namespace)
+
+    compiled_stage: Callable = pipeable()(namespace["_compiled"])
+    compiled_stage.record_steps = record_steps
+    compiled_stage.stage_name = "compiled"
+    compiled_stage.stage_args = ((" | ".join(kind for kind, _ in record_steps),), {})
+    return compiled_stage
+
+################################################################################
+
+_SPILL_CHUNK_SIZE: int = 1024
+
+
+def _spill(iterable: Iterable, temporary_directory: str = None) -> io.BufferedRandom:
+    """
+    Pickle records into an anonymous temporary file and rewind it.
+    """
+    import itertools, pickle, tempfile
+
+    f = tempfile.TemporaryFile(dir=temporary_directory)
+    iterator = iter(iterable)
+    while True:
+        chunk: list = list(itertools.islice(iterator, _SPILL_CHUNK_SIZE))
+        if not chunk:
+            break
+        pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def _unspill(f: io.BufferedRandom) -> Iterable[object]:
+    import pickle
+
+    while True:
+        try:
+            chunk: list = pickle.load(f)
+        except EOFError:
+            return
+        yield from chunk
+
+
 ################################################################################
+class _BatchedWriter(object):
+    """
+    Write records to a text or bytes sink, followed by a newline unless newline is empty.
+    Records are joined into one chunk of up to flush_size records per write call, and pending records
+    are also written once flush_interval seconds have passed since the last write.
+    For bytes sinks, str records of a chunk are joined first and encoded once.
+    """
+
+    def __init__(self, sink: io.IOBase, binary: bool, encoding: str, newline: str, flush_size: int, flush_interval: float = None):
+        if flush_size < 1:
+            raise ValueError("flush_size must be positive value.")
+        self.sink: io.IOBase = sink
+        self.binary: bool = binary
+        self.encoding: str = encoding
+        self.newline: str = newline
+        self.flush_size: int = flush_size
+        self.flush_interval: float = flush_interval
+        self.newline_b: bytes = newline.encode(encoding)
+        self.pending: list = []
+        if flush_interval is not None:
+            import time
+            self._monotonic: Callable = time.monotonic
+            self.last_flush: float = time.monotonic()
+        elif flush_size == 1:
+            self.write = self._write_through
+
+    def _write_through(self, obj: object) -> None:
+        if self.binary:
+            self.sink.write((obj if isinstance(obj, bytes) else str(obj).encode(self.encoding)) + self.newline_b)
+        else:
+            self.sink.write((obj.decode(self.encoding) if isinstance(obj, bytes) else str(obj)) + self.newline)
+
+    def write(self, obj: object) -> None:
+        pending: list = self.pending
+        pending.append(obj)
+        if len(pending) >= self.flush_size:
+            self.flush()
+        elif self.flush_interval is not None and self._monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        pending: list = self.pending
+        if self.flush_interval is not None:
+            self.last_flush = self._monotonic()
+        if not pending:
+            return
+        newline: str = self.newline
+        newline_b: bytes = self.newline_b
+        encoding: str = self.encoding
+        # Chunks of records of one type are joined at once, and mixed chunks record by record.
+        try:
+            if self.binary and isinstance(pending[0], bytes):
+                chunk: bytes = newline_b.join(pending) + newline_b
+            elif self.binary:
+                chunk: bytes = (newline.join(pending) + newline).encode(encoding)
+            else:
+                chunk: str = newline.join(pending) + newline
+        except TypeError:
+            if self.binary:
+                chunk: bytes = newline_b.join([obj if isinstance(obj, bytes) else str(obj).encode(encoding) for obj in pending]) + newline_b
+            else:
+                chunk: str = newline.join([obj.decode(encoding) if isinstance(obj, bytes) else str(obj) for obj in pending]) + newline
+        pending.clear()
+        self.sink.write(chunk)
+
+
+def _open_sink(target: object, encoding: str, append: bool, n: bool, binary: bool,
+               flush_size: int, flush_interval: float) -> tuple:
+    """
+    Return (write, close) of a target of tee. write is None for DEV_NULL, and close is None
+    for sinks that need not be closed.
+    """
+    import io
+
+    sink: object = target
+    must_close = False
+    batch_size: int = flush_size or 1
+    if isinstance(sink, str):
+        if sink == "-":
+            sink = sys.stdout.buffer if binary else sys.stdout
+        else:
+            must_close = True
+            batch_size = flush_size or 1024
+            if not append and os.path.exists(sink):
+                os.remove(sink)
+            # FILEs named *.gz, *.bz2 and *.xz are compressed
+            opener: Callable = getattr(_compression(sink, reading=False), "open", io.open)
+            if binary:
+                sink = opener(sink, "ab" if append else "wb")
+            else:
+                sink = opener(sink, "at" if append else "wt", encoding=encoding)
+
+    if sink is DEV_NULL:
+        return None, None
+    elif isinstance(sink, Sequence):
+        if not append:
+            sink.clear()
+        return sink.append, None
+    elif isinstance(sink, Set):
+        if not append:
+            sink.clear()
+        return sink.add, None
+    elif isinstance(sink, io.TextIOBase) or isinstance(sink, io.BufferedIOBase) or isinstance(sink, io.FileIO):
+        # if isinstance(sink, typing.TextIO): => dont work
+        # see https://docs.python.org/en/3/library/os.html#os.linesep for "\n"
+        writer = _BatchedWriter(sink, not isinstance(sink, io.TextIOBase), encoding, "" if n else "\n", batch_size, flush_interval)
+
+        def close() -> None:
+            try:
+                writer.flush()
+            finally:
+                if must_close:
+                    sink.close()
+
+        return writer.write, close
+    elif isinstance(sink, Callable):
+        return sink, None
+    else:
+        raise ValueError(f"sink=={sink} is not instance of either io, Sequence, or Set")
+
+
+_QUEUED_SINK_BATCH_SIZE: int = 256
+
+
+class _QueuedSink(object):
+    """
+    Write records to a sink in a background thread, through a queue that holds at most queue_size records.
+
+    When the queue is full, on_full decides what happens to the records:
+      "block"  wait for the writer thread
+      "drop"   discard them, and count them in dropped
+      "spill"  pickle them into a temporary file, which is handed to the writer thread in order
+    An exception raised by the writer thread is kept in error, and later records are discarded.
+    """
+
+    def __init__(self, write: Callable, close: Callable, queue_size: int, on_full: str, temporary_directory: str):
+        import queue, threading
+
+        if on_full not in ("block", "drop", "spill"):
+            raise ValueError(f"on_full=={on_full!r} is not one of 'block', 'drop' or 'spill'")
+        self.write_: Callable = write
+        self.close_: Callable = close
+        self.batch_size: int = max(1, min(_QUEUED_SINK_BATCH_SIZE, queue_size))
+        self.queue = queue.Queue(maxsize=max(1, queue_size // self.batch_size))
+        self.on_full: str = on_full
+        self.temporary_directory: str = temporary_directory
+        self.pending: list = []
+        self.spill_file: io.BufferedRandom = None
+        self.dropped: int = 0
+        self.error: BaseException = None
+        self.thread = threading.Thread(target=self._run, name="dw.tee", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        import pickle
+
+        write: Callable = self.write_
+        get: Callable = self.queue.get
+        try:
+            while True:
+                item: object = get()
+                if item is None:
+                    break
+                if self.error is not None:
+                    # keep draining the queue so that the pipeline is never blocked
+                    if not isinstance(item, list):
+                        item.close()
+                    continue
+                try:
+                    if isinstance(item, list):
+                        for obj in item:
+                            write(obj)
+                    else:
+                        with item:
+                            item.seek(0)
+                            while True:
+                                try:
+                                    batch: list = pickle.load(item)
+                                except EOFError:
+                                    break
+                                for obj in batch:
+                                    write(obj)
+                except BaseException as e:
+                    self.error = e
+        finally:
+            if self.close_ is not None:
+                try:
+                    self.close_()
+                except BaseException as e:
+                    self.error = self.error or e
+
+    def _put(self, batch: list) -> None:
+        import pickle, queue, tempfile
+
+        if self.error is not None:
+            raise self.error
+        if self.on_full == "block":
+            self.queue.put(batch)
+            return
+        if self.spill_file is None:
+            try:
+                self.queue.put_nowait(batch)
+                return
+            except queue.Full:
+                if self.on_full == "drop":
+                    self.dropped += len(batch)
+                    return
+                self.spill_file = tempfile.TemporaryFile(dir=self.temporary_directory)
+        pickle.dump(batch, self.spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            self.queue.put_nowait(self.spill_file)
+            self.spill_file = None
+        except queue.Full:
+            pass
+
+    def write(self, obj: object) -> None:
+        pending: list = self.pending
+        pending.append(obj)
+        if len(pending) >= self.batch_size:
+            self.pending = []
+            self._put(pending)
+
+    def close(self) -> None:
+        """
+        Hand the pending records to the writer thread and wait until it has written them.
+        """
+        try:
+            if self.pending and self.error is None:
+                self._put(self.pending)
+            if self.spill_file is not None:
+                self.queue.put(self.spill_file)
+            self.pending = []
+            self.spill_file = None
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+
+
 @monadic_function_returner
-def tee(target: object,
+def tee(*targets: object,
         e:str="utf-8", encoding:str="utf-8",
         a: bool=False, append: bool = False,
-        n: bool=False, ) -> Callable:
+        n: bool=False,
+        b: bool = False, binary: bool = False,
+        flush_size: int = None, flush_interval: float = None,
+        queue_size: int = None, on_full: str = "block",
+        T: str = None, temporary_directory: str = None) -> Callable:
     """
     Copy standard input to each FILE, and also to standard output.
       -a, --append              append to the given FILEs, do not overwrite
+      -b, --binary              open the FILEs (or the standard output for "-") as bytes sinks
+      -T, --temporary-directory=DIR  spill records for slow FILEs in DIR, not $TMPDIR
+    bytes records are written as is to bytes sinks, and decoded with encoding for text sinks.
+    FILEs named *.gz, *.bz2, *.xz or *.lzma are compressed with gzip, bzip2 or xz.
+
+    Records for io sinks are joined and written flush_size records at a time, and pending records are
+    also written once flush_interval seconds have passed. flush_size is 1024 by default for FILEs opened
+    by tee, and 1 for the standard output and io objects, so that they see each record as it passes.
+
+    With queue_size, FILEs, io objects and callables are written by a background thread each, through a
+    queue of at most queue_size records, so that a slow sink does not stall the pipeline until its queue
+    is full. Then on_full is "block" to wait for the sink, "drop" to discard the records for the sink,
+    or "spill" to keep them in a temporary file. Lists, sets and DEV_NULL are always written in place.
+    An exception raised while writing a sink is re-raised by the pipeline, at the latest when it finishes.
     """
     encoding = encoding or e
     append = append or a
+    binary = binary or b
+    temporary_directory = temporary_directory or T
 
     @pipeable()
     def _tee(iterable: Iterable) -> Iterable[object]:
-        import io
-
-        sink: Iterable = target
-        must_close = False
-        if isinstance(sink, str):
-            if sink == "-":
-                sink = sys.stdout
-            else:
-                must_close = True
-                if append:
-                    sink = io.open(sink, "at", encoding=encoding)
-                else:
-                    if os.path.exists(sink):
-                        os.remove(sink)
-                    sink = io.open(sink, "wt", encoding=encoding)
-
-        if sink is DEV_NULL:
-            for obj in iterable:
-                yield obj
-        elif isinstance(sink, Sequence):
-            if not append:
-                sink.clear()
-            for obj in iterable:
-                sink.append(obj)
-                yield obj
-        elif isinstance(sink, Set):
-            if not append:
-                sink.clear()
-            for obj in iterable:
-                sink.add(obj)
-                yield obj
-        elif isinstance(sink, io.TextIOBase):
-            # if isinstance(sink, typing.TextIO): => dont work
-            try:
+        writes: list = []
+        closers: list = []
+        queued_sinks: list = []
+        try:
+            for target in targets:
+                write, close = _open_sink(target, encoding, append, n, binary, flush_size, flush_interval)
+                if write is None:
+                    continue
+                if queue_size is not None and (close is not None or not isinstance(target, (Sequence, Set))):
+                    queued_sink = _QueuedSink(write, close, queue_size, on_full, temporary_directory)
+                    queued_sinks.append(queued_sink)
+                    write, close = queued_sink.write, queued_sink.close
+                writes.append(write)
+                if close is not None:
+                    closers.append(close)
+
+            if not writes:
                 for obj in iterable:
-                    sink.write(str(obj))
-                    # sink.write(os.linesep)
-                    if not n:
-                        sink.write("\n")  # see https://docs.python.org/en/3/library/os.html#os.linesep
                     yield obj
-            finally:
-                if must_close:
-                    sink.close()
-        elif isinstance(sink, io.BufferedWriter) or isinstance(sink, io.BytesIO) \
-        or isinstance(sink, io.BufferedRandom) or isinstance(sink, io.FileIO):
-            # elif isinstance(sink, typing.BinaryIO): => dont work
-            try:
-                linesep_b: bytes = bytes("\n", "utf-8")  # see https://docs.python.org/en/3/library/os.html#os.linesep
+            elif len(writes) == 1:
+                write: Callable = writes[0]
                 for obj in iterable:
-                    sink.write(bytes(str(obj), "utf-8"))
-                    if not n:
-                        sink.write(linesep_b)
+                    write(obj)
                     yield obj
-            finally:
-                if must_close:
-                    sink.close()
-        elif isinstance(sink, Callable):
-            for obj in iterable:
-                sink(obj)
-                yield obj
-        else:
-            raise ValueError(f"sink=={sink} is not instance of either io, Sequence, or Set")
-
-    return _tee()
+            else:
+                for obj in iterable:
+                    for write in writes:
+                        write(obj)
+                    yield obj
+        finally:
+            error: BaseException = None
+            for close in closers:
+                try:
+                    close()
+                except Exception as e:
+                    error = error or e
+            if error is not None:
+                raise error
+
+        for queued_sink in queued_sinks:
+            if queued_sink.dropped:
+                import logging
+                logging.getLogger(__name__).warning("tee dropped %d records for a slow sink", queued_sink.dropped)
+        for queued_sink in queued_sinks:
+            if queued_sink.error is not None:
+                raise queued_sink.error
+
+    if len(targets) > 1 or queue_size is not None:
+        pass
+    elif not targets or targets[0] is DEV_NULL:
+        _tee.record_steps = ()
+    elif isinstance(targets[0], str) or isinstance(targets[0], io.IOBase):
+        pass
+    elif isinstance(targets[0], MutableSequence):
+        _tee.record_steps = (("tee", (targets[0].append, None if append else targets[0].clear)),)
+    elif isinstance(targets[0], MutableSet):
+        _tee.record_steps = (("tee", (targets[0].add, None if append else targets[0].clear)),)
+    elif isinstance(targets[0], Callable):
+        _tee.record_steps = (("tee", (targets[0], None)),)
+    # a cached output would be replayed without writing the sinks
+    _tee.cacheable = False
+    return _tee
 
 
 ################################################################################
@@ -352,26 +1162,39 @@ def _ri_head(n: int = 5) -> Callable:
 
 @monadic_function_returner
 def head(n: int = 5):
+    """
+    Print the first n records, and stop reading after the n-th.
+    """
     if n < 0:
         raise ValueError("n must be non negative value.")
 
     @pipeable()
     def _head(iterable: Iterable) -> Iterable[object]:
+        if n == 0:
+            return
         idx: int = 0
         for obj in iterable:
-            if idx < n:
-                idx += 1
-                yield obj
-            else:
+            yield obj
+            idx += 1
+            if idx >= n:
+                # do not wait for another record, e.g. of a followed file
                 break
 
+    _head.head_n = n
+    _head.record_steps = (("head", n),)
     return _head
 
 
 @monadic_function_returner
-def tail(n: int = 5) -> Callable:
+def tail(n: int = 5, f: bool = False, follow: bool = False) -> Callable:
+    """
+    Print the last n records.
+      -f, --follow              after cat of local files, print the last n lines and then the lines appended
+                                to the files as they grow, see cat(..., follow=True). Otherwise ignored.
+    """
     if n < 0:
         raise ValueError("n must be non negative value.")
+    follow = follow or f
 
     @pipeable()
     def _tail(iterable: Iterable) -> Iterable[object]:
@@ -386,9 +1209,14 @@ def tail(n: int = 5) -> Callable:
             count += 1
         idx: int = 0
         m: int = min(n, count)
+        _note_buffered(m)
         for idx in range(m):
             yield buffer[(pos + idx) % m]
 
+    _tail.tail_n = n
+    _tail.follows = follow
+    # a followed file never ends, so its output would never be cached
+    _tail.cacheable = not follow
     return _tail
 
 
@@ -397,40 +1225,200 @@ _original_reversed = reversed
 
 @monadic_function_returner
 def reversed() -> Callable:
+    """
+    Print records in reverse order.
+    """
 
     @pipeable()
     def _reversed(iterable: Iterable) -> Iterable[object]:
-        return _original_reversed(iterable)
+        if isinstance(iterable, Sequence):
+            yield from _original_reversed(iterable)
+        else:
+            buffer: list = list(iterable)
+            _note_buffered(len(buffer))
+            yield from _original_reversed(buffer)
 
+    _reversed.reverses = True
     return _reversed
 
 
+def _random_generator(seed: object) -> object:
+    import random
+    return random if seed is None else random.Random(seed)
+
+
 @monadic_function_returner
-def shuffle() -> Callable:
+def shuffle(seed: object = None,
+            S: int = None, buffer_size: int = None,
+            T: str = None, temporary_directory: str = None) -> Callable:
+    """
+    Shuffle records.
+      seed                      seed of the random generator. The random module is used if None.
+      -S, --buffer-size=SIZE    keep at most SIZE records in memory. Larger inputs are scattered
+                                into temporary files at random, and each of them is shuffled in turn.
+      -T, --temporary-directory=DIR
+                                use DIR for temporaries, not $TMPDIR or /tmp
+    """
+    buffer_size = buffer_size or S
+    temporary_directory = temporary_directory or T
+    if buffer_size is not None and buffer_size < 1:
+        raise ValueError("buffer_size must be positive value.")
 
     @pipeable()
     def _shuffle(iterable: Iterable) -> Iterable[object]:
-        import random
-        buffer: list = [x for x in iterable]
-        return random.sample(buffer, k=len(buffer))
+        rng = _random_generator(seed)
+        if buffer_size is None:
+            buffer: list = [x for x in iterable]
+            _note_buffered(len(buffer))
+            rng.shuffle(buffer)
+            yield from buffer
+        else:
+            yield from _external_shuffle(iterable, rng, buffer_size, temporary_directory)
 
+    _shuffle.cacheable = seed is not None
     return _shuffle
 
 
+def _external_shuffle(iterable: Iterable, rng: object, buffer_size: int, temporary_directory: str) -> Iterable[object]:
+    # Scattering records into buckets uniformly at random and shuffling each bucket gives a uniform permutation.
+    # Buckets that are still larger than buffer_size are shuffled in the same way recursively.
+    import itertools, pickle, tempfile
+
+    iterator = iter(iterable)
+    buffer: list = list(itertools.islice(iterator, buffer_size + 1))
+    _note_buffered(len(buffer))
+    if len(buffer) <= buffer_size:
+        rng.shuffle(buffer)
+        yield from buffer
+        return
+
+    n_buckets: int = max(2, min(256, buffer_size))
+    chunk_size: int = max(1, buffer_size // n_buckets)
+    buckets: list = []
+    try:
+        for _ in range(n_buckets):
+            buckets.append(tempfile.TemporaryFile(dir=temporary_directory))
+        pending: list = [[] for _ in range(n_buckets)]
+        sizes: list = [0] * n_buckets
+        for obj in itertools.chain(buffer, iterator):
+            idx: int = rng.randrange(n_buckets)
+            pending[idx].append(obj)
+            sizes[idx] += 1
+            if len(pending[idx]) >= chunk_size:
+                pickle.dump(pending[idx], buckets[idx], protocol=pickle.HIGHEST_PROTOCOL)
+                pending[idx] = []
+        del buffer
+        for idx in range(n_buckets):
+            if pending[idx]:
+                pickle.dump(pending[idx], buckets[idx], protocol=pickle.HIGHEST_PROTOCOL)
+            pending[idx] = None
+
+        for idx, bucket in enumerate(buckets):
+            bucket.seek(0)
+            if sizes[idx] <= buffer_size:
+                records: list = list(_unspill(bucket))
+                rng.shuffle(records)
+                yield from records
+            else:
+                yield from _external_shuffle(_unspill(bucket), rng, buffer_size, temporary_directory)
+            bucket.close()
+    finally:
+        for bucket in buckets:
+            bucket.close()
+
+
 @monadic_function_returner
-def sample(k: int, counts=None) -> Callable:
+def sample(k: int, counts=None, seed: object = None, weight: Callable = None) -> Callable:
+    """
+    Choose k records at random without replacement, in random order.
+    The input is read in a single pass keeping only k records in memory (reservoir sampling, Algorithm L).
+      seed                      seed of the random generator. The random module is used if None.
+      weight                    function that returns the non negative weight of a record. Records are
+                                chosen with probability proportional to their weight (Efraimidis-Spirakis A-Res).
+      counts                    repeated records as random.sample. This keeps the whole input in memory.
+    A ValueError is raised if the input has less than k records, as random.sample does.
+    """
+    if k < 0:
+        raise ValueError("k must be non negative value.")
 
     @pipeable()
     def _sample(iterable: Iterable) -> Iterable[object]:
-        import random
-        buffer: list = [x for x in iterable]
-        return random.sample(buffer, k=k, counts=counts)
+        rng = _random_generator(seed)
+        if counts is not None:
+            buffer: list = [x for x in iterable]
+            _note_buffered(len(buffer))
+            yield from rng.sample(buffer, k=k, counts=counts)
+            return
+        if weight is not None:
+            reservoir: list = _weighted_reservoir_sample(iterable, k, rng, weight)
+        else:
+            reservoir: list = _reservoir_sample(iterable, k, rng)
+        _note_buffered(len(reservoir))
+        rng.shuffle(reservoir)
+        yield from reservoir
 
+    _sample.cacheable = seed is not None
     return _sample
 
 
+def _open_unit_random(rng: object) -> float:
+    # random() is in [0, 1) but logarithms need (0, 1)
+    while True:
+        u: float = rng.random()
+        if u > 0.0:
+            return u
+
+
+def _reservoir_sample(iterable: Iterable, k: int, rng: object) -> list:
+    # Li, "Reservoir-Sampling Algorithms of Time Complexity O(n(1 + log(N/n)))", Algorithm L
+    import itertools, math
+
+    iterator = iter(iterable)
+    reservoir: list = list(itertools.islice(iterator, k))
+    if len(reservoir) < k:
+        raise ValueError("Sample larger than population or is negative")
+    if k == 0:
+        return reservoir
+    w: float = math.exp(math.log(_open_unit_random(rng)) / k)
+    while True:
+        skip: int = int(math.log(_open_unit_random(rng)) / math.log1p(-w))
+        for obj in itertools.islice(iterator, skip, skip + 1):
+            reservoir[rng.randrange(k)] = obj
+            break
+        else:
+            return reservoir
+        w *= math.exp(math.log(_open_unit_random(rng)) / k)
+
+
+def _weighted_reservoir_sample(iterable: Iterable, k: int, rng: object, weight: Callable) -> list:
+    # Efraimidis and Spirakis, "Weighted random sampling with a reservoir", Algorithm A-Res.
+    # Records with the k largest u ** (1 / weight) are chosen, compared as log(u) / weight.
+    import heapq, math
+
+    heap: list = []
+    count: int = 0
+    for idx, obj in enumerate(iterable):
+        count += 1
+        w: float = weight(obj)
+        if w < 0:
+            raise ValueError(f"weight of {obj!r} is negative")
+        if w == 0:
+            continue
+        item: tuple = (math.log(_open_unit_random(rng)) / w, idx, obj)
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    if count < k:
+        raise ValueError("Sample larger than population or is negative")
+    if len(heap) < k:
+        raise ValueError("Fewer than k records have positive weight")
+    return [obj for _, _, obj in heap]
+
+
 @monadic_function_returner
-def uniq(g:bool=False, globally:bool=False) -> Callable:
+def uniq(g:bool=False, globally:bool=False,
+         approximate: bool = False, capacity: int = 1000000, error_rate: float = 0.01) -> Callable:
     """
     Usage: uniq [OPTION]... [INPUT [OUTPUT]]
     Filter adjacent matching lines from INPUT (or standard input),
@@ -453,11 +1441,28 @@ def uniq(g:bool=False, globally:bool=False) -> Callable:
     -u, --unique          only print unique lines
     -z, --zero-terminated     line delimiter is NUL, not newline
     -w, --check-chars=N   compare no more than N characters in lines
+
+    -g, --globally        eliminate all duplicated records, not only adjacent ones
+        --approximate     with -g, remember records in a Bloom filter of fixed size instead of a dict.
+                          No duplicate is printed, but while at most capacity distinct records are seen,
+                          each distinct record is dropped by mistake with probability at most error_rate.
     """
 
     globally = globally or g
 
-    if globally:
+    if globally and approximate:
+
+        @pipeable()
+        def _uniq(iterable: Iterable) -> Iterable[object]:
+            from dw.sketch import BloomFilter
+            bloom_filter = BloomFilter(capacity, error_rate)
+            for obj in iterable:
+                if not bloom_filter.add(obj):
+                    yield obj
+
+        _uniq.parallel_split = (_uniq, _uniq)
+        return _uniq
+    elif globally:
 
         @pipeable()
         def _uniq(iterable: Iterable) -> Iterable[object]:
@@ -465,9 +1470,11 @@ def uniq(g:bool=False, globally:bool=False) -> Callable:
             d = defaultdict(int)
             for obj in iterable:
                 d[obj] += 1
+            _note_buffered(len(d))
             for obj in d.keys():
                 yield obj
 
+        _uniq.parallel_split = (_uniq, _uniq)
         return _uniq
     else:
 
@@ -481,22 +1488,114 @@ def uniq(g:bool=False, globally:bool=False) -> Callable:
 
         return _uniq
 
+
+@monadic_function_returner
+def uniq_all(approximate: bool = False, capacity: int = 1000000, error_rate: float = 0.01) -> Callable:
+    """
+    Same as uniq(globally=True).
+    """
+    return uniq(globally=True, approximate=approximate, capacity=capacity, error_rate=error_rate)
+
 _original_sorted = sorted
 
 
 @monadic_function_returner
-def sorted(key: Callable = None, reverse: bool = False) -> Callable:
+def sorted(key: Callable = None, reverse: bool = False,
+           S: int = None, buffer_size: int = None,
+           T: str = None, temporary_directory: str = None) -> Callable:
+    """
+    Sort records in the same way as the builtin sorted.
+      -S, --buffer-size=SIZE    keep at most SIZE records in memory. Larger inputs are
+                                sorted in runs of SIZE records which are spilled to
+                                temporary files and merged.
+      -T, --temporary-directory=DIR
+                                use DIR for temporaries, not $TMPDIR or /tmp
+    """
+    buffer_size = buffer_size or S
+    temporary_directory = temporary_directory or T
+    if buffer_size is not None and buffer_size < 1:
+        raise ValueError("buffer_size must be positive value.")
 
     @pipeable()
     def _sorted(iterable: Iterable) -> Iterable[object]:
-        return _original_sorted(iterable, key=key, reverse=reverse)
+        if buffer_size is None:
+            buffer: list = _original_sorted(iterable, key=key, reverse=reverse)
+            _note_buffered(len(buffer))
+            yield from buffer
+        else:
+            yield from _external_sorted(iterable, key, reverse, buffer_size, temporary_directory)
 
+    _sorted.sort_spec = (key, reverse)
     return _sorted
 
+
+def _external_sorted(iterable: Iterable, key: Callable, reverse: bool, buffer_size: int, temporary_directory: str) -> Iterable[object]:
+    import heapq, itertools
+
+    iterator = iter(iterable)
+    spilled_runs: list = []
+    try:
+        while True:
+            run: list = _original_sorted(itertools.islice(iterator, buffer_size), key=key, reverse=reverse)
+            _note_buffered(len(run))
+            if len(run) < buffer_size:
+                break
+            spilled_runs.append(_spill(run, temporary_directory))
+            del run
+        if not spilled_runs:
+            yield from run
+        else:
+            # heapq.merge prefers earlier iterables on ties, so the merge is stable
+            # as long as the runs are given in input order.
+            runs = [_unspill(f) for f in spilled_runs] + [run]
+            del run
+            yield from heapq.merge(*runs, key=key, reverse=reverse)
+    finally:
+        for f in spilled_runs:
+            f.close()
+
 sort = sorted
 
 
-import functools as _functools
+@monadic_function_returner
+def topk(n: int = 5, key: Callable = None, reverse: bool = False, last: bool = False) -> Callable:
+    """
+    Select the first n records of sorted(key=key, reverse=reverse), or the last n records if last is True,
+    keeping only n records in a heap.
+    The output is the same as sorted(key=key, reverse=reverse) | head(n) (or | tail(n)), including the order of ties.
+    """
+    if n < 0:
+        raise ValueError("n must be non negative value.")
+
+    @pipeable()
+    def _topk(iterable: Iterable) -> Iterable[object]:
+        import heapq
+
+        if not last:
+            # nsmallest and nlargest are documented to be equivalent to sorted(...)[:n]
+            if reverse:
+                selected: list = heapq.nlargest(n, iterable, key=key)
+            else:
+                selected: list = heapq.nsmallest(n, iterable, key=key)
+            _note_buffered(len(selected))
+            yield from selected
+            return
+
+        # Ties are ordered by input position in the sorted output, so the last n records are
+        # the n largest (key, idx) pairs, or the n smallest (key, -idx) pairs if reverse.
+        if key is None:
+            decorated = ((obj, idx, obj) for idx, obj in enumerate(iterable))
+        else:
+            decorated = ((key(obj), idx, obj) for idx, obj in enumerate(iterable))
+        if reverse:
+            selected: list = heapq.nsmallest(n, ((k, -idx, obj) for k, idx, obj in decorated))
+        else:
+            selected: list = heapq.nlargest(n, decorated)
+        _note_buffered(len(selected))
+        for _, _, obj in _original_reversed(selected):
+            yield obj
+
+    return _topk
 
 
 def _compare(a, b) -> int:
@@ -508,18 +1607,384 @@ def _compare(a, b) -> int:
     return -1 if a < b else 1
 
 
-none_aware_key_func = _functools.cmp_to_key(_compare)
+def none_aware_key_func(obj: object) -> tuple:
+    """
+    Sort key under which None is greater than any other object, e.g. sorted(records, key=dw.none_aware_key_func).
+    Records are ordered as by functools.cmp_to_key(_compare), but compared as (is None, obj) tuples in C
+    instead of by a Python function call per comparison.
+    """
+    return (obj is None, obj)
+
+
+class _Descending(object):
+    """
+    Wrapper of a value of a "desc" column of columns_key, which compares in reverse order.
+    """
+    __slots__ = ("obj",)
+
+    def __init__(self, obj: object):
+        self.obj: object = obj
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return other.obj < self.obj
+
+    def __gt__(self, other: "_Descending") -> bool:
+        return self.obj < other.obj
+
+    def __eq__(self, other: "_Descending") -> bool:
+        return self.obj == other.obj
+
+
+def _parse_column(column: object) -> tuple:
+    """
+    Return (get_f, descending, nones_first) of a column of columns_key.
+    """
+    import operator
+
+    if isinstance(column, tuple):
+        field, order, nones = column + ("asc", None)[len(column) - 1:]
+    else:
+        field, order, nones = column, "asc", None
+    if order not in ("asc", "desc"):
+        raise ValueError(f"order=={order!r} is neither 'asc' nor 'desc'")
+    descending: bool = order == "desc"
+    if nones is None:
+        nones = "first" if descending else "last"
+    if nones not in ("first", "last"):
+        raise ValueError(f"nones=={nones!r} is neither 'first' nor 'last'")
+    get_f: Callable = field if isinstance(field, Callable) else operator.itemgetter(field)
+    return get_f, descending, nones == "first"
+
+
+def columns_key(*columns: object) -> Callable:
+    """
+    Sort key of records by columns, e.g. sorted(rows, key=dw.columns_key(2, ("name", "desc", "last"))).
+    A column is a field, i.e. an index or a key of records or a function of a record, or a tuple (field, order)
+    or (field, order, nones), where order is "asc" (default) or "desc" and nones is "first" or "last".
+    By default None is greater than any other value as in none_aware_key_func: last in "asc" columns and
+    first in "desc" columns.
+    Values in "desc" columns are wrapped in an object that compares in reverse by a Python call, so that they
+    compare as in "asc" columns, e.g. ints with Decimals. sort_by sorts in stable passes instead, which needs
+    no wrapper.
+    """
+    specs: list = [_parse_column(column) for column in columns]
+
+    def key(record: object) -> tuple:
+        k: list = []
+        for get_f, descending, nones_first in specs:
+            value: object = get_f(record)
+            if value is None:
+                k.append(not nones_first)
+                k.append(None)
+            else:
+                k.append(nones_first)
+                k.append(_Descending(value) if descending else value)
+        return tuple(k)
+
+    return key
+
+
+def _column_pass_key(specs: list) -> Callable:
+    """
+    Sort key of one pass of sort_by over columns of the same order.
+    The flag of None is ordered before the flags of values if None is first in the sorted output.
+    """
+    flags: list = [(nones_first == descending, nones_first != descending) for _, descending, nones_first in specs]
+    if len(specs) == 1:
+        get_f: Callable = specs[0][0]
+        none_flag, value_flag = flags[0]
+
+        def key(record: object) -> tuple:
+            value: object = get_f(record)
+            return (none_flag, None) if value is None else (value_flag, value)
+
+        return key
+
+    get_fs: list = [get_f for get_f, _, _ in specs]
+
+    def key(record: object) -> tuple:
+        k: list = []
+        for get_f, (none_flag, value_flag) in zip(get_fs, flags):
+            value: object = get_f(record)
+            if value is None:
+                k.append(none_flag)
+                k.append(None)
+            else:
+                k.append(value_flag)
+                k.append(value)
+        return tuple(k)
+
+    return key
+
+
+@monadic_function_returner
+def sort_by(*columns: object,
+            S: int = None, buffer_size: int = None,
+            T: str = None, temporary_directory: str = None) -> Callable:
+    """
+    Sort records by columns, see columns_key for columns and dw.sorted for the options.
+    In memory, columns of the same order are sorted in one stable pass, from the last columns to the first.
+    """
+    buffer_size = buffer_size or S
+    temporary_directory = temporary_directory or T
+    key: Callable = columns_key(*columns)
+    if buffer_size is not None:
+        return sorted(key=key, buffer_size=buffer_size, temporary_directory=temporary_directory)
+
+    specs: list = [_parse_column(column) for column in columns]
+    passes: list = []
+    for spec in specs:
+        if passes and passes[-1][0][1] == spec[1]:
+            passes[-1].append(spec)
+        else:
+            passes.append([spec])
+
+    @pipeable()
+    def _sort_by(iterable: Iterable) -> Iterable[object]:
+        records: list = list(iterable)
+        _note_buffered(len(records))
+        for pass_specs in _original_reversed(passes):
+            records.sort(key=_column_pass_key(pass_specs), reverse=pass_specs[0][1])
+        yield from records
+
+    _sort_by.sort_spec = (key, False)
+    return _sort_by
+
+################################################################################
+
+_JOIN_HOWS: tuple = ("inner", "left", "right", "outer")
+# partitions of a grace hash join, and the depth at which skewed partitions are joined in memory anyway
+_JOIN_PARTITIONS: int = 16
+_JOIN_MAX_DEPTH: int = 4
+
+
+@monadic_function_returner
+def join(other: object, key: Callable = None, other_key: Callable = None, how: str = "inner",
+         merge: bool = False,
+         S: int = None, buffer_size: int = None,
+         T: str = None, temporary_directory: str = None) -> Callable:
+    """
+    Join records with the records of other, an iterable or a file, and print (record, other record) pairs
+    of equal keys. key(record) is the key of a record, the record itself by default, and other_key that
+    of an other record (default key).
+      how                       inner: pairs with both records. left, right, outer: also (record, None),
+                                (None, other record), or both, for records without a match.
+      merge                     the inputs are sorted by key, so join them in one pass as sort-merge join,
+                                keeping only the records of one key. A ValueError is raised if they are not.
+      -S, --buffer-size=SIZE    keep at most SIZE records in the hash table. Larger inputs are partitioned
+                                by hash of key into temporary files, which are joined in turn (grace hash join).
+      -T, --temporary-directory=DIR
+                                use DIR for temporaries, not $TMPDIR or /tmp
+    Otherwise the hash table is built from other and the records stream through it, so other should be
+    the smaller input. Only if both inputs are sequences, e.g. lists and not generators or files, whose
+    sizes are known up front, is it built from the records when they are fewer. Pairs are printed in the
+    order of the input that is not in the hash table. Partitions are printed one after another.
+    """
+    if how not in _JOIN_HOWS:
+        raise ValueError(f"how must be one of {', '.join(_JOIN_HOWS)}.")
+    buffer_size = buffer_size or S
+    temporary_directory = temporary_directory or T
+    key = key or _identity
+    other_key = other_key or key
+    keep_left: bool = how in ("left", "outer")
+    keep_right: bool = how in ("right", "outer")
+    source_files: tuple = ()
+    if _is_file_name(other):
+        source_files = (other,)
+        other = cat(other)
+
+    @pipeable()
+    def _join(iterable: Iterable) -> Iterable[tuple]:
+        if merge:
+            yield from _merge_join(iterable, other, key, other_key, keep_left, keep_right)
+            return
+        if isinstance(iterable, Sequence) and isinstance(other, Sequence) and len(iterable) < len(other):
+            yield from _hash_join(iterable, key, keep_left, other, other_key, keep_right, True,
+                                  buffer_size, temporary_directory, 0)
+        else:
+            yield from _hash_join(other, other_key, keep_right, iterable, key, keep_left, False,
+                                  buffer_size, temporary_directory, 0)
+
+    _join.source_files = source_files
+    _join.cacheable = STDIO not in source_files
+    return _join
+
+
+def _identity(obj: object) -> object:
+    return obj
+
+
+def _hash_join(build: Iterable, build_key: Callable, keep_build: bool,
+               probe: Iterable, probe_key: Callable, keep_probe: bool, build_is_left: bool,
+               buffer_size: int, temporary_directory: str, depth: int) -> Iterable[tuple]:
+    """
+    Yield the pairs of a hash join of build and probe, as (left, right) according to build_is_left.
+    """
+    import itertools
+
+    table: dict = {}
+    build_iterator = iter(build)
+    size: int = 0
+    for obj in build_iterator:
+        k: object = build_key(obj)
+        records: list = table.get(k)
+        if records is None:
+            table[k] = [obj]
+        else:
+            records.append(obj)
+        size += 1
+        if buffer_size is not None and size > buffer_size and depth < _JOIN_MAX_DEPTH:
+            rest: Iterable = itertools.chain((obj for records in table.values() for obj in records), build_iterator)
+            yield from _grace_join(rest, build_key, keep_build, probe, probe_key, keep_probe, build_is_left,
+                                   buffer_size, temporary_directory, depth)
+            return
+    _note_buffered(size)
+
+    matched: set = set()
+    for obj in probe:
+        k: object = probe_key(obj)
+        records: list = table.get(k)
+        if records is None:
+            if keep_probe:
+                yield (None, obj) if build_is_left else (obj, None)
+            continue
+        if keep_build:
+            matched.add(k)
+        for build_obj in records:
+            yield (build_obj, obj) if build_is_left else (obj, build_obj)
+    if keep_build:
+        for k, records in table.items():
+            if k not in matched:
+                for build_obj in records:
+                    yield (build_obj, None) if build_is_left else (None, build_obj)
+
+
+def _partition(iterable: Iterable, key: Callable, depth: int, temporary_directory: str) -> list:
+    """
+    Scatter records into _JOIN_PARTITIONS temporary files by hash of key, salted by depth so that
+    a partition is split again at the next depth. Return [(file, number of records)].
+    """
+    import pickle, tempfile
+
+    files: list = [tempfile.TemporaryFile(dir=temporary_directory) for _ in range(_JOIN_PARTITIONS)]
+    chunks: list = [[] for _ in range(_JOIN_PARTITIONS)]
+    counts: list = [0 for _ in range(_JOIN_PARTITIONS)]
+    try:
+        for obj in iterable:
+            idx: int = hash((depth, key(obj))) % _JOIN_PARTITIONS
+            chunk: list = chunks[idx]
+            chunk.append(obj)
+            if len(chunk) >= _SPILL_CHUNK_SIZE:
+                pickle.dump(chunk, files[idx], protocol=pickle.HIGHEST_PROTOCOL)
+                counts[idx] += len(chunk)
+                chunk.clear()
+        for idx, chunk in enumerate(chunks):
+            if chunk:
+                pickle.dump(chunk, files[idx], protocol=pickle.HIGHEST_PROTOCOL)
+                counts[idx] += len(chunk)
+            files[idx].seek(0)
+    except BaseException:
+        for f in files:
+            f.close()
+        raise
+    return list(zip(files, counts))
+
+
+def _grace_join(build: Iterable, build_key: Callable, keep_build: bool,
+                probe: Iterable, probe_key: Callable, keep_probe: bool, build_is_left: bool,
+                buffer_size: int, temporary_directory: str, depth: int) -> Iterable[tuple]:
+    build_partitions: list = _partition(build, build_key, depth, temporary_directory)
+    try:
+        probe_partitions: list = _partition(probe, probe_key, depth, temporary_directory)
+        try:
+            for (build_f, build_count), (probe_f, probe_count) in zip(build_partitions, probe_partitions):
+                # the smaller partition goes to the hash table
+                if probe_count < build_count:
+                    yield from _hash_join(_unspill(probe_f), probe_key, keep_probe, _unspill(build_f), build_key, keep_build,
+                                          not build_is_left, buffer_size, temporary_directory, depth + 1)
+                else:
+                    yield from _hash_join(_unspill(build_f), build_key, keep_build, _unspill(probe_f), probe_key, keep_probe,
+                                          build_is_left, buffer_size, temporary_directory, depth + 1)
+        finally:
+            for f, _ in probe_partitions:
+                f.close()
+    finally:
+        for f, _ in build_partitions:
+            f.close()
+
+
+def _merge_join(left: Iterable, right: Iterable, left_key: Callable, right_key: Callable,
+                keep_left: bool, keep_right: bool) -> Iterable[tuple]:
+    import itertools
+
+    _end = object()
+
+    def groups(iterable: Iterable, key: Callable, side: str) -> Iterable[tuple]:
+        last: object = _end
+        for k, records in itertools.groupby(iterable, key=key):
+            if last is not _end and k < last:
+                raise ValueError(f"join with merge needs the {side} records sorted by key, but {k!r} follows {last!r}.")
+            last = k
+            yield k, records
+
+    left_groups = groups(left, left_key, "left")
+    right_groups = groups(right, right_key, "right")
+    left_k, left_records = next(left_groups, (_end, None))
+    right_k, right_records = next(right_groups, (_end, None))
+    while left_k is not _end and right_k is not _end:
+        if left_k < right_k:
+            if keep_left:
+                for obj in left_records:
+                    yield obj, None
+            left_k, left_records = next(left_groups, (_end, None))
+        elif right_k < left_k:
+            if keep_right:
+                for obj in right_records:
+                    yield None, obj
+            right_k, right_records = next(right_groups, (_end, None))
+        else:
+            right_list: list = list(right_records)
+            _note_buffered(len(right_list))
+            for obj in left_records:
+                for right_obj in right_list:
+                    yield obj, right_obj
+            left_k, left_records = next(left_groups, (_end, None))
+            right_k, right_records = next(right_groups, (_end, None))
+    while keep_left and left_k is not _end:
+        for obj in left_records:
+            yield obj, None
+        left_k, left_records = next(left_groups, (_end, None))
+    while keep_right and right_k is not _end:
+        for obj in right_records:
+            yield None, obj
+        right_k, right_records = next(right_groups, (_end, None))
+
 
 _original_filter = filter
 
 
 @monadic_function_returner
-def filter(condition_f: Callable) -> Callable:
+def filter(condition_f: Callable,
+           workers: int = None, batch_size: int = 1024, ordered: bool = True, executor: str = "process") -> Callable:
+    """
+    Pass records for which condition_f returns true.
+    See dw.map for workers, batch_size, ordered and executor.
+    """
+    if workers is not None:
+        import functools
+
+        @pipeable()
+        def _filter(iterable: Iterable) -> Iterable[object]:
+            return _parallel_batches(iterable, functools.partial(_filter_batch, condition_f), workers, batch_size, ordered, executor)
+
+        return _filter
 
     @pipeable()
     def _filter(iterable: Iterable) -> Iterable[object]:
         return _original_filter(condition_f, iterable)
 
+    _filter.record_steps = (("filter", condition_f),)
+    _filter.parallel_split = (_filter, None)
     return _filter
 
 
@@ -527,69 +1992,500 @@ _original_map = map
 
 
 @monadic_function_returner
-def map(condition_f: Callable) -> Callable:
+def map(condition_f: Callable,
+        workers: int = None, batch_size: int = 1024, ordered: bool = True, executor: str = "process") -> Callable:
+    """
+    Convert each record with condition_f.
+
+    If workers is given, batches of batch_size records are converted in a pool of workers processes,
+    started by the default method of multiprocessing if executor is "process" (default) or forked if
+    it is "fork", or in a pool of workers threads if executor is "thread". condition_f must be
+    picklable to be sent to processes, so use a module level function rather than a lambda. At most
+    2 * workers batches are in flight, so upstream is not drained faster than downstream consumes. If
+    ordered is False, batches are yielded in the order they finish.
+    """
+    if workers is not None:
+        import functools
+
+        @pipeable()
+        def _map(iterable: Iterable) -> Iterable[object]:
+            return _parallel_batches(iterable, functools.partial(_map_batch, condition_f), workers, batch_size, ordered, executor)
+
+        return _map
 
     @pipeable()
     def _map(iterable: Iterable) -> Iterable[object]:
         return _original_map(condition_f, iterable)
 
+    _map.record_steps = (("map", condition_f),)
+    _map.parallel_split = (_map, None)
     return _map
 
 
 ################################################################################
+# Batch functions are module level so that they can be pickled for process pools.
+# They receive the index of the first record of the batch and the batch.
+
+
+def _map_batch(condition_f: Callable, start: int, batch: list) -> list:
+    return list(_original_map(condition_f, batch))
+
+
+def _filter_batch(condition_f: Callable, start: int, batch: list) -> list:
+    return list(_original_filter(condition_f, batch))
+
 
+def _grep_batch(match_f: Callable, line_number: bool, start: int, batch: list) -> list:
+    if line_number:
+        return [[idx, obj] for idx, obj in enumerate(batch, start) if match_f(obj)]
+    return [obj for obj in batch if match_f(obj)]
 
 
+def _parallel_batches(iterable: Iterable, batch_f: Callable, workers: int, batch_size: int, ordered: bool, executor: str) -> Iterable[object]:
+    import collections, concurrent.futures, itertools
+
+    if workers < 1:
+        raise ValueError("workers must be positive value.")
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive value.")
+    if executor == "process":
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    elif executor == "fork":
+        import multiprocessing
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+    elif executor == "thread":
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f"executor=={executor} is none of process, fork and thread")
+
+    iterator = iter(iterable)
+    max_in_flight: int = 2 * workers
+    in_flight = collections.deque() if ordered else set()
+    start: int = 0
+    exhausted: bool = False
+
+    def _submit() -> None:
+        nonlocal start, exhausted
+        while not exhausted and len(in_flight) < max_in_flight:
+            batch: list = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                exhausted = True
+                return
+            future = pool.submit(batch_f, start, batch)
+            start += len(batch)
+            if ordered:
+                in_flight.append(future)
+            else:
+                in_flight.add(future)
+
+    try:
+        _submit()
+        while in_flight:
+            if ordered:
+                done: list = [in_flight.popleft()]
+            else:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                in_flight.difference_update(done)
+            results: list = [future.result() for future in done]
+            _submit()
+            for result in results:
+                yield from result
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+################################################################################
+
+
+
+
+class _AhoCorasick(object):
+    """
+    Aho-Corasick automaton that tells whether any of the literal patterns occurs in a text
+    in a single pass over the text, whatever the number of patterns is.
+    """
+
+    def __init__(self, patterns: list):
+        import collections
+
+        self.goto: list = [{}]
+        self.fail: list = [0]
+        self.out: list = [False]
+        for pattern in patterns:
+            state: int = 0
+            for c in pattern:
+                next_state: int = self.goto[state].get(c)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(False)
+                    self.goto[state][c] = next_state
+                state = next_state
+            self.out[state] = True
+
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state: int = queue.popleft()
+            for c, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state: int = self.fail[state]
+                while fail_state and c not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(c, 0)
+                self.out[next_state] = self.out[next_state] or self.out[self.fail[next_state]]
+
+    def search(self, text: Sequence) -> bool:
+        goto, fail, out = self.goto, self.fail, self.out
+        if out[0]:
+            return True
+        state: int = 0
+        for c in text:
+            next_state: int = goto[state].get(c)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(c)
+            if next_state is not None:
+                state = next_state
+                if out[state]:
+                    return True
+        return False
+
+
+# Fixed strings are matched with an Aho-Corasick automaton from this number of patterns,
+# and with an alternation of the escaped patterns below it.
+_AHO_CORASICK_MIN_PATTERNS: int = 512
+
+
+class _GrepMatcher(object):
+    """
+    Tell whether a record is selected by grep. This is a class so that it can be pickled for process pools.
+
+    A record is selected if any of the patterns matches, or with invert_match, if any of the patterns does not match.
+    Where possible, all the patterns are searched at once, either as a single alternation or,
+    for many fixed strings, with an Aho-Corasick automaton. Otherwise each pattern is searched in turn.
+    """
+
+    def __init__(self, patterns: list, flags: int, invert_match: bool, fixed_strings: bool = False):
+        import re
+
+        regex_patterns: list = [re.escape(p) for p in patterns] if fixed_strings else list(patterns)
+        self.compiled_patterns: list = [re.compile(p, flags=flags) for p in regex_patterns]
+        self.invert_match: bool = invert_match
+        self.ignore_case: bool = bool(flags & re.IGNORECASE)
+
+        # search(obj) is truthy if and only if any of the patterns matches obj.
+        self.search: Callable = None
+        if len(self.compiled_patterns) == 1:
+            self.search = self.compiled_patterns[0].search
+        elif len(self.compiled_patterns) > 1 and all(p.groups == 0 for p in self.compiled_patterns):
+            # Groups are excluded because numbered backreferences would refer to other groups in the alternation.
+            # Patterns that only compile alone, like those with global inline flags, fall back to one by one.
+            separator = b"|" if isinstance(regex_patterns[0], bytes) else "|"
+            try:
+                self.search = re.compile(separator.join(_original_map(self._group, regex_patterns)), flags=flags).search
+            except (re.error, TypeError):
+                self.search = None
+
+        self.aho_corasick: _AhoCorasick = None
+        if fixed_strings and len(patterns) >= _AHO_CORASICK_MIN_PATTERNS:
+            if not self.ignore_case:
+                self.aho_corasick = _AhoCorasick(patterns)
+            elif all(isinstance(p, bytes) or p.isascii() for p in patterns):
+                # lower() is the same as re.IGNORECASE only between ASCII texts, so the others go to the alternation
+                self.aho_corasick = _AhoCorasick([p.lower() for p in patterns])
+            if self.aho_corasick is not None:
+                self.search = self._search_fixed_strings
+
+    @staticmethod
+    def _group(pattern: object) -> object:
+        return b"(?:" + pattern + b")" if isinstance(pattern, bytes) else "(?:" + pattern + ")"
+
+    def _search_fixed_strings(self, obj: object) -> object:
+        if not self.ignore_case:
+            return self.aho_corasick.search(obj)
+        if isinstance(obj, bytes) or obj.isascii():
+            return self.aho_corasick.search(obj.lower())
+        return any(p.search(obj) for p in self.compiled_patterns)
+
+    def __call__(self, obj: str) -> bool:
+        if self.search is not None:
+            if not self.invert_match:
+                return bool(self.search(obj))
+            if not self.search(obj):
+                return True
+            if len(self.compiled_patterns) == 1:
+                return False
+        invert_match: bool = self.invert_match
+        for compiled_pattern in self.compiled_patterns:
+            m = compiled_pattern.search(obj)
+            if (m and not invert_match) or (not m and invert_match):
+                return True
+        return False
+
 
 @monadic_function_returner
 def grep(*patterns: list[str], \
          i=False, ignore_case=False, \
          n=False, line_number=False, \
-         v=False, invert_match=False) -> Callable:
+         v=False, invert_match=False,
+         F=False, fixed_strings=False,
+         workers: int = None, batch_size: int = 1024, ordered: bool = True, executor: str = "process") -> Callable:
+    """
+    Print records that match patterns.
+      -F, --fixed-strings       PATTERNS are strings, not regular expressions
+      -i, --ignore-case         ignore case distinctions in patterns and data
+      -n, --line-number         print [line number, record] instead of record
+      -v, --invert-match        select non-matching records
+    See dw.map for workers, batch_size, ordered and executor.
+    """
     ignore_case = ignore_case or i
     line_number = line_number or n
     invert_match = invert_match or v
+    fixed_strings = fixed_strings or F
+
+    import re
 
     flags = 0
     if ignore_case:
         flags |= re.IGNORECASE
 
-    compiled_patterns = [re.compile(p, flags=flags) for p in patterns]
+    _match = _GrepMatcher(patterns, flags, invert_match, fixed_strings=fixed_strings)
+    if _match.search is not None and _match.aho_corasick is None and not invert_match:
+        _match = _match.search
+
+    if workers is not None:
+        import functools
+
+        @pipeable()
+        def _grep(iterable: Iterable[str]) -> Iterable[str]:
+            return _parallel_batches(iterable, functools.partial(_grep_batch, _match, line_number), workers, batch_size, ordered, executor)
+
+        return _grep
 
     @pipeable()
     def _grep(iterable: Iterable[str]) -> Iterable[str]:
-        for idx, obj in enumerate(iterable):
-            for compiled_pattern in compiled_patterns:
-                m = compiled_pattern.search(obj)
-                if (m and not invert_match) or (not m and invert_match):
-                    if line_number:
-                        yield [idx, obj]
-                    else:
-                        yield obj
-                    break
-
+        if line_number:
+            return ([idx, obj] for idx, obj in enumerate(iterable) if _match(obj))
+        return _original_filter(_match, iterable)
+
+    _grep.record_steps = (("grep", (_match, line_number)),)
+    if not line_number:
+        _grep.parallel_split = (_grep, None)
+        _grep.grep_spec = (patterns, flags, invert_match, fixed_strings)
     return _grep
 
 
 ################################################################################
 
 @monadic_function_returner
-def count() -> Callable:
+def count(top: int = None, approximate: bool = False, capacity: int = 10000) -> Callable:
+    """
+    Count the occurrences of each record and print [count, record] in order of first occurrence.
+      top                       print only the top records in descending order of count
+      approximate               with top, count in fixed memory with capacity counters (Space-Saving).
+                                After N records, each count is larger than the true count by at most
+                                N / capacity, and every record occurring more than N / capacity times is counted.
+    """
+    if approximate and top is None:
+        raise ValueError("top must be given with approximate.")
 
-    @pipeable
+    if approximate:
+
+        @pipeable()
+        def _count(iterable: Iterable) -> Iterable[list]:
+            from dw.sketch import SpaceSaving
+            space_saving = SpaceSaving(capacity)
+            for obj in iterable:
+                space_saving.add(obj)
+            _note_buffered(len(space_saving.counts))
+            for obj, count, _ in space_saving.most_common(top):
+                yield [count, obj]
+
+        return _count
+
+    @pipeable()
     def _count(iterable: Iterable) -> Iterable[list]:
         from collections import defaultdict
         obj2count = defaultdict(int)
         for obj in iterable:
             obj2count[obj] += 1
-        for obj, count in obj2count.items():
-            yield [count, obj]
+        _note_buffered(len(obj2count))
+        if top is None:
+            for obj, count in obj2count.items():
+                yield [count, obj]
+        else:
+            import heapq
+            for obj, count in heapq.nlargest(top, obj2count.items(), key=lambda item: item[1]):
+                yield [count, obj]
 
+    _count.parallel_split = (_count if top is None else count(), _merge_counts(top))
     return _count
 
 
+def _merge_counts(top: int) -> Callable:
+    """
+    Return a stage that sums [count, record] in order of first occurrence, and keeps the top records if top is given.
+    """
+
+    @pipeable()
+    def _merge_counts(iterable: Iterable[list]) -> Iterable[list]:
+        from collections import defaultdict
+        obj2count = defaultdict(int)
+        for count, obj in iterable:
+            obj2count[obj] += count
+        _note_buffered(len(obj2count))
+        if top is None:
+            for obj, count in obj2count.items():
+                yield [count, obj]
+        else:
+            import heapq
+            for obj, count in heapq.nlargest(top, obj2count.items(), key=lambda item: item[1]):
+                yield [count, obj]
+
+    return _merge_counts
+
+
 wc_l = count
 
+
+@monadic_function_returner
+def count_distinct(approximate: bool = False, precision: int = 14) -> Callable:
+    """
+    Print the number of distinct records.
+      approximate               estimate it with a HyperLogLog of 2 ** precision bytes. The relative
+                                standard error is 1.04 / sqrt(2 ** precision), e.g. 0.81% for precision 14.
+    """
+
+    @pipeable()
+    def _count_distinct(iterable: Iterable) -> Iterable[int]:
+        if approximate:
+            from dw.sketch import HyperLogLog
+            hyper_log_log = HyperLogLog(precision)
+            for obj in iterable:
+                hyper_log_log.add(obj)
+            yield len(hyper_log_log)
+        else:
+            yield len(set(iterable))
+
+    if not approximate:
+        _count_distinct.parallel_split = (uniq(globally=True), _count_distinct)
+    return _count_distinct
+
+
+################################################################################
+
+# (file name, worker stages, encoding, binary, buffer_size) of running scans, by id.
+# Worker processes are forked after a scan is registered, so stages need not be picklable.
+_SCAN_JOBS: dict = {}
+
+
+class _ByteRange(object):
+    """
+    Readable view of the bytes from the current position of f up to end.
+    """
+
+    def __init__(self, f: io.RawIOBase, end: int):
+        self.f: io.RawIOBase = f
+        self.remaining: int = end - f.tell()
+
+    def read(self, size: int) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        data: bytes = self.f.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+
+def _scan_batch(job_id: int, _: int, ranges: list) -> list:
+    file_name, worker_stages, encoding, binary, buffer_size = _SCAN_JOBS[job_id]
+    results: list = []
+    for start, end in ranges:
+        with io.open(file_name, "rb", buffering=0) as f:
+            f.seek(start)
+            lines: Iterable = _binary_lines(_ByteRange(f, end), buffer_size)
+            if not binary:
+                lines = (line.decode(encoding) for line in lines)
+            m: IterableMonad = IterableMonad(lines)
+            for stage in worker_stages:
+                m = m | stage
+            results.extend(m)
+    return results
+
+
+def _split_file(file_name: str, n_ranges: int) -> list:
+    """
+    Split file_name into at most n_ranges (start, end) byte ranges, each starting at the beginning of a line.
+    """
+    size: int = os.path.getsize(file_name)
+    boundaries: list = [0]
+    with io.open(file_name, "rb") as f:
+        for idx in range(1, n_ranges):
+            offset: int = size * idx // n_ranges
+            if offset <= boundaries[-1]:
+                continue
+            f.seek(offset - 1)
+            f.readline()
+            if boundaries[-1] < f.tell() < size:
+                boundaries.append(f.tell())
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def scan(file_name: str, *stages: Callable, workers: int = None, encoding: str = "utf-8",
+         b: bool = False, binary: bool = False,
+         split_size: int = 64 * 1024 * 1024, buffer_size: int = 1024 * 1024) -> IterableMonad:
+    """
+    Same as cat(file_name) | stages[0] | stages[1] | ..., with the leading stages run on byte ranges of the
+    local file in workers processes (os.cpu_count() by default), e.g. dw.scan("huge.log", dw.grep("ERROR"), dw.count()).
+
+    The file is split at line boundaries into ranges of about split_size bytes, and at least 4 per worker.
+    map, filter, grep (without -n) and do_nothing run in the workers and their outputs are concatenated
+    in file order. The first count, uniq -g or count_distinct runs in the workers too, and its partial
+    results are merged: counts are summed and duplicates are removed across ranges. The rest of the stages,
+    and any stage after another kind of stage, run on the merged records in this process.
+    Lines are split at b"\n" as in binary mode of cat, so the encoding must be ASCII compatible.
+
+    Workers are forked, so stages need not be picklable. Without fork, with one worker, or for compressed
+    files, the whole pipeline runs in this process.
+    """
+    import functools, multiprocessing
+
+    binary = binary or b
+    workers = workers or os.cpu_count() or 1
+
+    worker_stages: list = []
+    rest: list = list(stages)
+    while rest and getattr(rest[0], "parallel_split", None) is not None:
+        worker_stage, merge_stage = rest.pop(0).parallel_split
+        worker_stages.append(worker_stage)
+        if merge_stage is not None:
+            rest.insert(0, merge_stage)
+            break
+
+    if workers < 2 or not worker_stages or "fork" not in multiprocessing.get_all_start_methods() \
+    or not os.path.exists(file_name) or _compression(file_name, reading=True) is not None:
+        m: IterableMonad = cat(file_name, encoding=encoding, binary=binary, buffer_size=buffer_size)
+        for stage in stages:
+            m = m | stage
+        return m
+
+    def _scan() -> Iterable[object]:
+        size: int = os.path.getsize(file_name)
+        n_ranges: int = max(4 * workers, -(-size // split_size))
+        # worker_stages lives as long as the scan, so its id is unique among running scans
+        job_id: int = id(worker_stages)
+        _SCAN_JOBS[job_id] = (file_name, worker_stages, encoding, binary, buffer_size)
+        try:
+            yield from _parallel_batches(_split_file(file_name, n_ranges), functools.partial(_scan_batch, job_id), workers, 1, True, "fork")
+        finally:
+            del _SCAN_JOBS[job_id]
+
+    m: IterableMonad = IterableMonad(_scan())
+    for stage in rest:
+        m = m | stage
+    return m
+
 ################################################################################
 
 @monadic_function_returner
@@ -615,9 +2511,23 @@ def touch(*filenames) -> Callable:
 ################################################################################
 
 
-def execute_command(cmd, args, **popen_kwargs):
+def _command_line(cmd: object, args: Sequence, shell: bool) -> object:
+    """
+    Append args to cmd, a list of arguments or a str run by the shell.
+    """
+    import shlex
+
+    if isinstance(cmd, str) and shell:
+        return " ".join([cmd] + [shlex.quote(str(arg)) for arg in args])
+    if isinstance(cmd, str):
+        return [cmd] + [str(arg) for arg in args]
+    return [str(arg) for arg in cmd] + [str(arg) for arg in args]
+
+
+def execute_command(cmd, args=(), **popen_kwargs):
     
     import subprocess
+    cmd = _command_line(cmd, args, popen_kwargs.get("shell", False))
     p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs)
     stdout, stderr = p.communicate()
     status = p.returncode
@@ -625,11 +2535,114 @@ def execute_command(cmd, args, **popen_kwargs):
     return (status, stdout, stderr)
 
 
+@monadic_function_returner
+def sh(cmd: object, *args: object,
+       e: str = "utf-8", encoding: str = "utf-8",
+       b: bool = False, binary: bool = False,
+       check: bool = True, flush_size: int = 1024, **popen_kwargs) -> Callable:
+    """
+    Pipe records through a command, e.g. dw.cat("a.txt") | dw.sh("sort -S 1G") | dw.head(3).
+    cmd is a str run by the shell, or a list of arguments. args are appended to it, quoted for the shell.
+
+    Records are written to the standard input of the command as lines, flush_size records at a time,
+    by a feeder thread, and the lines of its standard output are yielded without line breaks as they arrive.
+    Neither stream is held in memory, so large outputs never deadlock.
+      -b, --binary              yield the output lines as bytes, without decoding
+    If check is True, subprocess.CalledProcessError is raised when the command exits with non zero status
+    after all its output is read. If the pipeline stops early, the command is killed and its status is ignored,
+    and the feeder thread stops reading upstream, closes it and is joined.
+    An exception raised by upstream in the feeder thread is re-raised after the output is read.
+    """
+    encoding = encoding or e
+    binary = binary or b
+    shell: bool = popen_kwargs.pop("shell", isinstance(cmd, str))
+    command_line: object = _command_line(cmd, args, shell)
+
+    @pipeable()
+    def _sh(iterable: Iterable) -> Iterable[object]:
+        import subprocess, threading
+
+        p = subprocess.Popen(command_line, shell=shell, stdin=subprocess.PIPE, stdout=subprocess.PIPE, **popen_kwargs)
+        errors: list = []
+        # set when the pipeline stops early, so that the feeder stops reading upstream
+        stopped = threading.Event()
+
+        def feed() -> None:
+            writer = _BatchedWriter(p.stdin, True, encoding, "\n", flush_size, None)
+            iterator: Iterable = iter(iterable)
+            try:
+                for obj in iterator:
+                    if stopped.is_set():
+                        break
+                    writer.write(obj)
+                else:
+                    writer.flush()
+            except BrokenPipeError:
+                # the command exited without reading all its input, e.g. head -n 1
+                pass
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                try:
+                    p.stdin.close()
+                except BrokenPipeError:
+                    pass
+                if stopped.is_set() and hasattr(iterator, "close"):
+                    # closed in this thread, which runs it
+                    iterator.close()
+
+        feeder = threading.Thread(target=feed, name="dw.sh", daemon=True)
+        feeder.start()
+
+        stdout: io.IOBase = p.stdout if binary else io.TextIOWrapper(p.stdout, encoding=encoding)
+        finished: bool = False
+        try:
+            if binary:
+                for line in stdout:
+                    yield line.rstrip(b"\r\n")
+            else:
+                for line in stdout:
+                    yield line.rstrip("\r\n")
+            finished = True
+        finally:
+            if not finished:
+                stopped.set()
+                if p.poll() is None:
+                    p.kill()
+            stdout.close()
+            status: int = p.wait()
+            feeder.join()
+
+        if errors:
+            raise errors[0]
+        if check and status != 0:
+            raise subprocess.CalledProcessError(status, command_line)
+
+    # the output depends on the command and whatever it reads, which a cache cannot tell
+    _sh.cacheable = False
+    return _sh
+
+
+pipe_through = sh
+
+
+################################################################################
+
+
+def main_cli(args: Sequence[str] = None) -> int:
+    """
+    Entry point of the dw command, e.g. cat abc.csv | dw csv to_markdown. See dw.cli.
+    """
+    from dw.cli import main
+    return main(sys.argv[1:] if args is None else args)
+
+
 
 ################################################################################
 
 if __name__ == "__main__":
     # sys.exit(cli_main(*sys.argv[1:]))
+    import logging
     logging.basicConfig(stream=sys.stderr, format=_LOG_FORMAT, level=logging.WARNING)
     # sys.exit(_cli_main("home"))
 
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+asyncio counterparts of IterableMonad, pipeable and some stages, for pipelines over async iterables.
+
+    >>> import dw.aio
+    >>> async def main():
+    ...     process = await asyncio.create_subprocess_exec("tail", "-f", "access.log", stdout=asyncio.subprocess.PIPE)
+    ...     errors = await (dw.aio.cat(process.stdout) | dw.aio.grep("ERROR") | dw.aio.head(10) > [])
+
+Redirections with > and >> return awaitables, so the pipeline is put in parentheses after await.
+Iterables and async iterables on the left of | are read through dw.aio.cat.
+
+Every stage closes its upstream when it stops early (e.g. head) or when it is closed or cancelled,
+so sources such as files and async generators are closed without waiting for garbage collection.
+"""
+
+import asyncio
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Iterable
+import functools
+import inspect
+import io
+import sys
+
+import dw
+
+
+class _closing(object):
+    """
+    contextlib.aclosing, which is available since Python 3.10, for async iterators with or without aclose.
+    """
+
+    def __init__(self, aiterator: AsyncIterator):
+        self.aiterator: AsyncIterator = aiterator
+
+    async def __aenter__(self) -> AsyncIterator:
+        return self.aiterator
+
+    async def __aexit__(self, *exc_info) -> None:
+        aclose: Callable = getattr(self.aiterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+async def _from_iterable(iterable: Iterable) -> AsyncIterable:
+    for obj in iterable:
+        yield obj
+
+
+async def _drain(aiterable: AsyncIterable) -> None:
+    async with _closing(aiterable.__aiter__()) as aiterator:
+        async for _ in aiterator:
+            pass
+
+
+################################################################################
+
+
+class AsyncIterableMonad(dw.Monad):
+    """
+    IterableMonad over an async iterable. A plain iterable is also accepted.
+    """
+
+    def __init__(self, iterable: object = []):
+        if not hasattr(iterable, "__aiter__"):
+            iterable = _from_iterable(iterable)
+        super().__init__(iterable)
+
+    def bind(self, monadic_func: Callable) -> object:
+        new_monad: AsyncIterableMonad = super().bind(monadic_func)
+
+        if getattr(monadic_func, "sink_to_be_redirected_to", None) is not None:
+            # if redirect is sandwitched by parentheses like ["a", "b"] | (grep("a") > []), this block is called
+            return new_monad.redirect_to(monadic_func.sink_to_be_redirected_to)
+        elif getattr(monadic_func, "sink_to_be_appending_redirected_to", None) is not None:
+            return new_monad.appending_redirect_to(monadic_func.sink_to_be_appending_redirected_to)
+
+        return new_monad
+
+    __or__ = bind  # Monad.__or__ is bound to Monad.bind
+
+    def __aiter__(self) -> AsyncIterator:
+        return self.iterable.__aiter__()
+
+    async def redirect_to(self, sink: object) -> object:
+        await _drain(self | tee(sink, append=False))
+        return sink
+
+    __gt__ = redirect_to  # await (dw.aio.cat(...) | dw.aio.head(3) > [])
+
+    async def appending_redirect_to(self, sink: object) -> object:
+        await _drain(self | tee(sink, append=True))
+        return sink
+
+    __rshift__ = appending_redirect_to
+
+
+def pipeable(monad_class: AsyncIterableMonad = AsyncIterableMonad, monadic_function_wrapper: Callable = None):
+    """
+    Decorator of async generator functions that take an async iterable, like dw.pipeable.
+    """
+    if monadic_function_wrapper is None:
+        monadic_function_wrapper = functools.partial(dw.MonadicFunctionWrapper, obj2imonad_func=cat)
+    return dw.pipeable(monad_class, monadic_function_wrapper)
+
+
+################################################################################
+
+
+def cat(*sources: object, encoding: str = "utf-8",
+        b: bool = False, binary: bool = False, buffer_size: int = 1024 * 1024) -> AsyncIterableMonad:
+    """
+    Concatenate files, streams, async iterables and iterables. A str without line breaks is a file name,
+    and "-" is the standard input.
+      -b, --binary              read files and streams as bytes, without decoding
+    Files are read in the default executor of the event loop, lines of about buffer_size bytes at a time.
+    asyncio.StreamReader (e.g. stdout of asyncio.subprocess) yields its lines decoded with encoding.
+    Line breaks are removed from the lines of files and streams.
+    """
+    binary = binary or b
+
+    async def _cat() -> AsyncIterable:
+        for source in sources:
+            if dw._is_file_name(source):
+                async with _closing(_file_lines(source, encoding, binary, buffer_size)) as lines:
+                    async for line in lines:
+                        yield line
+            elif isinstance(source, asyncio.StreamReader):
+                while True:
+                    line: bytes = await source.readline()
+                    if not line:
+                        break
+                    line = line.rstrip(b"\r\n")
+                    yield line if binary else line.decode(encoding)
+            elif isinstance(source, str):
+                for line in source.splitlines():
+                    yield line
+            elif hasattr(source, "__aiter__"):
+                async with _closing(source.__aiter__()) as aiterator:
+                    async for obj in aiterator:
+                        yield obj
+            else:
+                for obj in source:
+                    yield obj
+
+    return AsyncIterableMonad(_cat())
+
+
+async def _file_lines(file_name: str, encoding: str, binary: bool, buffer_size: int) -> AsyncIterable:
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    must_close: bool = False
+    if file_name == dw.STDIO:
+        f: io.IOBase = sys.stdin.buffer if binary else sys.stdin
+    elif binary:
+        f: io.IOBase = await loop.run_in_executor(None, io.open, file_name, "rb")
+        must_close = True
+    else:
+        f: io.IOBase = await loop.run_in_executor(None, functools.partial(io.open, file_name, "rt", encoding=encoding))
+        must_close = True
+    line_breaks: object = b"\r\n" if binary else "\r\n"
+    try:
+        while True:
+            lines: list = await loop.run_in_executor(None, f.readlines, buffer_size)
+            if not lines:
+                break
+            for line in lines:
+                yield line.rstrip(line_breaks)
+    finally:
+        if must_close:
+            f.close()
+
+
+################################################################################
+
+
+@dw.monadic_function_returner
+def grep(*patterns: str,
+         i=False, ignore_case=False,
+         n=False, line_number=False,
+         v=False, invert_match=False,
+         F=False, fixed_strings=False) -> Callable:
+    """
+    Print records that match patterns. See dw.grep for the options.
+    """
+    import re
+
+    ignore_case = ignore_case or i
+    line_number = line_number or n
+    invert_match = invert_match or v
+    fixed_strings = fixed_strings or F
+
+    _match = dw._GrepMatcher(patterns, re.IGNORECASE if ignore_case else 0, invert_match, fixed_strings=fixed_strings)
+    if _match.search is not None and _match.aho_corasick is None and not invert_match:
+        _match = _match.search
+
+    @pipeable()
+    async def _grep(aiterable: AsyncIterable) -> AsyncIterable:
+        async with _closing(aiterable.__aiter__()) as aiterator:
+            idx: int = 0
+            async for obj in aiterator:
+                if _match(obj):
+                    yield [idx, obj] if line_number else obj
+                idx += 1
+
+    return _grep
+
+
+async def _call(f: Callable, obj: object) -> object:
+    result: object = f(obj)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+@dw.monadic_function_returner
+def map(f: Callable, concurrency: int = 1, ordered: bool = True) -> Callable:
+    """
+    Convert each record with f. If f is a coroutine function, or returns an awaitable, it is awaited,
+    and up to concurrency calls run at a time. If ordered is False, records are yielded in the order
+    their calls finish. Calls in flight are cancelled when the stage is closed or cancelled.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be positive value.")
+
+    @pipeable()
+    async def _map(aiterable: AsyncIterable) -> AsyncIterable:
+        import collections
+
+        async with _closing(aiterable.__aiter__()) as aiterator:
+            if concurrency == 1:
+                async for obj in aiterator:
+                    yield await _call(f, obj)
+                return
+
+            tasks: object = collections.deque() if ordered else set()
+            try:
+                async for obj in aiterator:
+                    task: asyncio.Future = asyncio.ensure_future(_call(f, obj))
+                    if ordered:
+                        tasks.append(task)
+                        if len(tasks) >= concurrency:
+                            yield await tasks.popleft()
+                    else:
+                        tasks.add(task)
+                        if len(tasks) >= concurrency:
+                            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                            for task in done:
+                                yield task.result()
+                while tasks:
+                    if ordered:
+                        yield await tasks.popleft()
+                    else:
+                        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            yield task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return _map
+
+
+@dw.monadic_function_returner
+def head(n: int = 5) -> Callable:
+    if n < 0:
+        raise ValueError("n must be non negative value.")
+
+    @pipeable()
+    async def _head(aiterable: AsyncIterable) -> AsyncIterable:
+        async with _closing(aiterable.__aiter__()) as aiterator:
+            if n == 0:
+                return
+            idx: int = 0
+            async for obj in aiterator:
+                yield obj
+                idx += 1
+                if idx >= n:
+                    break
+
+    return _head
+
+
+@dw.monadic_function_returner
+def tee(*targets: object,
+        e: str = "utf-8", encoding: str = "utf-8",
+        a: bool = False, append: bool = False,
+        n: bool = False,
+        b: bool = False, binary: bool = False,
+        flush_size: int = None, flush_interval: float = None) -> Callable:
+    """
+    Copy records to each target, and also to standard output. See dw.tee for the targets and options.
+    In addition, coroutine functions are awaited with each record, and records are written to
+    asyncio.StreamWriter targets (e.g. stdin of asyncio.subprocess) as lines, waiting for them to drain.
+    FILEs and io objects are written by the event loop thread, flush_size records at a time.
+    """
+    encoding = encoding or e
+    append = append or a
+    binary = binary or b
+    line_break: str = "" if n else "\n"
+
+    def _stream_writer_write(writer: asyncio.StreamWriter) -> Callable:
+
+        async def write(obj: object) -> None:
+            data: bytes = obj if isinstance(obj, bytes) else str(obj).encode(encoding)
+            writer.write(data + line_break.encode(encoding))
+            await writer.drain()
+
+        return write
+
+    @pipeable()
+    async def _tee(aiterable: AsyncIterable) -> AsyncIterable:
+        writes: list = []
+        async_writes: list = []
+        closers: list = []
+        try:
+            for target in targets:
+                if isinstance(target, asyncio.StreamWriter):
+                    async_writes.append(_stream_writer_write(target))
+                elif inspect.iscoroutinefunction(target):
+                    async_writes.append(target)
+                else:
+                    write, close = dw._open_sink(target, encoding, append, n, binary, flush_size, flush_interval)
+                    if write is not None:
+                        writes.append(write)
+                    if close is not None:
+                        closers.append(close)
+
+            async with _closing(aiterable.__aiter__()) as aiterator:
+                async for obj in aiterator:
+                    for write in writes:
+                        write(obj)
+                    for async_write in async_writes:
+                        await async_write(obj)
+                    yield obj
+        finally:
+            error: BaseException = None
+            for close in closers:
+                try:
+                    close()
+                except Exception as e:
+                    error = error or e
+            if error is not None:
+                raise error
+
+    return _tee
@@ -0,0 +1,564 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Stages that pass batches of records instead of one record at a time.
+
+    >>> import dw.batch
+    >>> dw.cat("numbers.txt") | dw.batch.map(float) | dw.batch.filter(lambda x: x > 0.5, vectorized=True) | dw.batch.sorted() > "-"
+
+A batch is a NumPy array of records, or an array.array if NumPy is not installed, or Columns, a dict of
+such arrays per field of dict records. The stages of this module read batches and convert records into
+batches of batch_size first if they are given records, e.g. by dw.cat. The stages that follow them read
+records again: binding a stage that is not of this module, or iterating or redirecting the pipeline,
+converts the batches back into records.
+
+map and filter call their function with each record, as dw.map and dw.filter do. With vectorized=True
+they call it with the whole batch instead, so that lambda x: x * 2 or lambda c: c["price"] > 100 runs
+in NumPy at once. A function of a record cannot be told from a function of a batch, e.g.
+lambda s: s[::-1] reverses a record but also a batch, so this is never guessed. Records keep their
+types through batches: ints, floats and bools become NumPy arrays of their type, and other records
+are kept as objects. Dict records become Columns and come back as dicts.
+"""
+
+from collections.abc import Callable, Iterable, Sequence
+import array
+import itertools
+import sys
+
+import dw
+
+# batch size of records that are converted implicitly
+_BATCH_SIZE: int = 65536
+
+_original_map = map
+_original_sorted = sorted
+
+
+def _numpy() -> object:
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+################################################################################
+
+
+class Columns(dict):
+    """
+    Batch of dict records as {name: array of the values of the field}. The arrays have the same length.
+    """
+
+    def __repr__(self) -> str:
+        return f"Columns({dict.__repr__(self)})"
+
+
+class _Objects(list):
+    """
+    Batch of records that do not fit in an array.array, without NumPy.
+    """
+
+    def tolist(self) -> list:
+        return list(self)
+
+
+def _is_batch(obj: object) -> bool:
+    if isinstance(obj, (array.array, _Objects, Columns)):
+        return True
+    # an ndarray can only exist if numpy has been imported
+    np: object = sys.modules.get("numpy")
+    return np is not None and isinstance(obj, np.ndarray)
+
+
+def _numpy_of(batch: object) -> object:
+    """
+    Return numpy if batch consists of NumPy arrays, to make batches of its results in the same way.
+    """
+    if isinstance(batch, Columns):
+        batch = next(iter(batch.values()), None)
+    np: object = sys.modules.get("numpy")
+    return np if np is not None and isinstance(batch, np.ndarray) else None
+
+
+def _array(values: list, np: object) -> object:
+    """
+    Return a 1-D array of values, with the type of the values if they are all ints, floats or bools.
+    """
+    types: set = set(_original_map(type, values))
+    if np is not None:
+        if len(types) == 1 and types <= {int, float, bool}:
+            try:
+                return np.array(values, dtype={int: np.int64, float: np.float64, bool: np.bool_}[types.pop()])
+            except OverflowError:
+                pass
+        # object arrays keep the records as they are, e.g. not strs padded or tuples made rows
+        return np.fromiter(values, dtype=object, count=len(values))
+    if types == {int}:
+        try:
+            return array.array("q", values)
+        except OverflowError:
+            pass
+    elif types == {float}:
+        return array.array("d", values)
+    return _Objects(values)
+
+
+def _to_batch(records: list, np: object) -> object:
+    if records and type(records[0]) is dict:
+        # only dicts with the same keys come back the same from columns, not e.g. dw.csv.Row
+        names: tuple = tuple(records[0])
+        if all(type(record) is dict and tuple(record) == names for record in records):
+            return Columns({name: _array([record[name] for record in records], np) for name in names})
+    return _array(records, np)
+
+
+def _length(batch: object) -> int:
+    if isinstance(batch, Columns):
+        return len(next(iter(batch.values()))) if batch else 0
+    return len(batch)
+
+
+def _tolist(batch: object) -> list:
+    if isinstance(batch, Columns):
+        names: list = list(batch)
+        return [dict(zip(names, values)) for values in zip(*[column.tolist() for column in batch.values()])]
+    return batch.tolist()
+
+
+def _slice(batch: object, start: int, stop: int) -> object:
+    if isinstance(batch, Columns):
+        return Columns({name: _slice(column, start, stop) for name, column in batch.items()})
+    if isinstance(batch, _Objects):
+        return _Objects(batch[start:stop])
+    return batch[start:stop]
+
+
+def _compress(batch: object, mask: Sequence) -> object:
+    if isinstance(batch, Columns):
+        return Columns({name: _compress(column, mask) for name, column in batch.items()})
+    if isinstance(batch, array.array):
+        return array.array(batch.typecode, itertools.compress(batch, mask))
+    if isinstance(batch, _Objects):
+        return _Objects(itertools.compress(batch, mask))
+    return batch[mask]
+
+
+def _take(batch: object, indices: object) -> object:
+    if isinstance(batch, Columns):
+        return Columns({name: _take(column, indices) for name, column in batch.items()})
+    return batch[indices]
+
+
+def _concatenated(batches: list) -> object:
+    if len(batches) == 1:
+        return batches[0]
+    first: object = batches[0]
+    if isinstance(first, Columns):
+        if all(isinstance(batch, Columns) and list(batch) == list(first) for batch in batches):
+            return Columns({name: _concatenated([batch[name] for batch in batches]) for name in first})
+    elif isinstance(first, array.array):
+        if all(isinstance(batch, array.array) and batch.typecode == first.typecode for batch in batches):
+            concatenated: array.array = array.array(first.typecode)
+            for batch in batches:
+                concatenated.extend(batch)
+            return concatenated
+    elif isinstance(first, _Objects):
+        return _Objects(itertools.chain.from_iterable(batches))
+    else:
+        np: object = _numpy_of(first)
+        # np.concatenate would make ints floats with a batch of floats
+        if all(isinstance(batch, np.ndarray) and batch.dtype == first.dtype for batch in batches):
+            return np.concatenate(batches)
+    return _to_batch(list(itertools.chain.from_iterable(_original_map(_tolist, batches))), _numpy_of(first))
+
+
+################################################################################
+
+
+def _peeked(iterable: Iterable) -> tuple:
+    """
+    Return the first object of iterable and an iterator of all its objects, or (None, None) if it is empty.
+    """
+    iterator = iter(iterable)
+    for first in iterator:
+        return first, itertools.chain([first], iterator)
+    return None, None
+
+
+def _batched(iterable: Iterable, batch_size: int = _BATCH_SIZE, vectorize: bool = None) -> Iterable[object]:
+    """
+    Yield the batches of iterable, or batches of its records if it yields records.
+    """
+    first, iterator = _peeked(iterable)
+    if iterator is None:
+        return
+    if _is_batch(first):
+        yield from iterator
+        return
+    np: object = None if vectorize is False else _numpy()
+    if vectorize and np is None:
+        raise ImportError("vectorize requires numpy")
+    while True:
+        records: list = list(itertools.islice(iterator, batch_size))
+        if not records:
+            return
+        yield _to_batch(records, np)
+
+
+def _unbatched(iterable: Iterable) -> Iterable[object]:
+    """
+    Yield the records of the batches of iterable, or its records if it yields records.
+    """
+    first, iterator = _peeked(iterable)
+    if iterator is None:
+        return
+    if not _is_batch(first):
+        yield from iterator
+        return
+    for batch in iterator:
+        yield from _tolist(batch)
+
+
+class BatchMonad(dw.IterableMonad):
+    """
+    IterableMonad of batches. Stages that are not batch stages are bound to its records, and iterating
+    it yields its records.
+    """
+
+    def bind(self, monadic_func: Callable) -> object:
+        if getattr(monadic_func, "batch_stage", False):
+            return super().bind(monadic_func)
+        return super().bind(records()).bind(monadic_func)
+
+    __or__ = bind
+
+    def __iter__(self):
+        return _unbatched(self._replayed())
+
+    def __str__(self) -> str:
+        return str(self.bind(records()))
+
+    __repr__ = __str__
+
+
+def _batch_stage(f: Callable) -> Callable:
+    """
+    Decorator of the factories of this module, which marks the stages they return to read batches.
+    """
+    import functools
+
+    @functools.wraps(f)
+    def _f(*args, **kwargs) -> Callable:
+        mf = f(*args, **kwargs)
+        mf.batch_stage = True
+        return mf
+
+    return _f
+
+
+################################################################################
+
+
+@_batch_stage
+@dw.monadic_function_returner
+def batches(batch_size: int = _BATCH_SIZE, vectorize: bool = None) -> Callable:
+    """
+    Convert records into batches of batch_size records, which the other stages of this module do implicitly.
+      vectorize                 True to make NumPy arrays, False to make array.array, or None to make NumPy
+                                arrays if numpy is installed
+    Batches are passed through.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive value.")
+
+    @dw.pipeable(BatchMonad)
+    def _batches(iterable: Iterable) -> Iterable[object]:
+        return _batched(iterable, batch_size, vectorize)
+
+    return _batches
+
+
+@_batch_stage
+@dw.monadic_function_returner
+def records() -> Callable:
+    """
+    Convert batches into records. Columns become dicts. Records are passed through.
+    """
+
+    @dw.pipeable()
+    def _records(iterable: Iterable) -> Iterable[object]:
+        return _unbatched(iterable)
+
+    return _records
+
+
+def _applied(f: Callable, batch: object, vectorized: bool) -> object:
+    """
+    Return the results of f for the records of batch as a batch, from f(batch) if vectorized.
+    """
+    np: object = _numpy_of(batch)
+    if vectorized:
+        if np is None:
+            raise ValueError("vectorized requires batches of NumPy arrays")
+        result: object = f(batch)
+        if isinstance(result, dict) and not isinstance(result, Columns):
+            result = Columns(result)
+        if not (_is_batch(result) and _length(result) == _length(batch) and (isinstance(result, Columns) or result.ndim == 1)):
+            raise ValueError(f"{f!r} does not return one value per record of a batch")
+        return result
+    # int and float give the same results on whole arrays of these kinds, e.g. object arrays of strs
+    if np is not None and isinstance(batch, np.ndarray) and ((f is float and batch.dtype.kind in "biufO")
+                                                          or (f is int and batch.dtype.kind in "biO")):
+        try:
+            return batch.astype(np.int64 if f is int else np.float64)
+        except (ValueError, TypeError, OverflowError):
+            # converted one by one below, e.g. to raise the error of the record
+            pass
+    return _to_batch([f(record) for record in _tolist(batch)], np)
+
+
+@_batch_stage
+@dw.monadic_function_returner
+def map(condition_f: Callable, vectorized: bool = False) -> Callable:
+    """
+    Convert each record with condition_f.
+      vectorized                call condition_f with whole batches of NumPy arrays or Columns, which must return
+                                an array of one value per record, e.g. lambda x: x * 2. Then NumPy semantics
+                                apply, e.g. int64 arithmetic wraps around. Otherwise condition_f is called with
+                                each record, except that int and float convert NumPy arrays at once.
+    """
+
+    @dw.pipeable(BatchMonad)
+    def _map(iterable: Iterable) -> Iterable[object]:
+        for batch in _batched(iterable):
+            yield _applied(condition_f, batch, vectorized)
+
+    return _map
+
+
+@_batch_stage
+@dw.monadic_function_returner
+def filter(condition_f: Callable, vectorized: bool = False) -> Callable:
+    """
+    Pass records for which condition_f returns true. See map for vectorized. condition_f(batch) must
+    return an array of bools to be vectorized, e.g. lambda x: x > 0.5.
+    """
+
+    @dw.pipeable(BatchMonad)
+    def _filter(iterable: Iterable) -> Iterable[object]:
+        for batch in _batched(iterable):
+            mask: object = _applied(condition_f, batch, vectorized)
+            np: object = _numpy_of(batch)
+            if np is not None:
+                if mask.dtype != np.bool_:
+                    mask = np.fromiter(_original_map(bool, mask.tolist()), dtype=np.bool_, count=len(mask))
+            else:
+                mask = list(_original_map(bool, mask.tolist()))
+            yield _compress(batch, mask)
+
+    return _filter
+
+
+@_batch_stage
+@dw.monadic_function_returner
+def sorted(key: object = None, reverse: bool = False, vectorized: bool = False) -> Callable:
+    """
+    Sort records in the same way as the builtin sorted, keeping all batches in memory.
+      key                       function of a record as dw.sorted, or of a batch if vectorized as for map, or
+                                the name of a field of dict records
+    NumPy arrays are sorted by a stable NumPy sort.
+    """
+
+    @dw.pipeable(BatchMonad)
+    def _sorted(iterable: Iterable) -> Iterable[object]:
+        collected: list = list(_batched(iterable))
+        if not collected:
+            return
+        batch: object = _concatenated(collected)
+        del collected
+        n: int = _length(batch)
+        dw._note_buffered(n)
+        np: object = _numpy_of(batch)
+        keys: object = None
+        if key is None:
+            if not isinstance(batch, Columns):
+                keys = batch
+        elif isinstance(key, str) and isinstance(batch, Columns):
+            keys = batch[key]
+        elif isinstance(key, str):
+            # e.g. dicts with different keys
+            keys = _to_batch([record[key] for record in _tolist(batch)], np)
+        else:
+            keys = _applied(key, batch, vectorized)
+        if np is not None and keys is not None and isinstance(keys, np.ndarray):
+            if reverse:
+                # sorting the reversed keys stably and reversing the order keeps equal records in order
+                order = n - 1 - np.argsort(keys[::-1], kind="stable")[::-1]
+            else:
+                order = np.argsort(keys, kind="stable")
+            batch = _take(batch, order)
+        elif keys is None:
+            batch = _to_batch(_original_sorted(_tolist(batch), reverse=reverse), np)
+        else:
+            key_list: list = _tolist(keys)
+            order: list = _original_sorted(range(n), key=key_list.__getitem__, reverse=reverse)
+            objs: list = _tolist(batch)
+            batch = _to_batch([objs[idx] for idx in order], np)
+        for start in range(0, n, _BATCH_SIZE):
+            yield _slice(batch, start, start + _BATCH_SIZE)
+
+    return _sorted
+
+
+@_batch_stage
+@dw.monadic_function_returner
+def head(n: int = 5) -> Callable:
+    """
+    Print the first n records, and stop reading after the batch of the n-th.
+    """
+    if n < 0:
+        raise ValueError("n must be non negative value.")
+
+    @dw.pipeable(BatchMonad)
+    def _head(iterable: Iterable) -> Iterable[object]:
+        rest: int = n
+        if rest == 0:
+            return
+        for batch in _batched(iterable):
+            length: int = _length(batch)
+            if length >= rest:
+                yield _slice(batch, 0, rest)
+                break
+            yield batch
+            rest -= length
+
+    return _head
+
+
+@_batch_stage
+@dw.monadic_function_returner
+def tail(n: int = 5) -> Callable:
+    """
+    Print the last n records.
+    """
+    if n < 0:
+        raise ValueError("n must be non negative value.")
+
+    @dw.pipeable(BatchMonad)
+    def _tail(iterable: Iterable) -> Iterable[object]:
+        import collections
+
+        kept: collections.deque = collections.deque()
+        size: int = 0
+        for batch in _batched(iterable):
+            kept.append(batch)
+            size += _length(batch)
+            # drop the batches that the last n records do not need
+            while kept and size - _length(kept[0]) >= n:
+                size -= _length(kept.popleft())
+        if n == 0 or not kept:
+            return
+        batch: object = _concatenated(list(kept))
+        dw._note_buffered(min(n, size))
+        yield _slice(batch, max(0, size - n), size)
+
+    return _tail
+
+
+@_batch_stage
+@dw.monadic_function_returner
+def count(top: int = None) -> Callable:
+    """
+    Count the occurrences of each record and print [count, record] in order of first occurrence, as
+    dw.count does. Records of Columns are counted as tuples of their fields.
+      top                       print only the top records in descending order of count
+    NumPy arrays of numbers are counted by np.unique per batch.
+    """
+
+    @dw.pipeable()
+    def _count(iterable: Iterable) -> Iterable[list]:
+        obj2count: dict = {}
+        get: Callable = obj2count.get
+        for batch in _batched(iterable):
+            np: object = _numpy_of(batch)
+            if np is not None and not isinstance(batch, Columns) and batch.dtype.kind in "biuf":
+                values, firsts, counts = np.unique(batch, return_index=True, return_counts=True)
+                # in order of first occurrence in the batch
+                order = np.argsort(firsts, kind="stable")
+                for obj, count in zip(values[order].tolist(), counts[order].tolist()):
+                    obj2count[obj] = get(obj, 0) + count
+                continue
+            if isinstance(batch, Columns):
+                objs: Iterable = zip(*[column.tolist() for column in batch.values()])
+            else:
+                objs = batch.tolist()
+            for obj in objs:
+                obj2count[obj] = get(obj, 0) + 1
+        dw._note_buffered(len(obj2count))
+        if top is None:
+            for obj, count in obj2count.items():
+                yield [count, obj]
+        else:
+            import heapq
+            for obj, count in heapq.nlargest(top, obj2count.items(), key=lambda item: item[1]):
+                yield [count, obj]
+
+    return _count
+
+
+@_batch_stage
+@dw.monadic_function_returner
+def sample(k: int, seed: object = None) -> Callable:
+    """
+    Choose k records at random without replacement, in random order, as dw.sample does. The records that
+    are skipped are never converted, and the same seed chooses the same records as dw.sample.
+    A ValueError is raised if the input has less than k records.
+    """
+    if k < 0:
+        raise ValueError("k must be non negative value.")
+
+    @dw.pipeable(BatchMonad)
+    def _sample(iterable: Iterable) -> Iterable[object]:
+        # dw._reservoir_sample (Algorithm L) with the same random numbers, skipping over batches
+        import math
+
+        rng = dw._random_generator(seed)
+        reservoir: list = []
+        np: object = None
+        # index of the first record of the batch, and of the next record to replace one in the reservoir
+        start: int = 0
+        chosen: int = None
+        w: float = None
+        for batch in _batched(iterable):
+            np = _numpy_of(batch)
+            length: int = _length(batch)
+            if len(reservoir) < k:
+                reservoir.extend(_tolist(_slice(batch, 0, k - len(reservoir))))
+                if len(reservoir) == k:
+                    w = math.exp(math.log(dw._open_unit_random(rng)) / k)
+                    chosen = k + int(math.log(dw._open_unit_random(rng)) / math.log1p(-w))
+            while chosen is not None and chosen < start + length:
+                reservoir[rng.randrange(k)] = _tolist(_slice(batch, chosen - start, chosen - start + 1))[0]
+                w *= math.exp(math.log(dw._open_unit_random(rng)) / k)
+                chosen += 1 + int(math.log(dw._open_unit_random(rng)) / math.log1p(-w))
+            start += length
+            if k == 0:
+                break
+        if len(reservoir) < k:
+            raise ValueError("Sample larger than population or is negative")
+        dw._note_buffered(len(reservoir))
+        rng.shuffle(reservoir)
+        if reservoir:
+            yield _to_batch(reservoir, np)
+
+    _sample.cacheable = seed is not None
+    return _sample
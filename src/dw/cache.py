@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Results of pipelines over files, kept on disk and replayed while the files are unchanged.
+
+    >>> from dw.cache import ResultCache
+    >>> cache = ResultCache()
+    >>> dw.cat("access.log", cache=cache) | dw.grep("ERROR") | dw.sorted() | dw.uniq() > "-"
+
+A pipeline is cached if it starts with cat of local files given a ResultCache, and is keyed on the
+descriptions of its stages and the identity of each file: its path, size, mtime and inode, or the SHA-256
+of its content with identity="content". The output is written to the cache as it streams to the consumer,
+and kept only if it is read to the end and the files did not change meanwhile. The next run of the same
+stages over the same files reads the output from the cache without running any stage.
+
+Stages are described by their names and arguments, and functions by their bytecode, constants, defaults,
+closures, the globals they refer to and the values of the attributes they read from modules, e.g.
+cfg.LIMIT. Keys also include the version of dw. A stage that cannot be described, e.g. one given a
+generator, an object of an unknown class or a function that uses a module otherwise than by reading its
+attributes, and stages that set cacheable to False, such as shuffle and sample without a seed and tee,
+make the pipeline bypass the cache from there on. Then it runs as without a cache.
+
+The least recently used results are deleted when the cache exceeds max_bytes, and invalidate deletes
+the results of a pipeline or of a file at once.
+"""
+
+from collections.abc import Callable, Iterable, Sequence
+import hashlib
+import os
+import pickle
+import types
+
+import dw
+
+# bump when the format of the entries or of the keys changes
+_VERSION: int = 1
+_SUFFIX: str = ".dwc"
+_HASH_BLOCK_SIZE: int = 1024 * 1024
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+################################################################################
+
+
+def _code(code: types.CodeType, seen: set) -> tuple:
+    return ("code", code.co_name, code.co_code, code.co_names,
+            tuple(_code(const, seen) if isinstance(const, types.CodeType) else _fingerprint(const, seen)
+                  for const in code.co_consts))
+
+
+def _codes(code: types.CodeType) -> Iterable[types.CodeType]:
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _codes(const)
+
+
+def _module_attributes(code: types.CodeType, f_globals: dict) -> Iterable[tuple]:
+    """
+    Yield (dotted name, value) of the attributes that code reads from modules that are globals, e.g.
+    ("cfg.LIMIT", 2) for cfg.LIMIT, so that a change of the value changes the key. Raise _Uncacheable if a
+    module is used otherwise, e.g. passed to a function.
+    """
+    import dis
+
+    for inner in _codes(code):
+        instructions: list = list(dis.get_instructions(inner))
+        for idx, instruction in enumerate(instructions):
+            if instruction.opname != "LOAD_GLOBAL" or not isinstance(f_globals.get(instruction.argval), types.ModuleType):
+                continue
+            name: str = instruction.argval
+            value: object = f_globals[name]
+            for following in instructions[idx + 1:]:
+                if not isinstance(value, types.ModuleType):
+                    break
+                if following.opname not in ("LOAD_ATTR", "LOAD_METHOD"):
+                    raise _Uncacheable(name)
+                try:
+                    value = getattr(value, following.argval)
+                except AttributeError:
+                    raise _Uncacheable(name)
+                name += "." + following.argval
+            yield name, value
+
+
+def _fingerprint(obj: object, seen: set = None) -> tuple:
+    """
+    Return a tuple of strs, bytes and numbers that is equal for objects that behave equally, or raise
+    _Uncacheable.
+    """
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        return (type(obj).__name__, repr(obj))
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        # e.g. a recursive function, inside its own fingerprint
+        return ("recursive", getattr(obj, "__qualname__", type(obj).__name__))
+    seen.add(id(obj))
+    try:
+        return _fingerprint_object(obj, seen)
+    finally:
+        seen.discard(id(obj))
+
+
+def _cell(cell: types.CellType, seen: set) -> tuple:
+    try:
+        contents: object = cell.cell_contents
+    except ValueError:
+        # a variable that is not assigned yet
+        return ("empty",)
+    return _fingerprint(contents, seen)
+
+
+def _fingerprint_object(obj: object, seen: set) -> tuple:
+    if isinstance(obj, (tuple, list)):
+        return (type(obj).__name__, tuple(_fingerprint(element, seen) for element in obj))
+    if isinstance(obj, (set, frozenset)):
+        return (type(obj).__name__, tuple(sorted((_fingerprint(element, seen) for element in obj), key=repr)))
+    if isinstance(obj, dict):
+        return (type(obj).__name__, tuple((_fingerprint(k, seen), _fingerprint(v, seen)) for k, v in obj.items()))
+    if isinstance(obj, dw.MonadicFunctionWrapper):
+        return _stage(obj, seen)
+    if isinstance(obj, types.FunctionType):
+        f_globals: dict = obj.__globals__
+        names: set = {name for code in _codes(obj.__code__) for name in code.co_names
+                      if name in f_globals and not isinstance(f_globals[name], types.ModuleType)}
+        referred: tuple = tuple((name, _fingerprint(f_globals[name], seen)) for name in sorted(names))
+        attributes: tuple = tuple(sorted({(name, repr(_fingerprint(value, seen)))
+                                          for name, value in _module_attributes(obj.__code__, f_globals)}))
+        cells: tuple = tuple(_cell(cell, seen) for cell in obj.__closure__ or ())
+        return ("function", obj.__module__, obj.__qualname__, _code(obj.__code__, seen),
+                _fingerprint(obj.__defaults__, seen), _fingerprint(obj.__kwdefaults__, seen), cells, referred, attributes)
+    if isinstance(obj, types.MethodType):
+        return ("method", _fingerprint(obj.__func__, seen), _fingerprint(obj.__self__, seen))
+    if isinstance(obj, (types.BuiltinFunctionType, types.MethodDescriptorType, types.WrapperDescriptorType)):
+        owner: object = getattr(obj, "__self__", None)
+        if owner is None or isinstance(owner, types.ModuleType):
+            return ("builtin", getattr(owner, "__name__", None), obj.__qualname__)
+        return ("builtin method", obj.__qualname__, _fingerprint(owner, seen))
+    if isinstance(obj, type):
+        return ("type", obj.__module__, obj.__qualname__)
+    # modules are described by the attributes that functions read from them, see _module_attributes
+    import functools, operator, re
+    if isinstance(obj, functools.partial):
+        return ("partial", _fingerprint(obj.func, seen), _fingerprint(obj.args, seen), _fingerprint(obj.keywords, seen))
+    if isinstance(obj, re.Pattern):
+        return ("pattern", obj.pattern, obj.flags)
+    if isinstance(obj, (operator.itemgetter, operator.attrgetter, operator.methodcaller)):
+        return (type(obj).__name__, repr(obj))
+    raise _Uncacheable(type(obj).__name__)
+
+
+def _stage(monadic_func: Callable, seen: set = None) -> tuple:
+    if getattr(monadic_func, "cacheable", True) is False:
+        raise _Uncacheable(getattr(monadic_func, "stage_name", "stage"))
+    stage_args: tuple = getattr(monadic_func, "stage_args", None)
+    if stage_args is not None:
+        return ("stage", monadic_func.stage_name, _fingerprint(stage_args, seen))
+    # the closure of the stage holds its arguments
+    return ("stage", getattr(monadic_func, "stage_name", None), _fingerprint(getattr(monadic_func, "f", monadic_func), seen))
+
+
+################################################################################
+
+
+class ResultCache(object):
+    """
+    Outputs of pipelines in directory, $XDG_CACHE_HOME/dw or ~/.cache/dw by default, of at most max_bytes
+    in total. identity is "stat" to tell changed files by path, size, mtime and inode, or "content" to tell
+    them by the SHA-256 of their content, which reads the files once more but survives copies and touches.
+    hits, misses and bypasses count the pipelines that were read from the cache, were written to it, and
+    could not be cached.
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = 1024 * 1024 * 1024, identity: str = "stat"):
+        if identity not in ("stat", "content"):
+            raise ValueError("identity must be stat or content.")
+        if max_bytes < 0:
+            raise ValueError("max_bytes must be non negative value.")
+        if directory is None:
+            directory = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "dw")
+        os.makedirs(directory, exist_ok=True)
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.identity: str = identity
+        self.hits: int = 0
+        self.misses: int = 0
+        self.bypasses: int = 0
+
+    def __repr__(self) -> str:
+        return f"ResultCache({self.directory!r}, max_bytes={self.max_bytes}, identity={self.identity!r})"
+
+    ############################################################################
+    # Lineages are (stages, file names) of monads, kept by IterableMonad.bind. They are None if the
+    # output of the monad cannot be cached.
+
+    def source(self, file_names: Sequence[str], encoding: str, binary: bool) -> tuple:
+        """
+        Return the lineage of cat of local files.
+        """
+        return ((("cat", encoding, binary),), tuple(os.path.abspath(file_name) for file_name in file_names))
+
+    def extended(self, lineage: tuple, monadic_func: Callable) -> tuple:
+        """
+        Return the lineage of the output of monadic_func bound to a monad of lineage.
+        """
+        if lineage is None:
+            return None
+        try:
+            stage: tuple = _stage(monadic_func)
+        except _Uncacheable:
+            return None
+        stages, file_names = lineage
+        source_files: tuple = getattr(monadic_func, "source_files", ())
+        return stages + (stage,), file_names + tuple(os.path.abspath(file_name) for file_name in source_files)
+
+    def _identities(self, file_names: tuple) -> tuple:
+        identities: list = []
+        for file_name in file_names:
+            if self.identity == "content":
+                digest = hashlib.sha256()
+                with open(file_name, "rb") as f:
+                    for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+                        digest.update(block)
+                identities.append((file_name, digest.hexdigest()))
+            else:
+                st: os.stat_result = os.stat(file_name)
+                identities.append((file_name, st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev))
+        return tuple(identities)
+
+    @staticmethod
+    def _digest(obj: object) -> str:
+        # stages may change their output from one version of dw to another
+        return hashlib.sha256(repr((_VERSION, dw.__version__, obj)).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    ############################################################################
+
+    def replayed(self, lineage: tuple, iterable: Iterable) -> Iterable[object]:
+        """
+        Yield the output of a monad of lineage from the cache if it is there, or from iterable while
+        writing it to the cache.
+        """
+        if lineage is None or len(lineage[0]) < 2:
+            # cat alone is cheaper to read again than to copy
+            if lineage is None:
+                self.bypasses += 1
+            yield from iterable
+            return
+        stages, file_names = lineage
+        try:
+            identities: tuple = self._identities(file_names)
+        except OSError:
+            # e.g. a missing file, for cat to raise the error
+            self.bypasses += 1
+            yield from iterable
+            return
+        path: str = self._path(self._digest((stages, identities)))
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            f = None
+        if f is not None:
+            with f:
+                # mark it as recently used
+                os.utime(path)
+                self.hits += 1
+                pickle.load(f)
+                yield from dw._unspill(f)
+            return
+        self.misses += 1
+        header: dict = {"stages": self._digest(stages), "files": file_names}
+        yield from self._stored(path, header, iterable, lambda: self._identities(file_names) == identities)
+
+    def _stored(self, path: str, header: dict, iterable: Iterable, unchanged: Callable) -> Iterable[object]:
+        import tempfile
+
+        fd, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        f = os.fdopen(fd, "wb")
+        try:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            chunk: list = []
+            for obj in iterable:
+                # each record goes downstream as it arrives, e.g. for a following tail
+                yield obj
+                if f is None:
+                    continue
+                chunk.append(obj)
+                if len(chunk) >= dw._SPILL_CHUNK_SIZE:
+                    f = self._dumped(chunk, f)
+                    chunk = []
+            if f is not None and chunk:
+                f = self._dumped(chunk, f)
+            if f is not None:
+                f.close()
+                f = None
+                try:
+                    if unchanged():
+                        os.replace(temporary_path, path)
+                        self._evict()
+                except OSError:
+                    pass
+        finally:
+            if f is not None:
+                f.close()
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+
+    def _dumped(self, chunk: list, f: object) -> object:
+        """
+        Append chunk to f, and return f, or None after closing f if the output is not to be cached.
+        """
+        try:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # records that cannot be pickled are not cached
+            f.close()
+            return None
+        if f.tell() > self.max_bytes:
+            f.close()
+            return None
+        return f
+
+    ############################################################################
+
+    def _entries(self) -> list:
+        """
+        Return (mtime, size, path) of the entries, least recently used first.
+        """
+        entries: list = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(_SUFFIX):
+                continue
+            path: str = os.path.join(self.directory, name)
+            try:
+                st: os.stat_result = os.stat(path)
+            except FileNotFoundError:
+                # evicted by another process
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+        entries.sort()
+        return entries
+
+    def _evict(self) -> None:
+        entries: list = self._entries()
+        total: int = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def size(self) -> int:
+        """
+        Return the bytes of the entries in the cache.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def invalidate(self, pipeline: object = None, file_name: str = None) -> int:
+        """
+        Delete the outputs of pipeline, a monad that the cache could replay, for any files, or the
+        outputs of pipelines that read file_name, or all outputs if neither is given. Return the number
+        of outputs deleted.
+        """
+        stages_digest: str = None
+        if pipeline is not None:
+            lineage: tuple = getattr(pipeline, "lineage", None)
+            if lineage is None:
+                return 0
+            stages_digest = self._digest(lineage[0])
+        file_name = None if file_name is None else os.path.abspath(file_name)
+        removed: int = 0
+        for _, _, path in self._entries():
+            if stages_digest is not None or file_name is not None:
+                try:
+                    with open(path, "rb") as f:
+                        header: dict = pickle.load(f)
+                except (OSError, EOFError, pickle.UnpicklingError):
+                    continue
+                if stages_digest is not None and header["stages"] != stages_digest:
+                    continue
+                if file_name is not None and file_name not in header["files"]:
+                    continue
+            removed += self._remove(path)
+        return removed
+
+    def clear(self) -> int:
+        """
+        Delete all outputs. Return the number of outputs deleted.
+        """
+        return self.invalidate()
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+The dw command, which runs a stage of dw over files or the standard input and prints its records.
+
+    $ cat access.log | dw grep -i error | dw sort | dw uniq
+    $ cat abc.csv | dw csv to_markdown
+
+dw is called many times from shell scripts, so it starts fast: options are parsed here without
+argparse or getopt, which import re, and each subcommand imports what it needs (re for grep, random
+for sample and shuffle, csv for dw csv) only when it runs. benchmarks/cli_bench.py checks the
+import time of dw head against a budget.
+
+Records that are lists or tuples (e.g. of dw count) are printed with their items separated by tabs.
+When the reader of the standard output goes away (e.g. dw cat big.log | head -1), dw exits with
+status 141 as if killed by SIGPIPE, without a traceback.
+"""
+
+from collections.abc import Callable, Iterable, Sequence
+import os
+import sys
+
+import dw
+
+# exit statuses
+_EXIT_FAILURE: int = 1
+_EXIT_USAGE: int = 2
+_EXIT_SIGINT: int = 130
+_EXIT_SIGPIPE: int = 141
+
+
+class UsageError(Exception):
+    pass
+
+
+def parse_args(args: Sequence[str], options: Sequence[tuple]) -> tuple:
+    """
+    Parse args by options, (flags, name, kind) tuples such as (("-n", "--lines"), "n", int). kind is bool
+    for flags without argument, list for options that may be repeated, and otherwise the type of the
+    argument. Short flags may be grouped (-iv) and take their argument attached (-n5), and long flags
+    take it after "=" or as the next arg. Options and operands may be mixed, and "--" ends options.
+    Return (values, operands), where values maps names of the given options to their values.
+    """
+    by_flag: dict = {flag: (name, kind) for flags, name, kind in options for flag in flags}
+    values: dict = {}
+    operands: list = []
+
+    def set_value(flag: str, value: str) -> None:
+        name, kind = by_flag[flag]
+        if kind is list:
+            values.setdefault(name, []).append(value)
+            return
+        try:
+            values[name] = kind(value)
+        except ValueError:
+            raise UsageError(f"invalid argument '{value}' for '{flag}'") from None
+
+    idx: int = 0
+    while idx < len(args):
+        arg: str = args[idx]
+        idx += 1
+        if arg == "--":
+            operands.extend(args[idx:])
+            break
+        if arg == "-" or not arg.startswith("-"):
+            operands.append(arg)
+        elif arg.startswith("--"):
+            flag, eq, value = arg.partition("=")
+            if flag not in by_flag:
+                raise UsageError(f"unrecognized option '{flag}'")
+            if by_flag[flag][1] is bool:
+                if eq:
+                    raise UsageError(f"option '{flag}' doesn't allow an argument")
+                values[by_flag[flag][0]] = True
+                continue
+            if not eq:
+                if idx >= len(args):
+                    raise UsageError(f"option '{flag}' requires an argument")
+                value = args[idx]
+                idx += 1
+            set_value(flag, value)
+        else:
+            pos: int = 1
+            while pos < len(arg):
+                flag: str = "-" + arg[pos]
+                pos += 1
+                if flag not in by_flag:
+                    raise UsageError(f"invalid option -- '{flag[1]}'")
+                if by_flag[flag][1] is bool:
+                    values[by_flag[flag][0]] = True
+                    continue
+                if pos < len(arg):
+                    value: str = arg[pos:]
+                elif idx < len(args):
+                    value: str = args[idx]
+                    idx += 1
+                else:
+                    raise UsageError(f"option requires an argument -- '{flag[1]}'")
+                set_value(flag, value)
+                break
+    return values, operands
+
+
+################################################################################
+
+# name -> (function, usage, options, help text or an object whose __doc__ is the help)
+_COMMANDS: dict = {}
+
+_HELP: tuple = (("-h", "--help"), "help", bool)
+
+
+def _command(name: str, usage: str, *options: tuple, doc: Callable = None) -> Callable:
+    """
+    Register a subcommand. The function takes the values of options and the operands, and returns the
+    records to print, and whether to flush after each record.
+    """
+
+    def deco(f: Callable) -> Callable:
+        _COMMANDS[name] = (f, usage, options + (_HELP,), doc)
+        return f
+
+    return deco
+
+
+def _files(operands: Sequence[str]) -> list:
+    return list(operands) or [dw.STDIO]
+
+
+def _seed(value: str) -> object:
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+@_command("cat", "[OPTION]... [FILE]...",
+          (("-f", "--follow"), "follow", bool),
+          (("-s", "--sleep-interval"), "sleep_interval", float),
+          doc=dw.cat)
+def _cat(values: dict, operands: list) -> tuple:
+    follow: bool = values.get("follow", False)
+    return dw.cat(*_files(operands), follow=follow, sleep_interval=values.get("sleep_interval", 1.0)), follow
+
+
+@_command("head", "[OPTION]... [FILE]...",
+          (("-n", "--lines"), "n", int),
+          doc=dw.head)
+def _head(values: dict, operands: list) -> tuple:
+    return dw.cat(*_files(operands)) | dw.head(values.get("n", 10)), False
+
+
+@_command("tail", "[OPTION]... [FILE]...",
+          (("-n", "--lines"), "n", int),
+          (("-f", "--follow"), "follow", bool),
+          (("-s", "--sleep-interval"), "sleep_interval", float),
+          doc=dw.tail)
+def _tail(values: dict, operands: list) -> tuple:
+    follow: bool = values.get("follow", False)
+    m: dw.IterableMonad = dw.cat(*_files(operands), sleep_interval=values.get("sleep_interval", 1.0))
+    return m | dw.tail(values.get("n", 10), follow=follow), follow
+
+
+@_command("grep", "[OPTION]... PATTERNS [FILE]...",
+          (("-e", "--regexp"), "patterns", list),
+          (("-F", "--fixed-strings"), "fixed_strings", bool),
+          (("-i", "--ignore-case"), "ignore_case", bool),
+          (("-n", "--line-number"), "line_number", bool),
+          (("-v", "--invert-match"), "invert_match", bool),
+          doc=dw.grep)
+def _grep(values: dict, operands: list) -> tuple:
+    patterns: list = values.pop("patterns", None)
+    if patterns is None:
+        if not operands:
+            raise UsageError("no PATTERNS")
+        patterns = [operands.pop(0)]
+    return dw.cat(*_files(operands)) | dw.grep(*patterns, **values), False
+
+
+def _number(line: str) -> float:
+    # sort -n compares the leading number of lines, and lines without one as 0
+    fields: list = line.split(None, 1)
+    try:
+        return float(fields[0]) if fields else 0.0
+    except ValueError:
+        return 0.0
+
+
+@_command("sort", "[OPTION]... [FILE]...",
+          (("-n", "--numeric-sort"), "numeric", bool),
+          (("-r", "--reverse"), "reverse", bool),
+          (("-u", "--unique"), "unique", bool),
+          (("-S", "--buffer-size"), "buffer_size", int),
+          (("-T", "--temporary-directory"), "temporary_directory", str),
+          doc=dw.sorted)
+def _sort(values: dict, operands: list) -> tuple:
+    m: dw.IterableMonad = dw.cat(*_files(operands)) | dw.sorted(key=_number if values.get("numeric") else None,
+                                                                reverse=values.get("reverse", False),
+                                                                buffer_size=values.get("buffer_size"),
+                                                                temporary_directory=values.get("temporary_directory"))
+    if values.get("unique"):
+        m = m | dw.uniq()
+    return m, False
+
+
+@_command("uniq", "[OPTION]... [FILE]...",
+          (("-g", "--globally"), "globally", bool),
+          (("--approximate",), "approximate", bool),
+          doc=dw.uniq)
+def _uniq(values: dict, operands: list) -> tuple:
+    return dw.cat(*_files(operands)) | dw.uniq(**values), False
+
+
+@_command("count", "[OPTION]... [FILE]...",
+          (("--top",), "top", int),
+          (("--approximate",), "approximate", bool),
+          doc=dw.count)
+def _count(values: dict, operands: list) -> tuple:
+    return dw.cat(*_files(operands)) | dw.count(**values), False
+
+
+@_command("count_distinct", "[OPTION]... [FILE]...",
+          (("--approximate",), "approximate", bool),
+          doc=dw.count_distinct)
+def _count_distinct(values: dict, operands: list) -> tuple:
+    return dw.cat(*_files(operands)) | dw.count_distinct(**values), False
+
+
+@_command("sample", "[OPTION]... -k K [FILE]...",
+          (("-k", "-n", "--count"), "k", int),
+          (("--seed",), "seed", _seed),
+          doc=dw.sample)
+def _sample(values: dict, operands: list) -> tuple:
+    if "k" not in values:
+        raise UsageError("no -k K")
+    return dw.cat(*_files(operands)) | dw.sample(values["k"], seed=values.get("seed")), False
+
+
+@_command("shuffle", "[OPTION]... [FILE]...",
+          (("--seed",), "seed", _seed),
+          (("-S", "--buffer-size"), "buffer_size", int),
+          (("-T", "--temporary-directory"), "temporary_directory", str),
+          doc=dw.shuffle)
+def _shuffle(values: dict, operands: list) -> tuple:
+    return dw.cat(*_files(operands)) | dw.shuffle(**values), False
+
+
+@_command("reversed", "[FILE]...", doc=dw.reversed)
+def _reversed(values: dict, operands: list) -> tuple:
+    return dw.cat(*_files(operands)) | dw.reversed(), False
+
+
+@_command("tee", "[OPTION]... [FILE]...",
+          (("-a", "--append"), "append", bool),
+          doc=dw.tee)
+def _tee(values: dict, operands: list) -> tuple:
+    return dw.cat(dw.STDIO) | dw.tee(*operands, **values), True
+
+
+@_command("csv", "SUBCOMMAND [OPTION]... [FILE]...",
+          (("-d", "--delimiter"), "delimiter", str),
+          (("--field",), "fields", list),
+          (("--formula",), "formulas", list),
+          (("--csv",), "csv", bool),
+          (("-S", "--buffer-size"), "buffer_size", int),
+          (("-T", "--temporary-directory"), "temporary_directory", str),
+          doc="""
+    Read CSV with a header line and run SUBCOMMAND over the rows, see dw.csv.
+      to_markdown               print the rows as a Markdown table
+      format                    print the rows as CSV
+      pivot                     group the rows by the values of --field, and print the results of
+                                --formula for each group, see dw.pivot.parse_formula
+      -d, --delimiter=DELIM     use DELIM instead of comma
+      --field=FIELD             with pivot, a column to group by. May be repeated.
+      --formula=FORMULA         with pivot, NAME=FUNCTION(FIELD) with FUNCTION one of sum, count, min, max,
+                                mean and distinct. May be repeated.
+      --csv                     with pivot, print CSV instead of a Markdown table
+      -S, --buffer-size=SIZE    with pivot, hold at most SIZE groups in memory
+      -T, --temporary-directory=DIR
+                                with pivot, use DIR for temporaries, not $TMPDIR or /tmp
+    """)
+def _csv(values: dict, operands: list) -> tuple:
+    import dw.csv
+
+    if not operands:
+        raise UsageError("no SUBCOMMAND")
+    subcommand: str = operands.pop(0)
+    delimiter: str = values.get("delimiter", ",")
+    if subcommand == "pivot":
+        from dw.pivot import number, parse_formula, pivot
+
+        formulas: list = values.get("formulas", [])
+        try:
+            aggregators: list = [parse_formula(formula) for formula in formulas]
+        except ValueError as e:
+            raise UsageError(str(e)) from None
+        # the fields to aggregate are converted to numbers where they are ones
+        types: dict = {aggregator.field: number for aggregator in aggregators if aggregator.field is not None}
+        rows: dw.IterableMonad = dw.csv.cat(*_files(operands), types=types, delimiter=delimiter)
+        m: dw.IterableMonad = rows | pivot(*values.get("fields", []), formulas=formulas, buffer_size=values.get("buffer_size"),
+                                           temporary_directory=values.get("temporary_directory")) | _aggregated
+        return m | (dw.csv.format(delimiter=delimiter) if values.get("csv") else dw.csv.to_markdown()), False
+    rows: dw.IterableMonad = dw.csv.cat(*_files(operands), delimiter=delimiter)
+    if subcommand == "to_markdown":
+        return rows | dw.csv.to_markdown(), False
+    elif subcommand == "format":
+        return rows | dw.csv.format(delimiter=delimiter), False
+    raise UsageError(f"unknown SUBCOMMAND '{subcommand}'")
+
+
+@dw.pipeable()
+def _aggregated(iterable: Iterable) -> Iterable[object]:
+    # e.g. sum of a column that is not numbers
+    try:
+        yield from iterable
+    except TypeError as e:
+        raise UsageError(f"cannot aggregate the values of a --formula: {e}") from None
+
+
+################################################################################
+
+
+def _help(doc: object) -> str:
+    text: str = doc if isinstance(doc, str) or doc is None else doc.__doc__
+    return (text or "").strip("\n")
+
+
+def _print_help(out: object) -> None:
+    out.write("Usage: dw COMMAND [OPTION]... [FILE]...\n"
+              "Run a stage of dw over FILEs, or the standard input if no FILE is given or FILE is -.\n\n"
+              "Commands:\n")
+    for name, (_, _, _, doc) in _COMMANDS.items():
+        lines: list = _help(doc).strip().splitlines()
+        summary: str = lines[0] if lines else ""
+        out.write(f"  {name:<16}{summary}\n")
+    out.write("\nSee 'dw COMMAND --help' for the options of COMMAND.\n")
+
+
+def _write(records: Iterable[object], flush: bool) -> None:
+    stdout: object = sys.stdout
+    write: Callable = stdout.write
+    for obj in records:
+        if isinstance(obj, str):
+            write(obj)
+        elif isinstance(obj, (list, tuple)):
+            write("\t".join([str(item) for item in obj]))
+        else:
+            write(str(obj))
+        write("\n")
+        if flush:
+            stdout.flush()
+    stdout.flush()
+
+
+def main(args: Sequence[str]) -> int:
+    """
+    Run the dw command with args, the arguments after the command name, and return the exit status.
+    """
+    if not args:
+        _print_help(sys.stderr)
+        return _EXIT_USAGE
+    if args[0] in ("-h", "--help", "help"):
+        _print_help(sys.stdout)
+        return 0
+    name: str = args[0]
+    if name not in _COMMANDS:
+        sys.stderr.write(f"dw: '{name}' is not a dw command. See 'dw --help'.\n")
+        return _EXIT_USAGE
+    f, usage, options, doc = _COMMANDS[name]
+    try:
+        values, operands = parse_args(args[1:], options)
+        if values.pop("help", False):
+            sys.stdout.write(f"Usage: dw {name} {usage}\n")
+            if _help(doc):
+                sys.stdout.write(_help(doc) + "\n")
+            return 0
+        records, flush = f(values, operands)
+        _write(records, flush)
+    except UsageError as e:
+        sys.stderr.write(f"dw {name}: {e}\nUsage: dw {name} {usage}\nTry 'dw {name} --help' for more information.\n")
+        return _EXIT_USAGE
+    except BrokenPipeError:
+        # The reader of stdout went away. stdout is pointed to devnull so that flushing it at exit
+        # does not raise again.
+        devnull: int = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+        return _EXIT_SIGPIPE
+    except KeyboardInterrupt:
+        return _EXIT_SIGINT
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"dw {name}: {e}\n")
+        return _EXIT_FAILURE
+    return 0
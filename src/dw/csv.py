@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+CSV records for dw pipelines.
+
+    >>> import dw.csv
+    >>> dw.csv.cat("abc.csv", types={"c": int}) | dw.filter(lambda row: row["c"] > 1) | dw.csv.format() > "out.csv"
+    >>> dw.csv.cat("abc.csv") | dw.csv.to_markdown() > "-"
+
+Rows are Row objects that share the Header of their file, instead of a dict per row as csv.DictReader
+yields. A Row keeps its fields as one str and an array of the offsets where the fields end, so a
+retained row takes a fraction of the memory of a dict or a tuple of strs. Fields are sliced out of the
+str and converted by the types of the header only when they are accessed, so columns that are never
+read cost nothing.
+"""
+
+from collections.abc import Callable, Iterable, Sequence
+import array
+import csv
+import functools
+import io
+import itertools
+import os
+import sys
+
+import dw
+
+################################################################################
+
+
+class Row(object):
+    """
+    Fields of a CSV record with the Header of its file. row["name"] and row[idx] return a field converted
+    by the type of its column, which is None for an empty field of a typed column. row.field(idx)
+    returns the field as read. Rows that are shorter than the header are padded with empty fields.
+    """
+
+    __slots__ = ("_data", "_ends")
+
+    # set in the subclass that each Header makes
+    header: object = None
+
+    def __init__(self, fields: Sequence[str]):
+        self._data: str = "".join(fields)
+        self._ends: array.array = array.array("I", itertools.accumulate(map(len, fields)))
+
+    def field(self, idx: int) -> str:
+        ends: array.array = self._ends
+        return self._data[ends[idx - 1] if idx > 0 else 0:ends[idx]]
+
+    @property
+    def fields(self) -> tuple:
+        data: str = self._data
+        start: int = 0
+        fields: list = []
+        for end in self._ends:
+            fields.append(data[start:end])
+            start = end
+        return tuple(fields)
+
+    def __getitem__(self, key: object) -> object:
+        header: Header = self.header
+        idx: int = header.index[key] if isinstance(key, str) else key
+        if idx < 0:
+            idx += len(self._ends)
+        ends: array.array = self._ends
+        field: str = self._data[ends[idx - 1] if idx > 0 else 0:ends[idx]]
+        converter: Callable = header.converters[idx] if idx < len(header.converters) else None
+        if converter is None:
+            return field
+        return converter(field) if field else None
+
+    def __getattr__(self, name: str) -> object:
+        index: dict = self.header.index
+        if name.startswith("_") or name not in index:
+            raise AttributeError(name)
+        return self[index[name]]
+
+    def get(self, key: object, default: object = None) -> object:
+        try:
+            return self[key]
+        except (KeyError, IndexError):
+            return default
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def __iter__(self) -> Iterable[object]:
+        for idx in range(len(self._ends)):
+            yield self[idx]
+
+    def keys(self) -> tuple:
+        return self.header.names
+
+    def values(self) -> list:
+        return list(self)
+
+    def items(self) -> list:
+        return list(zip(self.header.names, self))
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Row):
+            return NotImplemented
+        return self.header.names == other.header.names and self._data == other._data and self._ends == other._ends
+
+    def __hash__(self) -> int:
+        return hash((self.header.names, self._data, tuple(self._ends)))
+
+    def __reduce__(self) -> tuple:
+        return (_row, (self.header, self.fields))
+
+    def __repr__(self) -> str:
+        names: tuple = self.header.names
+        fields: tuple = self.fields
+        return "Row(" + ", ".join(f"{names[idx] if idx < len(names) else idx}={field!r}" for idx, field in enumerate(fields)) + ")"
+
+
+def _row(header: object, fields: Sequence[str]) -> Row:
+    return header.row_class(fields)
+
+
+class Header(object):
+    """
+    Column names and types shared by the rows of a CSV file. types maps column names or positions to
+    callables that convert fields, e.g. {"price": float}, or is a sequence of callables (or None) in
+    column order.
+    """
+
+    def __init__(self, names: Sequence[str], types: object = None):
+        self.names: tuple = tuple(names)
+        # the first of duplicated names wins, as in csv.DictReader
+        self.index: dict = {}
+        for idx, name in enumerate(self.names):
+            self.index.setdefault(name, idx)
+        self.converters: tuple = _converters(self.names, self.index, types)
+        self.row_class: type = type("Row", (Row,), {"__slots__": (), "header": self})
+
+    def __reduce__(self) -> tuple:
+        return (_header, (self.names, self.converters))
+
+    def __repr__(self) -> str:
+        return f"Header({self.names!r})"
+
+
+@functools.lru_cache(maxsize=None)
+def _header(names: tuple, converters: tuple) -> Header:
+    # rows that are unpickled, e.g. after sorted spills them, share one Header per file again
+    return Header(names, converters)
+
+
+def _converters(names: tuple, index: dict, types: object) -> tuple:
+    if types is None:
+        return ()
+    if isinstance(types, dict):
+        converters: list = [None for _ in names]
+        for key, converter in types.items():
+            idx: int = index[key] if isinstance(key, str) else key
+            if idx >= len(converters):
+                converters.extend(None for _ in range(idx + 1 - len(converters)))
+            converters[idx] = converter
+        return tuple(converters)
+    return tuple(types)
+
+
+################################################################################
+
+
+def _rows(records: Iterable[list], header: object, types: object) -> Iterable[Row]:
+    """
+    Yield Rows of records, the lists of fields that csv.reader yields, with the first record as the
+    names of the columns if header is True.
+    """
+    records = iter(records)
+    if header is True:
+        names: list = next(records, None)
+        if names is None:
+            return
+    elif header:
+        names: Sequence = header
+    else:
+        first: list = next(records, None)
+        if first is None:
+            return
+        names: Sequence = [str(idx) for idx in range(len(first))]
+        records = itertools.chain([first], records)
+    row_class: type = Header(names, types).row_class
+    width: int = len(names)
+    for fields in records:
+        if len(fields) < width:
+            fields.extend("" for _ in range(width - len(fields)))
+        yield row_class(fields)
+
+
+@dw.monadic_function_returner
+def parse(header: object = True, types: object = None, delimiter: str = ",", **fmtparams) -> Callable:
+    """
+    Parse lines into Rows. See cat for the options.
+    Quoted fields may span lines, and the line breaks in them become "\\n".
+    """
+
+    @dw.pipeable()
+    def _parse(iterable: Iterable) -> Iterable[Row]:
+        # cat removes line breaks, which csv.reader needs to keep them in quoted fields
+        lines: Iterable[str] = (line + "\n" for line in iterable)
+        yield from _rows(csv.reader(lines, delimiter=delimiter, **fmtparams), header, types)
+
+    return _parse
+
+
+def cat(*sources: object, encoding: str = "utf-8", header: object = True, types: object = None,
+        delimiter: str = ",", **fmtparams) -> dw.IterableMonad:
+    """
+    Concatenate CSV files and iterables of lines into Rows. A str without line breaks is a file name,
+    and "-" is the standard input. Files compressed with gzip, bzip2 or xz are decompressed.
+      header                    True if the first record of each source names the columns, a sequence of
+                                names, or False to name the columns "0", "1", ...
+      types                     {name or position: callable} or a sequence of callables (or None) in column
+                                order, to convert the fields of the columns when they are accessed
+      delimiter                 the one-character string that separates fields (default ",")
+    The other keyword arguments are passed to csv.reader, e.g. quotechar.
+    """
+
+    def _cat() -> Iterable[Row]:
+        for source in sources:
+            if not dw._is_file_name(source):
+                yield from dw.cat(source) | parse(header, types, delimiter, **fmtparams)
+                continue
+            if source == dw.STDIO:
+                f: io.TextIOWrapper = io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, newline="")
+                try:
+                    yield from _rows(csv.reader(f, delimiter=delimiter, **fmtparams), header, types)
+                finally:
+                    f.detach()
+                continue
+            if not os.path.exists(source):
+                raise FileNotFoundError(source)
+            compression: object = dw._compression(source, reading=True)
+            opener: Callable = io.open if compression is None else compression.open
+            with opener(source, "rt", encoding=encoding, newline="") as f:
+                yield from _rows(csv.reader(f, delimiter=delimiter, **fmtparams), header, types)
+
+    return dw.IterableMonad(_cat())
+
+
+################################################################################
+
+
+class _LastLine(object):
+    """
+    File object for csv.writer that keeps the line written last, without its line break.
+    """
+
+    __slots__ = ("line",)
+
+    def write(self, line: str) -> None:
+        self.line = line[:-2]
+
+
+@dw.monadic_function_returner
+def format(header: object = True, delimiter: str = ",", **fmtparams) -> Callable:
+    """
+    Format Rows, dicts and sequences as CSV lines without line breaks, e.g. for tee.
+      header                    True to write the names of the columns first, taken from the Header of
+                                the first Row or the keys of the first dict, and not written for
+                                sequences, which have no names, a sequence of names to write instead,
+                                or False
+      delimiter                 the one-character string that separates fields (default ",")
+    dicts are written in the order of the names. The other keyword arguments are passed to csv.writer.
+    Fields of Rows are written as they were read.
+    """
+
+    @dw.pipeable()
+    def _format(iterable: Iterable) -> Iterable[str]:
+        buffer: _LastLine = _LastLine()
+        # fields with line breaks are quoted only if the line terminator contains them
+        writer: object = csv.writer(buffer, delimiter=delimiter, lineterminator="\r\n", **fmtparams)
+        writerow: Callable = writer.writerow
+        iterator = iter(iterable)
+        first: object = next(iterator, None)
+        if first is None:
+            return
+        names: Sequence = None
+        if isinstance(first, Row):
+            names = first.header.names
+        elif isinstance(first, dict):
+            names = list(first)
+        if header and (header is not True or names is not None):
+            writerow(names if header is True else header)
+            yield buffer.line
+        if isinstance(first, dict):
+            if header and header is not True:
+                names = header
+            for obj in itertools.chain([first], iterator):
+                writerow([obj.get(name, "") for name in names])
+                yield buffer.line
+            return
+        for obj in itertools.chain([first], iterator):
+            writerow(obj.fields if isinstance(obj, Row) else obj)
+            yield buffer.line
+
+    return _format
+
+
+def _cell(obj: object) -> str:
+    return "" if obj is None else str(obj).replace("|", "\\|")
+
+
+@dw.monadic_function_returner
+def to_markdown(min_width: int = 4) -> Callable:
+    """
+    Format Rows, dicts and sequences as a Markdown table, with the names of the columns of the first Row
+    or dict as its header. Columns are padded to the width of their longest field, so all records are
+    held until the end of input.
+    """
+
+    @dw.pipeable()
+    def _to_markdown(iterable: Iterable) -> Iterable[str]:
+        table: list = []
+        names: Sequence = None
+        for obj in iterable:
+            if names is None:
+                if isinstance(obj, Row):
+                    names = obj.header.names
+                elif isinstance(obj, dict):
+                    names = list(obj)
+                else:
+                    names = [str(idx) for idx in range(len(obj))]
+                table.append([_cell(name) for name in names])
+            if isinstance(obj, Row):
+                table.append([_cell(field) for field in obj.fields])
+            elif isinstance(obj, dict):
+                table.append([_cell(obj.get(name)) for name in names])
+            else:
+                table.append([_cell(field) for field in obj])
+        dw._note_buffered(len(table))
+        if not table:
+            return
+        width: int = max(len(fields) for fields in table)
+        widths: list = [min_width for _ in range(width)]
+        for fields in table:
+            for idx, field in enumerate(fields):
+                if len(field) > widths[idx]:
+                    widths[idx] = len(field)
+
+        def _line(fields: list) -> str:
+            fields = fields + ["" for _ in range(width - len(fields))]
+            return "| " + " | ".join(field.ljust(widths[idx]) for idx, field in enumerate(fields)) + " |"
+
+        yield _line(table[0])
+        yield "| " + " | ".join("-" * w for w in widths) + " |"
+        for fields in table[1:]:
+            yield _line(fields)
+
+    return _to_markdown
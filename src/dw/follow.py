@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Follow growing files as tail -F does, for cat(..., follow=True) and cat(...) | tail(n, follow=True).
+
+Lines are yielded once their line break is written. A file that is truncated is read again from its
+beginning, and a file whose name is given to another inode (rotation) is read from the beginning of
+the new file after the rest of the old one. A missing file is waited for.
+
+The files are waited on with inotify on Linux, and otherwise polled at intervals that double from
+sleep_interval / 64 up to sleep_interval while nothing changes. inotify waits also time out after
+sleep_interval, so changes that inotify does not report (e.g. on NFS) are seen within sleep_interval.
+"""
+
+from collections.abc import Iterable, Sequence
+import io
+import os
+
+# inotify(7)
+_IN_MODIFY: int = 0x00000002
+_IN_ATTRIB: int = 0x00000004
+_IN_CLOSE_WRITE: int = 0x00000008
+_IN_MOVED_FROM: int = 0x00000040
+_IN_MOVED_TO: int = 0x00000080
+_IN_CREATE: int = 0x00000100
+_IN_DELETE: int = 0x00000200
+_IN_DIRECTORY_MASK: int = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+class _PollingWatcher(object):
+    """
+    Sleep between polls, for intervals that double while nothing changes.
+    """
+
+    def __init__(self, sleep_interval: float):
+        self.max_interval: float = sleep_interval
+        self.min_interval: float = sleep_interval / 64
+        self.interval: float = self.min_interval
+
+    def changed(self) -> None:
+        self.interval = self.min_interval
+
+    def wait(self) -> None:
+        import time
+        time.sleep(self.interval)
+        self.interval = min(2 * self.interval, self.max_interval)
+
+    def close(self) -> None:
+        pass
+
+
+class _InotifyWatcher(object):
+    """
+    Wait for inotify events in the directories of the files, for at most sleep_interval.
+    """
+
+    def __init__(self, directories: Iterable[str], sleep_interval: float):
+        import ctypes
+
+        # the symbols of the process, which include those of libc
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.sleep_interval: float = sleep_interval
+        self.fd: int = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        try:
+            for directory in directories:
+                if libc.inotify_add_watch(self.fd, os.fsencode(directory), _IN_DIRECTORY_MASK) < 0:
+                    raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def changed(self) -> None:
+        pass
+
+    def wait(self) -> None:
+        import select
+
+        readable, _, _ = select.select([self.fd], [], [], self.sleep_interval)
+        if readable:
+            # the events are not needed, the files are checked again
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def _watcher(file_names: Sequence[str], sleep_interval: float) -> object:
+    import sys
+
+    if sys.platform.startswith("linux"):
+        try:
+            directories: set = {os.path.dirname(os.path.abspath(file_name)) for file_name in file_names}
+            return _InotifyWatcher(directories, sleep_interval)
+        except (OSError, AttributeError):
+            # no inotify in libc, or too many watches
+            pass
+    return _PollingWatcher(sleep_interval)
+
+
+def _tail_offset(f: io.RawIOBase, size: int, n: int, block_size: int = 64 * 1024) -> int:
+    """
+    Return the offset of the first of the last n lines of f.
+    """
+    if n == 0:
+        return size
+    end: int = size
+    if size:
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            # the last line break ends the last line
+            end = size - 1
+    count: int = 0
+    pos: int = end
+    while pos > 0:
+        read_size: int = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        block: bytes = f.read(read_size)
+        idx: int = len(block)
+        while True:
+            idx = block.rfind(b"\n", 0, idx)
+            if idx < 0:
+                break
+            count += 1
+            if count == n:
+                return pos + idx + 1
+    return 0
+
+
+class _FollowedFile(object):
+
+    def __init__(self, file_name: str, n: int):
+        self.file_name: str = file_name
+        self.f: io.RawIOBase = None
+        # bytes of the last line, until its line break is written
+        self.rest: bytes = b""
+        self.open(n)
+
+    def open(self, n: int = None) -> None:
+        try:
+            self.f = io.open(self.file_name, "rb", buffering=0)
+        except FileNotFoundError:
+            self.f = None
+            return
+        if n is not None:
+            self.f.seek(_tail_offset(self.f, os.fstat(self.f.fileno()).st_size, n))
+
+    def read_lines(self, buffer_size: int) -> list:
+        """
+        Return the lines written since the last call, with the rest of the old file and the lines
+        of the new file if the file was rotated.
+        """
+        lines: list = []
+        if self.f is None:
+            self.open()
+            if self.f is None:
+                return lines
+        if os.fstat(self.f.fileno()).st_size < self.f.tell():
+            # truncated
+            self.f.seek(0)
+            self.rest = b""
+        self._read(lines, buffer_size)
+
+        try:
+            stat: os.stat_result = os.stat(self.file_name)
+        except FileNotFoundError:
+            return lines
+        fstat: os.stat_result = os.fstat(self.f.fileno())
+        if (stat.st_dev, stat.st_ino) != (fstat.st_dev, fstat.st_ino):
+            # rotated: the old file has been read to its end
+            if self.rest:
+                lines.append(self.rest)
+                self.rest = b""
+            self.f.close()
+            self.open()
+            if self.f is not None:
+                self._read(lines, buffer_size)
+        return lines
+
+    def _read(self, lines: list, buffer_size: int) -> None:
+        while True:
+            data: bytes = self.f.read(buffer_size)
+            if not data:
+                return
+            if self.rest:
+                data = self.rest + data
+            block_lines: list = data.split(b"\n")
+            self.rest = block_lines.pop()
+            lines.extend(block_lines)
+
+    def close(self) -> None:
+        if self.f is not None:
+            self.f.close()
+
+
+def follow_lines(file_names: Sequence[str], encoding: str, binary: bool, sleep_interval: float = 1.0,
+                 n: int = None, buffer_size: int = 1024 * 1024) -> Iterable[object]:
+    """
+    Yield the lines of file_names, or the last n lines of each if n is given, and then the lines
+    appended to them, forever. Lines are split at b"\\n" and trailing b"\\r" are removed, so the
+    encoding must be ASCII compatible.
+    """
+    followed_files: list = []
+    watcher: object = None
+    try:
+        for file_name in file_names:
+            followed_files.append(_FollowedFile(file_name, n))
+        watcher = _watcher(file_names, sleep_interval)
+        while True:
+            changed: bool = False
+            for followed_file in followed_files:
+                lines: list = followed_file.read_lines(buffer_size)
+                if lines:
+                    changed = True
+                for line in lines:
+                    line = line.rstrip(b"\r")
+                    yield line if binary else line.decode(encoding)
+            if changed:
+                watcher.changed()
+            else:
+                watcher.wait()
+    finally:
+        for followed_file in followed_files:
+            followed_file.close()
+        if watcher is not None:
+            watcher.close()
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+On-disk trigram index of files, consulted by cat(..., index=...) | grep(...) to read only the blocks
+of the files that can match.
+
+    >>> from dw.index import TrigramIndex
+    >>> index = TrigramIndex("logs.dwindex")
+    >>> index.update(*glob.glob("logs/*.log"))
+    >>> index.save()
+    >>> dw.cat(*glob.glob("logs/*.log"), index="logs.dwindex") | dw.grep("ERROR.*timeout") > "-"
+
+Files are indexed in blocks of about block_size bytes that end at line breaks, with the set of trigrams
+(3 bytes, ASCII lower cased) of each block. Candidate blocks are still matched with grep, so results are
+the same as without the index, provided that lines are separated by b"\n" and the encoding is ASCII
+compatible, as for cat(..., memory_map=True). A file that was appended to is indexed from its end of
+indexed lines on, and its unindexed tail is always read. Patterns without literals of at least 3 characters that every
+match must contain, -v, -n and compressed files are not accelerated and fall back to a full scan.
+"""
+
+from collections.abc import Iterable
+import functools
+import hashlib
+import io
+import os
+import pickle
+import sys
+
+_VERSION: int = 1
+# bytes hashed at the beginning and at the end of the indexed part of a file to detect rewrites
+_DIGEST_SIZE: int = 4096
+# combinations of alternatives beyond which a pattern's constraints are simplified
+_MAX_ALTERNATIVES: int = 64
+
+
+def _digest(f: io.RawIOBase, start: int, end: int) -> bytes:
+    f.seek(start)
+    return hashlib.blake2b(f.read(end - start), digest_size=16).digest()
+
+
+def _trigrams(data: bytes) -> set:
+    data = data.lower()
+    return {data[idx:idx + 3] for idx in range(len(data) - 2)}
+
+
+class _FileIndex(object):
+
+    def __init__(self):
+        # bytes up to the last line break that is indexed
+        self.indexed_size: int = 0
+        self.head_digest: bytes = b""
+        self.tail_digest: bytes = b""
+        # (start, end) of each block
+        self.blocks: list = []
+        # trigram -> sorted list of block numbers
+        self.postings: dict = {}
+
+    def _add_block(self, start: int, data: bytes) -> None:
+        number: int = len(self.blocks)
+        self.blocks.append((start, start + len(data)))
+        postings: dict = self.postings
+        for trigram in _trigrams(data):
+            numbers: list = postings.get(trigram)
+            if numbers is None:
+                postings[trigram] = [number]
+            else:
+                numbers.append(number)
+
+    def extend(self, f: io.RawIOBase, block_size: int) -> None:
+        """
+        Index the lines of f after indexed_size.
+        """
+        f.seek(self.indexed_size)
+        start: int = self.indexed_size
+        rest: bytes = b""
+        while True:
+            data: bytes = f.read(block_size)
+            if not data:
+                break
+            data = rest + data
+            end: int = data.rfind(b"\n") + 1
+            if end == 0:
+                rest = data
+                continue
+            self._add_block(start, data[:end])
+            start += end
+            rest = data[end:]
+        self.indexed_size = start
+        self.head_digest = _digest(f, 0, min(start, _DIGEST_SIZE))
+        self.tail_digest = _digest(f, max(0, start - _DIGEST_SIZE), start)
+
+    def is_prefix_of(self, f: io.RawIOBase, size: int) -> bool:
+        """
+        Return whether the indexed part of the file is unchanged, i.e. the file was at most appended to.
+        """
+        start: int = self.indexed_size
+        return size >= start and self.head_digest == _digest(f, 0, min(start, _DIGEST_SIZE)) \
+            and self.tail_digest == _digest(f, max(0, start - _DIGEST_SIZE), start)
+
+    def candidate_blocks(self, alternatives: list) -> set:
+        numbers: set = set()
+        for literals in alternatives:
+            trigrams: set = set()
+            for literal in literals:
+                trigrams |= _trigrams(literal)
+            postings: list = [self.postings.get(trigram, []) for trigram in trigrams]
+            postings.sort(key=len)
+            candidates: set = set(postings[0])
+            for numbers_of_trigram in postings[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(numbers_of_trigram)
+            numbers |= candidates
+        return numbers
+
+
+class TrigramIndex(object):
+    """
+    Trigram index of files, saved to and loaded from path.
+    """
+
+    def __init__(self, path: str = None, block_size: int = 64 * 1024):
+        self.path: str = path
+        self.block_size: int = block_size
+        # absolute file name -> _FileIndex
+        self.files: dict = {}
+        if path is not None and os.path.exists(path):
+            with io.open(path, "rb") as f:
+                version, self.block_size, self.files = pickle.load(f)
+            if version != _VERSION:
+                raise ValueError(f"{path} is an index of version {version}, not {_VERSION}")
+
+    def save(self, path: str = None) -> None:
+        path = path or self.path
+        temporary_path: str = path + ".tmp"
+        with io.open(temporary_path, "wb") as f:
+            pickle.dump((_VERSION, self.block_size, self.files), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+    def update(self, *file_names: str) -> bool:
+        """
+        Index new files, the appended lines of indexed files, and rewritten files from scratch.
+        Compressed files are not indexed. Return whether anything was indexed.
+        """
+        import dw
+
+        updated: bool = False
+        for file_name in file_names:
+            if dw._compression(file_name, reading=True) is not None:
+                continue
+            key: str = os.path.abspath(file_name)
+            file_index: _FileIndex = self.files.get(key)
+            with io.open(file_name, "rb", buffering=0) as f:
+                size: int = os.fstat(f.fileno()).st_size
+                if file_index is not None and file_index.is_prefix_of(f, size):
+                    if size == file_index.indexed_size:
+                        continue
+                else:
+                    file_index = self.files[key] = _FileIndex()
+                    updated = True
+                indexed_size: int = file_index.indexed_size
+                file_index.extend(f, self.block_size)
+                updated = updated or file_index.indexed_size != indexed_size
+        return updated
+
+    def candidate_ranges(self, file_name: str, alternatives: list) -> list:
+        """
+        Return the (start, end) byte ranges of file_name that contain every literal of one of alternatives,
+        a list of lists of bytes, or None if the whole file must be read.
+        """
+        file_index: _FileIndex = self.files.get(os.path.abspath(file_name))
+        if file_index is None or alternatives is None:
+            return None
+        with io.open(file_name, "rb", buffering=0) as f:
+            size: int = os.fstat(f.fileno()).st_size
+            if not file_index.is_prefix_of(f, size):
+                return None
+        ranges: list = []
+        for number in sorted(file_index.candidate_blocks(alternatives)):
+            start, end = file_index.blocks[number]
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        if file_index.indexed_size < size:
+            ranges.append((file_index.indexed_size, size))
+        return ranges
+
+
+################################################################################
+
+
+@functools.lru_cache(maxsize=None)
+def _folded_to_non_ascii() -> frozenset:
+    """
+    Return the codes of the ASCII characters that match non ASCII characters under re.IGNORECASE, e.g.
+    "k" matches KELVIN SIGN and "i" matches LATIN CAPITAL LETTER I WITH DOT ABOVE.
+    """
+    import re, string
+    non_ascii: str = "".join(map(chr, range(128, sys.maxunicode + 1)))
+    candidates: set = set(re.findall(f"[{string.ascii_letters}]", non_ascii, re.IGNORECASE))
+    return frozenset(ord(c) for c in string.ascii_letters
+                     if any(re.fullmatch(c, u, re.IGNORECASE) for u in candidates))
+
+
+def _required_literals(pattern: object, flags: int, encoding: str) -> list:
+    """
+    Return alternatives, a list of lists of bytes such that every match of pattern contains all
+    the bytes of one of the lists, or None if no such literals of at least 3 bytes are known.
+    """
+    import re
+    try:
+        import re._parser as sre_parse
+        from re._constants import LITERAL, SUBPATTERN, BRANCH, MAX_REPEAT, MIN_REPEAT, POSSESSIVE_REPEAT
+    except ImportError:
+        import sre_parse
+        from sre_constants import LITERAL, SUBPATTERN, BRANCH, MAX_REPEAT, MIN_REPEAT
+        POSSESSIVE_REPEAT = MAX_REPEAT
+
+    parsed = sre_parse.parse(pattern, flags)
+    is_bytes: bool = isinstance(pattern, bytes)
+
+    def usable(code: int, ignore_case: bool) -> bool:
+        # Non ASCII characters and the ASCII characters that match non ASCII ones can match characters
+        # whose bytes differ after ASCII lower casing.
+        return not ignore_case or is_bytes or code < 128 and code not in _folded_to_non_ascii()
+
+    def product(alternatives: list, other: list) -> list:
+        if len(alternatives) * len(other) > _MAX_ALTERNATIVES:
+            # dropping constraints only adds candidates
+            return alternatives if len(alternatives) <= len(other) else other
+        return [literals + other_literals for literals in alternatives for other_literals in other]
+
+    def analyze(items: Iterable, ignore_case: bool) -> list:
+        alternatives: list = [[]]
+        run: list = []
+
+        def flush() -> None:
+            nonlocal alternatives
+            if run:
+                literal: bytes = bytes(run) if is_bytes else "".join(chr(code) for code in run).encode(encoding)
+                if len(literal) >= 3:
+                    alternatives = [literals + [literal] for literals in alternatives]
+                run.clear()
+
+        for op, av in items:
+            if op == LITERAL and usable(av, ignore_case):
+                run.append(av)
+                continue
+            flush()
+            if op == SUBPATTERN:
+                _, add_flags, del_flags, sub_pattern = av
+                sub_ignore_case: bool = bool((ignore_case or add_flags & re.IGNORECASE) and not del_flags & re.IGNORECASE)
+                alternatives = product(alternatives, analyze(sub_pattern, sub_ignore_case))
+            elif op == BRANCH:
+                branches: list = []
+                for branch in av[1]:
+                    branches.extend(analyze(branch, ignore_case))
+                alternatives = product(alternatives, branches)
+            elif op in (MAX_REPEAT, MIN_REPEAT, POSSESSIVE_REPEAT) and av[0] >= 1:
+                alternatives = product(alternatives, analyze(av[2], ignore_case))
+        flush()
+        return alternatives
+
+    alternatives: list = analyze(parsed, bool(parsed.state.flags & re.IGNORECASE))
+    if any(not literals for literals in alternatives):
+        return None
+    return alternatives
+
+
+def query(patterns: Iterable, flags: int, invert_match: bool, fixed_strings: bool, encoding: str) -> list:
+    """
+    Return the alternatives of literals for grep(*patterns), or None if the index can not be used.
+    """
+    import re
+
+    if invert_match:
+        return None
+    alternatives: list = []
+    for pattern in patterns:
+        pattern_alternatives: list = _required_literals(re.escape(pattern) if fixed_strings else pattern, flags, encoding)
+        if pattern_alternatives is None:
+            return None
+        alternatives.extend(pattern_alternatives)
+    return alternatives or None
+
+
+def candidate_lines(index: object, file_names: Iterable[str], grep_spec: tuple, encoding: str,
+                    binary: bool, buffer_size: int) -> Iterable[object]:
+    """
+    Yield the lines of the blocks of file_names that may match grep_spec, (patterns, flags, invert_match,
+    fixed_strings), after updating index, a TrigramIndex or the path of one.
+    """
+    import dw
+
+    if isinstance(index, str):
+        index = TrigramIndex(index)
+    if index.update(*file_names) and index.path is not None:
+        index.save()
+    patterns, flags, invert_match, fixed_strings = grep_spec
+    alternatives: list = query(patterns, flags, invert_match, fixed_strings, encoding)
+
+    for file_name in file_names:
+        ranges: list = index.candidate_ranges(file_name, alternatives)
+        if ranges is None:
+            yield from dw.cat(file_name, encoding=encoding, binary=binary, buffer_size=buffer_size)
+            continue
+        with io.open(file_name, "rb", buffering=0) as f:
+            for start, end in ranges:
+                f.seek(start)
+                lines: Iterable = dw._binary_lines(dw._ByteRange(f, end), buffer_size)
+                if binary:
+                    yield from lines
+                else:
+                    for line in lines:
+                        yield line.decode(encoding)
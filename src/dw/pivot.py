@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Group-by aggregation of records, behind dw csv pivot.
+
+    >>> from dw.pivot import pivot
+    >>> dw.csv.cat("abc.csv", types={"c": int}) | pivot("a", formulas=["sum_c=sum(c)", "n=count()"]) | dw.csv.to_markdown() > "-"
+
+Records are read in batches of batch_size. The group of each record is looked up in a dict, and then
+each aggregator reduces the values of the batch per group at once, with NumPy if it is installed and the
+values are all ints or all floats, and in Python otherwise. Both reduce a batch into partial aggregates in
+record order and merge them into the aggregates of the groups in the same way, so the results are identical.
+
+With buffer_size, at most buffer_size groups are held. The partial aggregates of more groups are spilled
+to temporary files partitioned by hash of group, which are merged one after another at the end.
+"""
+
+from collections.abc import Callable, Iterable, Sequence
+import itertools
+
+import dw
+
+# number of partitions of spilled partial aggregates
+_PARTITIONS: int = 16
+
+
+def number(text: str) -> object:
+    """
+    Convert text to an int or a float if it is one, e.g. as the type of a CSV column to aggregate.
+    """
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def _numpy() -> object:
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+################################################################################
+
+
+class _Column(object):
+    """
+    Values of a field in a batch with the group ids of their records. Their NumPy arrays are made once
+    for all the aggregators of the field.
+    """
+
+    def __init__(self, np: object, ids: list, values: list, n_groups: int):
+        self.np: object = np
+        self.ids: list = ids
+        self.values: list = values
+        self.n_groups: int = n_groups
+        self._arrays: tuple = None
+
+    def arrays(self) -> tuple:
+        """
+        Return (ids, values, counts) as arrays without the None values, where counts is the number of
+        values per group, if the values are all ints that fit in int64 or all floats without NaN.
+        Otherwise return None.
+        """
+        if self._arrays is None:
+            self._arrays = (self._vectorize(),)
+        return self._arrays[0]
+
+    def _vectorize(self) -> tuple:
+        np: object = self.np
+        ids: list = self.ids
+        values: list = self.values
+        types: set = set(map(type, values))
+        has_none: bool = type(None) in types
+        types.discard(type(None))
+        if types != {int} and types != {float}:
+            return None
+        if has_none:
+            ids = [idx for idx, value in zip(ids, values) if value is not None]
+            values = [value for value in values if value is not None]
+        if types == {int}:
+            try:
+                array = np.array(values, dtype=np.int64)
+            except OverflowError:
+                return None
+            # sums of the batch must not overflow either, and np.abs wraps for -2**63
+            if len(array) and max(-int(array.min()), int(array.max())) >= np.iinfo(np.int64).max // len(array):
+                return None
+        else:
+            array = np.array(values, dtype=np.float64)
+            if np.isnan(array).any():
+                return None
+        ids_array = np.array(ids, dtype=np.intp)
+        return ids_array, array, np.bincount(ids_array, minlength=self.n_groups)
+
+
+class Aggregator(object):
+    """
+    Aggregate the values of field per group. None values are skipped. An aggregate is kept as a state,
+    which partial states of batches or spilled files are merged into.
+    """
+
+    def __init__(self, name: str, field: object):
+        self.name: str = name
+        self.field: object = field
+
+    def partials(self, column: _Column) -> dict:
+        """
+        Return {group id: partial state} of a batch.
+        """
+        raise NotImplementedError()
+
+    def partials_numpy(self, column: _Column) -> dict:
+        """
+        Return the same as partials by NumPy, or None if the values can not be vectorized.
+        """
+        return None
+
+    def merge(self, state: object, partial: object) -> object:
+        raise NotImplementedError()
+
+    def result(self, state: object) -> object:
+        return state
+
+
+class _Sum(Aggregator):
+
+    def partials(self, column: _Column) -> dict:
+        partials: dict = {}
+        get: Callable = partials.get
+        for idx, value in zip(column.ids, column.values):
+            if value is not None:
+                partials[idx] = get(idx, 0) + value
+        return partials
+
+    def partials_numpy(self, column: _Column) -> dict:
+        arrays: tuple = column.arrays()
+        if arrays is None:
+            return None
+        np: object = column.np
+        ids, values, counts = arrays
+        if values.dtype == np.int64:
+            sums = np.zeros(column.n_groups, dtype=np.int64)
+            np.add.at(sums, ids, values)
+        else:
+            # bincount adds the weights of each group in record order, as partials does
+            sums = np.bincount(ids, weights=values, minlength=column.n_groups)
+        groups = np.flatnonzero(counts)
+        return dict(zip(groups.tolist(), sums[groups].tolist()))
+
+    def merge(self, state: object, partial: object) -> object:
+        return partial if state is None else state + partial
+
+    def result(self, state: object) -> object:
+        return 0 if state is None else state
+
+
+class _Count(Aggregator):
+    """
+    Count the records whose field is not None, or all records if field is None.
+    """
+
+    def partials(self, column: _Column) -> dict:
+        import collections
+
+        if self.field is None:
+            return collections.Counter(column.ids)
+        return collections.Counter([idx for idx, value in zip(column.ids, column.values) if value is not None])
+
+    def partials_numpy(self, column: _Column) -> dict:
+        np: object = column.np
+        if self.field is None:
+            counts = np.bincount(np.array(column.ids, dtype=np.intp), minlength=column.n_groups)
+        else:
+            arrays: tuple = column.arrays()
+            if arrays is None:
+                return None
+            counts = arrays[2]
+        groups = np.flatnonzero(counts)
+        return dict(zip(groups.tolist(), counts[groups].tolist()))
+
+    def merge(self, state: object, partial: object) -> object:
+        return partial if state is None else state + partial
+
+    def result(self, state: object) -> object:
+        return 0 if state is None else state
+
+
+class _Min(Aggregator):
+
+    _python: Callable = min
+    _at: str = "minimum"
+
+    def partials(self, column: _Column) -> dict:
+        partials: dict = {}
+        better: Callable = self._python
+        for idx, value in zip(column.ids, column.values):
+            if value is not None:
+                partial: object = partials.get(idx)
+                partials[idx] = value if partial is None else better(partial, value)
+        return partials
+
+    def partials_numpy(self, column: _Column) -> dict:
+        arrays: tuple = column.arrays()
+        if arrays is None:
+            return None
+        np: object = column.np
+        ids, values, counts = arrays
+        if values.dtype.kind == "f":
+            # np.minimum and np.maximum keep the later of 0.0 and -0.0, but min and max keep the first
+            signs = np.signbit(values[values == 0])
+            if signs.any() and not signs.all():
+                return None
+        extremes = np.zeros(column.n_groups, dtype=values.dtype)
+        # every group with values starts from one of them
+        extremes[ids] = values
+        getattr(np, self._at).at(extremes, ids, values)
+        groups = np.flatnonzero(counts)
+        return dict(zip(groups.tolist(), extremes[groups].tolist()))
+
+    def merge(self, state: object, partial: object) -> object:
+        return partial if state is None else self._python(state, partial)
+
+
+class _Max(_Min):
+
+    _python: Callable = max
+    _at: str = "maximum"
+
+
+class _Mean(Aggregator):
+
+    def __init__(self, name: str, field: object):
+        super().__init__(name, field)
+        self.sum: _Sum = _Sum(name, field)
+        self.count: _Count = _Count(name, field)
+
+    def partials(self, column: _Column) -> dict:
+        counts: dict = self.count.partials(column)
+        sums: dict = self.sum.partials(column)
+        return {idx: (sums[idx], count) for idx, count in counts.items()}
+
+    def partials_numpy(self, column: _Column) -> dict:
+        sums: dict = self.sum.partials_numpy(column)
+        if sums is None:
+            return None
+        counts: dict = self.count.partials_numpy(column)
+        return {idx: (sums[idx], count) for idx, count in counts.items()}
+
+    def merge(self, state: object, partial: object) -> object:
+        return partial if state is None else (state[0] + partial[0], state[1] + partial[1])
+
+    def result(self, state: object) -> object:
+        return None if state is None else state[0] / state[1]
+
+
+class _Distinct(Aggregator):
+    """
+    Count the distinct values.
+    """
+
+    def partials(self, column: _Column) -> dict:
+        partials: dict = {}
+        for idx, value in zip(column.ids, column.values):
+            if value is not None:
+                partial: set = partials.get(idx)
+                if partial is None:
+                    partials[idx] = {value}
+                else:
+                    partial.add(value)
+        return partials
+
+    def merge(self, state: object, partial: object) -> object:
+        if state is None:
+            return partial
+        state |= partial
+        return state
+
+    def result(self, state: object) -> object:
+        return 0 if state is None else len(state)
+
+
+_AGGREGATORS: dict = {
+    "sum": _Sum,
+    "count": _Count,
+    "min": _Min,
+    "max": _Max,
+    "mean": _Mean,
+    "avg": _Mean,
+    "distinct": _Distinct,
+    "count_distinct": _Distinct,
+}
+
+
+def parse_formula(formula: str) -> Aggregator:
+    """
+    Return the Aggregator of formula, NAME=FUNCTION(FIELD) or FUNCTION(FIELD), where FUNCTION is one of
+    sum, count, min, max, mean (avg) and distinct (count_distinct). NAME defaults to FUNCTION_FIELD. FIELD
+    may be omitted or * for count, which then counts records. A FIELD of digits is a position.
+    """
+    name, eq, expression = formula.partition("=")
+    if not eq:
+        name, expression = "", formula
+    function, paren, rest = expression.strip().partition("(")
+    function = function.strip().lower()
+    if not paren or not rest.endswith(")") or function not in _AGGREGATORS:
+        raise ValueError(f"formula must be NAME=FUNCTION(FIELD) with FUNCTION one of {', '.join(_AGGREGATORS)}: {formula}")
+    field: object = rest[:-1].strip()
+    if field in ("", "*"):
+        if function != "count":
+            raise ValueError(f"{function} needs a FIELD: {formula}")
+        field = None
+    elif field.isdigit():
+        field = int(field)
+    name = name.strip() or (f"{function}_{field}" if field is not None else function)
+    return _AGGREGATORS[function](name, field)
+
+
+################################################################################
+
+
+def _spill_groups(index: dict, firsts: list, states: list, partitions: list, temporary_directory: str) -> None:
+    """
+    Append (key, first, states) of the groups of index, {key: group id}, to partitions, which are created
+    at the first spill.
+    """
+    import pickle, tempfile
+
+    if not partitions:
+        partitions.extend(tempfile.TemporaryFile(dir=temporary_directory) for _ in range(_PARTITIONS))
+    chunks: list = [[] for _ in range(_PARTITIONS)]
+    for key, idx in index.items():
+        chunks[hash(key) % _PARTITIONS].append((key, firsts[idx], [aggregator_states[idx] for aggregator_states in states]))
+    for f, chunk in zip(partitions, chunks):
+        if chunk:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _merged_partition(f: object, aggregators: list) -> list:
+    """
+    Return [(first, key, states)] of the groups of a partition, in order of first record.
+    """
+    f.seek(0)
+    merged: dict = {}
+    for key, first, states in dw._unspill(f):
+        entry: list = merged.get(key)
+        if entry is None:
+            merged[key] = [first, states]
+            continue
+        entry[0] = min(entry[0], first)
+        entry[1] = [aggregator.merge(state, partial) if partial is not None else state
+                    for aggregator, state, partial in zip(aggregators, entry[1], states)]
+    dw._note_buffered(len(merged))
+    return sorted(((first, key, states) for key, (first, states) in merged.items()), key=lambda entry: entry[0])
+
+
+@dw.monadic_function_returner
+def pivot(*fields: object, formulas: Sequence[str] = (),
+          S: int = None, buffer_size: int = None,
+          T: str = None, temporary_directory: str = None,
+          batch_size: int = 65536, vectorize: bool = None) -> Callable:
+    """
+    Group records by the values of fields, and print a dict per group with the fields and the results of
+    formulas (see parse_formula), in order of the first record of each group. record[field] is the value
+    of a field, so records may be dw.csv Rows, dicts or sequences.
+      -S, --buffer-size=SIZE    hold at most SIZE groups. The partial aggregates of more groups are spilled
+                                to temporary files, and then groups are printed one partition at a time.
+      -T, --temporary-directory=DIR
+                                use DIR for temporaries, not $TMPDIR or /tmp
+      vectorize                 reduce batches with NumPy: True requires it, False never uses it, and
+                                None (default) uses it if it is installed
+    """
+    buffer_size = buffer_size or S
+    temporary_directory = temporary_directory or T
+    aggregators: list = [parse_formula(formula) for formula in formulas]
+    np: object = None
+    if vectorize or vectorize is None:
+        np = _numpy()
+        if np is None and vectorize:
+            raise ImportError("vectorize needs numpy.")
+
+    import operator
+
+    if not fields:
+        key_f: Callable = lambda record: ()
+    else:
+        # a single field is the key itself, and more fields a tuple of them
+        key_f: Callable = operator.itemgetter(*fields)
+    value_fs: list = [None if aggregator.field is None else operator.itemgetter(aggregator.field) for aggregator in aggregators]
+
+    @dw.pipeable()
+    def _pivot(iterable: Iterable) -> Iterable[dict]:
+        # key -> group id, and the number of the first record of each group
+        index: dict = {}
+        firsts: list = []
+        # per aggregator, the states of the groups by group id
+        states: list = [[] for _ in aggregators]
+        partitions: list = []
+        iterator = iter(iterable)
+        n_records: int = 0
+        # the records of a batch from the first one of a group beyond buffer_size
+        pending: list = []
+        try:
+            while True:
+                batch: list = pending or list(itertools.islice(iterator, batch_size))
+                pending = []
+                if not batch:
+                    break
+                keys: list = list(map(key_f, batch))
+                ids: list = list(map(index.get, keys))
+                if None in ids:
+                    for pos, idx in enumerate(ids):
+                        if idx is None:
+                            key: object = keys[pos]
+                            idx = index.get(key)
+                            if idx is None:
+                                if buffer_size is not None and len(firsts) >= buffer_size:
+                                    # the groups are spilled before this one is held
+                                    pending = batch[pos:]
+                                    del batch[pos:], keys[pos:], ids[pos:]
+                                    break
+                                idx = index[key] = len(firsts)
+                                firsts.append(n_records + pos)
+                                for aggregator_states in states:
+                                    aggregator_states.append(None)
+                            ids[pos] = idx
+                n_records += len(batch)
+                columns: dict = {}
+                for aggregator, value_f, aggregator_states in zip(aggregators, value_fs, states):
+                    column: _Column = columns.get(aggregator.field)
+                    if column is None:
+                        values: list = batch if value_f is None else list(map(value_f, batch))
+                        column = columns[aggregator.field] = _Column(np, ids, values, len(firsts))
+                    partials: dict = None
+                    if np is not None:
+                        partials = aggregator.partials_numpy(column)
+                    if partials is None:
+                        partials = aggregator.partials(column)
+                    merge: Callable = aggregator.merge
+                    for idx, partial in partials.items():
+                        aggregator_states[idx] = merge(aggregator_states[idx], partial)
+                del batch, keys, columns
+                dw._note_buffered(len(firsts))
+                if pending:
+                    _spill_groups(index, firsts, states, partitions, temporary_directory)
+                    index.clear()
+                    firsts = []
+                    states = [[] for _ in aggregators]
+
+            if partitions:
+                _spill_groups(index, firsts, states, partitions, temporary_directory)
+                index.clear()
+                states = []
+                entries: Iterable = (entry for f in partitions for entry in _merged_partition(f, aggregators))
+            else:
+                entries = ((firsts[idx], key, [aggregator_states[idx] for aggregator_states in states])
+                           for key, idx in index.items())
+            for _, key, group_states in entries:
+                record: dict = dict(zip(fields, key if len(fields) > 1 else (key,)))
+                for aggregator, state in zip(aggregators, group_states):
+                    record[aggregator.name] = aggregator.result(state)
+                yield record
+        finally:
+            for f in partitions:
+                f.close()
+
+    return _pivot
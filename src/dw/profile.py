@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Per-stage instrumentation of pipelines.
+
+    >>> from dw.profile import Profiler
+    >>> profiler = Profiler()
+    >>> dw.cat("access.log", profiler=profiler) | dw.grep("ERROR") | dw.sorted() > dw.DEV_NULL
+    >>> print(profiler)
+
+Nothing is measured unless a Profiler is given to cat or IterableMonad.
+"""
+
+from collections.abc import Iterable, Iterator
+import json
+import logging
+import time
+
+# Stats of the stages whose __next__ is running, innermost last
+_running: list = []
+
+
+def note_buffered(size: int) -> None:
+    """
+    Called by stages that hold records, with the number of records they hold.
+    """
+    if _running:
+        stats: StageStats = _running[-1]
+        if size > stats.peak_buffered:
+            stats.peak_buffered = size
+
+
+class StageStats(object):
+
+    def __init__(self, name: str, description: str):
+        self.name: str = name
+        self.description: str = description
+        self.records_out: int = 0
+        # seconds spent in __next__ of this stage, including the time spent in the upstream stages
+        self.inclusive_seconds: float = 0.0
+        self.peak_buffered: int = 0
+
+
+class ProfiledIterator(Iterator):
+    """
+    Iterator over the output of a stage that records its stats.
+    """
+
+    def __init__(self, iterable: Iterable, stats: StageStats):
+        self.iterator: Iterator = iter(iterable)
+        self.stats: StageStats = stats
+
+    def __next__(self) -> object:
+        stats: StageStats = self.stats
+        _running.append(stats)
+        start: float = time.perf_counter()
+        try:
+            obj: object = next(self.iterator)
+        finally:
+            stats.inclusive_seconds += time.perf_counter() - start
+            _running.pop()
+        stats.records_out += 1
+        return obj
+
+    def close(self) -> None:
+        close = getattr(self.iterator, "close", None)
+        if close is not None:
+            close()
+
+
+class Profiler(object):
+    """
+    Collect StageStats of the stages of a pipeline, in pipeline order.
+    """
+
+    def __init__(self):
+        self.stages: list = []
+
+    def profile(self, iterable: Iterable, name: str, description: str = None) -> ProfiledIterator:
+        stats: StageStats = StageStats(name, description or name)
+        self.stages.append(stats)
+        return ProfiledIterator(iterable, stats)
+
+    def discard(self, iterable: Iterable) -> None:
+        """
+        Forget the stage that produces iterable, when bind replaces it by another stage.
+        """
+        if isinstance(iterable, ProfiledIterator) and iterable.stats in self.stages:
+            self.stages.remove(iterable.stats)
+
+    def report(self) -> list:
+        """
+        Return a list of dicts, one per stage, with records_in, records_out, the seconds spent
+        in the stage itself and peak_buffered, the largest number of records held by the stage.
+        """
+        rows: list = []
+        upstream: StageStats = None
+        for stats in self.stages:
+            rows.append({
+                "stage": stats.description,
+                "records_in": upstream.records_out if upstream else None,
+                "records_out": stats.records_out,
+                "seconds": stats.inclusive_seconds - (upstream.inclusive_seconds if upstream else 0.0),
+                "peak_buffered": stats.peak_buffered,
+            })
+            upstream = stats
+        return rows
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.report(), **kwargs)
+
+    def log(self, logger: logging.Logger = None, level: int = logging.INFO) -> None:
+        logger = logger or logging.getLogger("dw")
+        for row in self.report():
+            logger.log(level, "%(stage)s: in=%(records_in)s out=%(records_out)s %(seconds).6fs peak_buffered=%(peak_buffered)s", row)
+
+    def __str__(self) -> str:
+        rows: list = self.report()
+        width: int = max([len("stage")] + [len(row["stage"]) for row in rows])
+        lines: list = [f"{'stage':<{width}} | {'in':>10} | {'out':>10} | {'seconds':>10} | {'peak buffered':>13}"]
+        for row in rows:
+            records_in: str = "" if row["records_in"] is None else str(row["records_in"])
+            lines.append(f"{row['stage']:<{width}} | {records_in:>10} | {row['records_out']:>10} | {row['seconds']:>10.6f} | {row['peak_buffered']:>13}")
+        return "\n".join(lines)
+
+    __repr__ = __str__
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================
+# dw
+#
+# Copyright (c) 2022 Takahide Nogayama
+#
+# This software is released under the MIT License.
+# http://opensource.org/licenses/mit-license.php
+# =================================================================
+"""
+Fixed memory summaries of streams, used by the approximate modes of dw.uniq, dw.count and dw.count_distinct.
+"""
+
+from collections.abc import Iterable
+import math
+
+_MASK64: int = (1 << 64) - 1
+
+
+def hash64(obj: object) -> int:
+    """
+    64 bit hash of a hashable object. hash() is mixed by the SplitMix64 finalizer because
+    hash() of small ints is the int itself. Like hash(), it is stable only within a process.
+    """
+    h: int = hash(obj) & _MASK64
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return h ^ (h >> 31)
+
+
+################################################################################
+
+
+class BloomFilter(object):
+    """
+    Set membership with false positives and without false negatives.
+    While at most capacity objects are added, the probability that an object which was not added
+    is reported as contained is at most error_rate.
+    It takes -capacity * ln(error_rate) / ln(2) ** 2 bits.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        if capacity < 1:
+            raise ValueError("capacity must be positive value.")
+        if not 0.0 < error_rate < 1.0:
+            raise ValueError("error_rate must be in (0, 1).")
+        self.n_bits: int = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.n_hashes: int = max(1, int(round(self.n_bits / capacity * math.log(2))))
+        self.bits: bytearray = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, obj: object) -> Iterable[int]:
+        # Kirsch and Mitzenmacher, "Less hashing, same performance"
+        h: int = hash64(obj)
+        h1: int = h & 0xFFFFFFFF
+        h2: int = (h >> 32) | 1
+        n_bits: int = self.n_bits
+        return ((h1 + i * h2) % n_bits for i in range(self.n_hashes))
+
+    def add(self, obj: object) -> bool:
+        """
+        Add obj, and return True if it may have been added before.
+        """
+        bits: bytearray = self.bits
+        contained: bool = True
+        for pos in self._positions(obj):
+            mask: int = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                contained = False
+                bits[pos >> 3] |= mask
+        return contained
+
+    def __contains__(self, obj: object) -> bool:
+        bits: bytearray = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(obj))
+
+
+################################################################################
+
+
+class HyperLogLog(object):
+    """
+    Estimate of the number of distinct objects with 2 ** precision registers of one byte.
+    The relative standard error of the estimate is 1.04 / sqrt(2 ** precision), e.g. 0.81% for precision 14.
+    Flajolet et al., "HyperLogLog: the analysis of a near-optimal cardinality estimation algorithm"
+    """
+
+    def __init__(self, precision: int = 14):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be in [4, 18].")
+        self.precision: int = precision
+        self.registers: bytearray = bytearray(1 << precision)
+
+    def add(self, obj: object) -> None:
+        h: int = hash64(obj)
+        p: int = self.precision
+        idx: int = h >> (64 - p)
+        rank: int = (64 - p) - (h & ((1 << (64 - p)) - 1)).bit_length() + 1
+        if self.registers[idx] < rank:
+            self.registers[idx] = rank
+
+    def __len__(self) -> int:
+        m: int = len(self.registers)
+        alpha: float = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate: float = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros: int = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+################################################################################
+
+
+class SpaceSaving(object):
+    """
+    Counts of the heavy hitters of a stream with at most capacity counters.
+    Metwally et al., "Efficient computation of frequent and top-k elements in data streams"
+
+    After N objects are added, every reported count overestimates the true count by at most N / capacity,
+    and every object that occurs more than N / capacity times is reported.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("capacity must be positive value.")
+        self.capacity: int = capacity
+        self.counts: dict = {}
+        self.errors: dict = {}
+        # count -> objects with the count, as a dict used as an ordered set
+        self.buckets: dict = {}
+        self.min_count: int = 0
+
+    def _move(self, obj: object, old_count: int, new_count: int) -> None:
+        bucket: dict = self.buckets[old_count]
+        del bucket[obj]
+        if not bucket:
+            del self.buckets[old_count]
+            if old_count == self.min_count:
+                self.min_count = new_count
+        self.buckets.setdefault(new_count, {})[obj] = None
+        self.counts[obj] = new_count
+
+    def add(self, obj: object) -> None:
+        count: int = self.counts.get(obj)
+        if count is not None:
+            self._move(obj, count, count + 1)
+        elif len(self.counts) < self.capacity:
+            self.counts[obj] = 1
+            self.errors[obj] = 0
+            self.buckets.setdefault(1, {})[obj] = None
+            self.min_count = 1
+        else:
+            # replace an object with the minimum count, taking over its count as the error
+            count = self.min_count
+            bucket: dict = self.buckets[count]
+            victim: object = next(iter(bucket))
+            del bucket[victim]
+            del self.counts[victim]
+            del self.errors[victim]
+            if not bucket:
+                del self.buckets[count]
+                self.min_count = count + 1
+            self.counts[obj] = count + 1
+            self.errors[obj] = count
+            self.buckets.setdefault(count + 1, {})[obj] = None
+
+    def most_common(self, n: int = None) -> list:
+        """
+        Return [(obj, count, error)] in descending order of count. The true count is in [count - error, count].
+        """
+        items: list = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        if n is not None:
+            items = items[:n]
+        return [(obj, count, self.errors[obj]) for obj, count in items]
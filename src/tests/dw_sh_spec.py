@@ -10,7 +10,9 @@
 # =================================================================
 
 from uspec import description, context, it, execute_command
-from hamcrest import assert_that, equal_to, instance_of, is_not
+from hamcrest import assert_that, calling, contains_string, equal_to, instance_of, is_not, less_than, raises
+
+import builtins
 
 import dw
 from dw import *
@@ -87,6 +89,181 @@ with description("dw.IterableMonad"):
         assert_that([e for e in m], equal_to(l))
 
 
+    @it("merges consecutive per-record stages into a single loop if compiled")
+    def _(self):
+        def pipeline(compiled):
+            seen = []
+            m = cat(range(100), compiled=compiled) | map(lambda x: f"{x:03d}") | dw.do_nothing | filter(lambda s: s[-1] != "3") \
+                | grep("^0[1-5]", "7$") | tee(seen) | head(12) | grep("2", n=True) | tee(DEV_NULL)
+            return m, [x for x in m], seen
+
+        m, l, seen = pipeline(compiled=True)
+        assert_that([kind for kind, _ in m.stage.record_steps], equal_to(["map", "filter", "grep", "tee", "head", "grep"]))
+        assert_that((l, seen), equal_to(pipeline(compiled=False)[1:]))
+
+    @it("reads no record through the merged loop if compiled with head(0)")
+    def _(self):
+        def pipeline(compiled):
+            seen, kept = ["stale"], ["stale"]
+            l = list(cat(range(10), compiled=compiled) | tee(seen) | head(0) | tee(kept))
+            return l, seen, kept
+
+        assert_that(pipeline(compiled=True), equal_to(([], ["stale"], [])))
+        assert_that(pipeline(compiled=True), equal_to(pipeline(compiled=False)))
+
+
+with description("dw.cat"):
+
+    @it("reads files as bytes lines in binary mode")
+    def _(self):
+        import os, tempfile
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "in.txt")
+            with open(path, "wb") as f:
+                f.write(b"abc\r\ndef\n\nghi")
+            assert_that(list(cat(path, b=True, buffer_size=2)), equal_to([b"abc", b"def", b"", b"ghi"]))
+            assert_that(list(cat(path)), equal_to(["abc", "def", "", "ghi"]))
+
+            out = os.path.join(d, "out.txt")
+            cat(path, b=True) | grep(b"^[ag]") | tee(out, b=True) | dw.do_nothing > DEV_NULL
+            with open(out, "rb") as f:
+                assert_that(f.read(), equal_to(b"abc\nghi\n"))
+
+
+    @it("memory maps files and scans them backwards for tail and reversed")
+    def _(self):
+        import os, tempfile
+        with tempfile.TemporaryDirectory() as d:
+            path1, path2, empty = os.path.join(d, "1.txt"), os.path.join(d, "2.txt"), os.path.join(d, "empty.txt")
+            with open(path1, "wb") as f:
+                f.write(b"a\r\n\nb\n")
+            with open(path2, "wb") as f:
+                f.write(b"c\nd")
+            open(empty, "wb").close()
+
+            lines = list(cat(path1, empty, path2))
+            assert_that(list(cat(path1, empty, path2, memory_map=True)), equal_to(lines))
+            for n in (0, 1, 3, 10):
+                m = cat(path1, empty, path2, memory_map=True) | tail(n)
+                assert_that(getattr(m.stage, "tail_n", None), equal_to(None))
+                assert_that(list(m), equal_to(lines[len(lines) - n:]))
+            assert_that(list(cat(path1, empty, path2, memory_map=True) | reversed()), equal_to(lines[::-1]))
+            assert_that(list(cat(path1, path2, memory_map=True, b=True) | reversed()), equal_to([b"d", b"c", b"b", b"", b"a"]))
+
+    @it("reads and writes compressed files")
+    def _(self):
+        import bz2, os, tempfile
+        lines = [f"line {x}" for x in range(10000)]
+        with tempfile.TemporaryDirectory() as d:
+            for extension in (".gz", ".bz2", ".xz"):
+                path = os.path.join(d, "out.log" + extension)
+                lines | tee(path) > DEV_NULL
+                # without the extension, the compression is detected by the magic bytes
+                renamed = os.path.join(d, "out.log")
+                with open(path, "rb") as src, open(renamed, "wb") as dst:
+                    dst.write(src.read())
+                for source in (path, renamed):
+                    for decompress_in_thread in (False, True):
+                        assert_that(list(cat(source, decompress_in_thread=decompress_in_thread, buffer_size=1000)), equal_to(lines))
+                        assert_that(list(cat(source, b=True, decompress_in_thread=decompress_in_thread, buffer_size=1000)), equal_to([x.encode() for x in lines]))
+                assert_that(list(cat(path, decompress_in_thread=True) | head(2)), equal_to(lines[:2]))
+            # text that starts like the magic bytes of a compression is read as text
+            path = os.path.join(d, "text.log")
+            for text in ("BZh is a line\n", "BZh91 and more\n", "\x1f is a line\n"):
+                with open(path, "w") as f:
+                    f.write(text)
+                assert_that(list(cat(path)), equal_to([text[:-1]]))
+            with open(path, "wb") as f:
+                f.write(bz2.compress(b""))
+            assert_that(list(cat(path)), equal_to([]))
+
+
+with description("dw.profile.Profiler"):
+
+    @it("records records in and out, time and peak buffered records of each stage")
+    def _(self):
+        import json
+        from dw.profile import Profiler
+        profiler = Profiler()
+        l = cat(range(100), profiler=profiler) | filter(lambda x: x % 2 == 0) | sorted(reverse=True) | tail(3) | map(str) > []
+        assert_that(l, equal_to(["4", "2", "0"]))
+        report = profiler.report()
+        assert_that([row["stage"] for row in report], equal_to(["cat(range(0, 100))", "filter(<lambda>)", "topk(3, key=None, reverse=True, last=True)", "map(str)", "tee([], append=False)"]))
+        assert_that([row["records_in"] for row in report], equal_to([None, 100, 50, 3, 3]))
+        assert_that([row["records_out"] for row in report], equal_to([100, 50, 3, 3, 3]))
+        assert_that([row["peak_buffered"] for row in report], equal_to([0, 0, 3, 0, 0]))
+        assert_that(all(row["seconds"] >= 0 for row in report), equal_to(True))
+        assert_that(json.loads(profiler.to_json()), equal_to(report))
+
+        profiler = Profiler()
+        IterableMonad(iter(range(10)), profiler=profiler) | shuffle() | count() > DEV_NULL
+        assert_that([row["peak_buffered"] for row in profiler.report()], equal_to([0, 10, 10, 0]))
+
+
+with description("dw.tee"):
+
+    @it("writes records to files in batches")
+    def _(self):
+        import os, tempfile
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "out.txt")
+            ["a", b"b", 3] | tee(path, flush_size=2) > DEV_NULL
+            with open(path, "rb") as f:
+                assert_that(f.read(), equal_to(b"a\nb\n3\n"))
+            ["c", b"d", 4] | tee(path, b=True, append=True) > DEV_NULL
+            ["e", "f"] | tee(path, n=True, append=True) > DEV_NULL
+            with open(path, "rb") as f:
+                assert_that(f.read(), equal_to(b"a\nb\n3\nc\nd\n4\nef"))
+            range(5) | map(str) > path
+            assert_that(list(cat(path)), equal_to(["0", "1", "2", "3", "4"]))
+
+    @it("writes each record to io objects as it passes unless flush_size is given")
+    def _(self):
+        import io
+        for sink, flush_size, expected in ((io.StringIO(), None, ["0\n", "0\n1\n", "0\n1\n2\n"]),
+                                           (io.StringIO(), 2, ["", "0\n1\n", "0\n1\n"]),
+                                           (io.BytesIO(), None, [b"0\n", b"0\n1\n", b"0\n1\n2\n"])):
+            contents = []
+            for _ in range(3) | tee(sink, flush_size=flush_size):
+                contents.append(sink.getvalue())
+            assert_that(contents, equal_to(expected))
+            assert_that(sink.getvalue(), equal_to(b"0\n1\n2\n" if isinstance(sink, io.BytesIO) else "0\n1\n2\n"))
+
+    @it("fans out to several sinks through background writer threads")
+    def _(self):
+        import os, tempfile, time
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "out.txt")
+            for on_full in ("block", "spill"):
+                seen, unique, called = [], set(), []
+                def slow(obj):
+                    time.sleep(0.0001)
+                    called.append(obj)
+                m = range(2000) | tee(seen, unique, path, slow, DEV_NULL, queue_size=10, on_full=on_full, T=d)
+                assert_that(list(m), equal_to(list(range(2000))))
+                assert_that(seen, equal_to(list(range(2000))))
+                assert_that(unique, equal_to(set(range(2000))))
+                assert_that(called, equal_to(list(range(2000))))
+                assert_that(list(cat(path)), equal_to([str(i) for i in range(2000)]))
+
+            called = []
+            def slow(obj):
+                time.sleep(0.001)
+                called.append(obj)
+            range(2000) | tee(slow, queue_size=10, on_full="drop") > DEV_NULL
+            assert_that(len(called), less_than(2000))
+            assert_that(called, equal_to(builtins.sorted(called)))
+
+    @it("re-raises errors of writer threads")
+    def _(self):
+        def fail(obj):
+            if obj == 3:
+                raise KeyError(obj)
+        seen = []
+        assert_that(calling(lambda: range(10) | tee(seen, fail, queue_size=100) > DEV_NULL), raises(KeyError))
+        assert_that(seen, equal_to(list(range(10))))
+
+
 with description("dw.MonadicFunctionWrapper#__ror__"):
 
     @it("flips left term and right term of __or__")
@@ -129,6 +306,48 @@ with description("dw.tail"):
         l = [x for x in m]
         assert_that(l, equal_to([7, 8, 9]))
 
+    @it("follows files with -f, through truncation and rotation")
+    def _(self):
+        import os, tempfile, threading, time
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "service.log")
+            with open(path, "w") as f:
+                f.write("".join(f"old {x}\n" for x in range(10)))
+
+            def write():
+                time.sleep(0.05)
+                with open(path, "a") as f:
+                    f.write("new 1\nnew ")
+                    f.flush()
+                    time.sleep(0.05)
+                    f.write("2\n")
+                time.sleep(0.05)
+                with open(path, "w") as f:
+                    f.write("truncated\n")
+                time.sleep(0.05)
+                os.rename(path, path + ".1")
+                with open(path + ".1", "a") as f:
+                    f.write("before rotation\n")
+                time.sleep(0.05)
+                with open(path, "w") as f:
+                    f.write("rotated\n")
+
+            expected = ["old 7", "old 8", "old 9", "new 1", "new 2", "truncated", "before rotation", "rotated"]
+            for m in (lambda: cat(path) | tail(3, f=True), lambda: cat(path, f=True, s=0.2) | tail(3)):
+                with open(path, "w") as f:
+                    f.write("".join(f"old {x}\n" for x in range(10)))
+                iterator = iter(m() | head(len(expected)))
+                lines = [next(iterator) for _ in range(3)]
+                writer = threading.Thread(target=write)
+                writer.start()
+                start = time.time()
+                lines.extend(iterator)
+                writer.join()
+                assert_that(lines, equal_to(expected))
+                assert_that(time.time() - start, less_than(5))
+            assert_that(list(cat(path + ".1", f=True) | head(1)), equal_to(["truncated"]))
+            assert_that(list(["a", "b"] | tail(1, f=True)), equal_to(["b"]))
+
 
 with description("dw.reversed"):
 
@@ -149,6 +368,13 @@ with description("dw.shuffle"):
         assert_that(s, equal_to(set([0, 1, 2, 3, 4])))
         assert_that(l, is_not(equal_to([0, 1, 2, 3, 4])))
 
+    @it("shuffles with a bounded buffer by scattering records into temporary files")
+    def _(self):
+        l = list(range(1000) | shuffle(seed=1, buffer_size=10))
+        assert_that(builtins.sorted(l), equal_to(list(range(1000))))
+        assert_that(l, is_not(equal_to(list(range(1000)))))
+        assert_that(list(range(1000) | shuffle(seed=1, buffer_size=10)), equal_to(l))
+
 
 with description("dw.sample"):
 
@@ -160,6 +386,27 @@ with description("dw.sample"):
         assert_that(len(l), equal_to(3))
         assert_that(s.issubset(set(range(5))), equal_to(True))
 
+    @it("samples each record with the same probability in a single pass")
+    def _(self):
+        import collections
+        counter = collections.Counter()
+        for seed in range(2000):
+            l = list(iter(range(10)) | sample(k=3, seed=seed))
+            assert_that(len(set(l)), equal_to(3))
+            counter.update(l)
+        for x in range(10):
+            assert_that(abs(counter[x] - 600) < 100, equal_to(True))
+        assert_that(list(range(100) | sample(k=5, seed=7)), equal_to(list(range(100) | sample(k=5, seed=7))))
+
+    @it("samples records with probability proportional to their weights")
+    def _(self):
+        import collections
+        counter = collections.Counter()
+        for seed in range(1000):
+            counter.update(range(4) | sample(k=1, seed=seed, weight=lambda x: [0, 1, 1, 2][x]))
+        assert_that(counter[0], equal_to(0))
+        assert_that(abs(counter[3] - 500) < 80, equal_to(True))
+
 
 with description("dw.uniq"):
 
@@ -178,6 +425,50 @@ with description("dw.uniq_all"):
         l = [x for x in m]
         assert_that(l, equal_to([None, "a", "b", "c"]))
 
+    @it("eliminates duplicated records with a Bloom filter, dropping few distinct records by mistake")
+    def _(self):
+        records = [f"id-{x % 20000}" for x in range(60000)]
+        exact = list(records | uniq(g=True))
+        approximate = list(records | uniq(g=True, approximate=True, capacity=20000, error_rate=0.01))
+        kept = set(approximate)
+        assert_that(len(kept), equal_to(len(approximate)))
+        assert_that([x for x in exact if x in kept], equal_to(approximate))
+        assert_that(len(exact) - len(approximate) <= 0.02 * len(exact), equal_to(True))
+
+
+with description("dw.count"):
+
+    @it("counts records")
+    def _(self):
+        m = ["a", "b", "a", "c", "a", "b"] | count()
+        assert_that(list(m), equal_to([[3, "a"], [2, "b"], [1, "c"]]))
+        m = ["a", "b", "a", "c", "a", "b"] | count(top=2)
+        assert_that(list(m), equal_to([[3, "a"], [2, "b"]]))
+
+    @it("counts the top records in fixed memory within N / capacity")
+    def _(self):
+        import random
+        random.seed(0)
+        records = [int(random.paretovariate(1.0)) for _ in range(50000)]
+        exact = list(records | count(top=5))
+        approximate = list(records | count(top=5, approximate=True, capacity=100))
+        assert_that([obj for _, obj in approximate], equal_to([obj for _, obj in exact]))
+        for (exact_count, _), (approximate_count, _) in zip(exact, approximate):
+            assert_that(0 <= approximate_count - exact_count <= len(records) / 100, equal_to(True))
+
+
+with description("dw.count_distinct"):
+
+    @it("estimates the number of distinct records within the standard error")
+    def _(self):
+        # ints, unlike str, hash the same in every process, so that the estimate is reproducible
+        records = [x % 50000 for x in range(100000)]
+        assert_that(list(records | count_distinct()), equal_to([50000]))
+        estimate, = records | count_distinct(approximate=True, precision=14)
+        assert_that(abs(estimate - 50000) <= 3 * 0.0081 * 50000, equal_to(True))
+        estimate, = range(100) | count_distinct(approximate=True)
+        assert_that(abs(estimate - 100) <= 2, equal_to(True))
+
 
 with description("dw.sorted"):
 
@@ -187,6 +478,122 @@ with description("dw.sorted"):
         l = [x for x in m]
         assert_that(l, equal_to(["a", "b", "c", "d", "e", "f", "g"]))
 
+    @it("sorts records stably with a bounded buffer by spilling runs to temporary files")
+    def _(self):
+        import random
+        records = [(random.randint(0, 9), idx) for idx in range(100)]
+        for reverse in (False, True):
+            m = records | sorted(key=lambda r: r[0], reverse=reverse, buffer_size=7)
+            l = [x for x in m]
+            assert_that(l, equal_to(builtins.sorted(records, key=lambda r: r[0], reverse=reverse)))
+
+
+with description("dw.none_aware_key_func"):
+
+    @it("orders records as cmp_to_key(_compare) does")
+    def _(self):
+        import functools, random
+        rng = random.Random(0)
+        records = [rng.choice([None, rng.randrange(20), rng.random()]) for _ in range(2000)]
+        for reverse in (False, True):
+            expected = builtins.sorted(enumerate(records), key=lambda r: functools.cmp_to_key(dw._compare)(r[1]), reverse=reverse)
+            assert_that(builtins.sorted(enumerate(records), key=lambda r: none_aware_key_func(r[1]), reverse=reverse), equal_to(expected))
+
+
+with description("dw.sort_by"):
+
+    @it("sorts by columns with mixed orders and placements of None")
+    def _(self):
+        import decimal, functools, random
+        rng = random.Random(0)
+        rows = [{"n": rng.choice([None, 1, 2, 3]), "s": rng.choice([None, "a", "b", "c"]), "x": rng.choice([None, 0.5, 1.5])}
+                for _ in range(3000)]
+
+        def reference(columns):
+            specs = [dw._parse_column(column) for column in columns]
+
+            def compare(a, b):
+                for get_f, descending, nones_first in specs:
+                    x, y = get_f(a), get_f(b)
+                    if x == y:
+                        continue
+                    if x is None or y is None:
+                        return (-1 if x is None else 1) * (1 if nones_first else -1)
+                    return (-1 if x < y else 1) * (-1 if descending else 1)
+                return 0
+
+            return builtins.sorted(rows, key=functools.cmp_to_key(compare))
+
+        for columns in [("n",), (("s", "desc"),), ("n", ("s", "desc", "last"), "x"), (("x", "desc"), ("n", "asc", "first")),
+                        (("s", "desc"), ("n", "desc"), ("x", "asc", "last")), (lambda row: row["s"], ("n", "desc", "first"))]:
+            expected = reference(columns)
+            assert_that(list(rows | sort_by(*columns)), equal_to(expected))
+            assert_that(builtins.sorted(rows, key=columns_key(*columns)), equal_to(expected))
+            assert_that(list(rows | sort_by(*columns, S=100)), equal_to(expected))
+            assert_that(list(rows | sort_by(*columns) | head(7)), equal_to(expected[:7]))
+            assert_that(list(rows | sort_by(*columns) | tail(7)), equal_to(expected[-7:]))
+
+        # numbers of types that can not all be negated sort in reverse as they do in order
+        values = [2, decimal.Decimal("2.5"), None, 1.5, decimal.Decimal("-1"), 3]
+        for order in ("asc", "desc"):
+            expected = builtins.sorted([v for v in values if v is not None], reverse=order == "desc") + [None]
+            assert_that([row[0] for row in builtins.sorted([[v] for v in values], key=columns_key((0, order, "last")))], equal_to(expected))
+
+
+with description("dw.topk"):
+
+    @it("selects the same records as sorted | head and sorted | tail, including ties")
+    def _(self):
+        import random
+        records = [(random.randint(0, 9), idx) for idx in range(100)]
+        key = lambda r: r[0]
+        for reverse in (False, True):
+            expected = builtins.sorted(records, key=key, reverse=reverse)
+            for n in (0, 1, 5, 200):
+                assert_that(list(records | topk(n, key=key, reverse=reverse)), equal_to(expected[:n]))
+                assert_that(list(records | topk(n, key=key, reverse=reverse, last=True)), equal_to(expected[len(expected) - n:]))
+
+    @it("replaces sorted | head and sorted | tail in a pipeline")
+    def _(self):
+        records = ["d", "c", "a", "b", "f", "g", "e"]
+        m = IterableMonad(records) | sorted() | head(3)
+        assert_that(m.upstream, equal_to(records))
+        assert_that(list(m), equal_to(["a", "b", "c"]))
+        m = IterableMonad(records) | sorted(reverse=True) | tail(2)
+        assert_that(m.upstream, equal_to(records))
+        assert_that(list(m), equal_to(["b", "a"]))
+
+
+with description("dw.join"):
+
+    @it("joins records by key in memory, through partitions on disk, and by merge")
+    def _(self):
+        import random
+        rng = random.Random(0)
+        left = [(rng.randrange(50), idx) for idx in range(300)]
+        right = [(rng.randrange(60), -idx) for idx in range(200)]
+        key = lambda record: record[0]
+
+        def expected(left, right, how):
+            pairs = [(l, r) for l in left for r in right if l[0] == r[0]]
+            if how in ("left", "outer"):
+                pairs += [(l, None) for l in left if all(l[0] != r[0] for r in right)]
+            if how in ("right", "outer"):
+                pairs += [(None, r) for r in right if all(l[0] != r[0] for l in left)]
+            return builtins.sorted(pairs, key=repr)
+
+        for how in ("inner", "left", "right", "outer"):
+            for l, r in ((left, right), (left[:20], right)):
+                for options in ({}, dict(S=10), dict(buffer_size=1)):
+                    assert_that(builtins.sorted(iter(l) | join(r, key=key, how=how, **options), key=repr),
+                                equal_to(expected(l, r, how)))
+                assert_that(builtins.sorted(l | join(r, key=key, how=how), key=repr), equal_to(expected(l, r, how)))
+                pairs = list(builtins.sorted(l, key=key) | join(builtins.sorted(r, key=key), key=key, how=how, merge=True))
+                assert_that(builtins.sorted(pairs, key=repr), equal_to(expected(l, r, how)))
+        assert_that(list(["a", "b"] | join(["b", "c"])), equal_to([("b", "b")]))
+        assert_that(calling(list).with_args([2, 1] | join([1, 2], merge=True)), raises(ValueError))
+        assert_that(calling(join).with_args([], how="cross"), raises(ValueError))
+
 
 with description("dw.filter"):
 
@@ -196,6 +603,13 @@ with description("dw.filter"):
         l = [x for x in m]
         assert_that(l, equal_to([0, 2, 4, 6, 8]))
 
+    @it("filters records in a pool of workers")
+    def _(self):
+        records = [str(x) if x % 3 else "" for x in range(1000)]
+        for executor in ("thread", "process"):
+            m = records | filter(bool, workers=2, batch_size=64, executor=executor)
+            assert_that([x for x in m], equal_to([x for x in records if x]))
+
 
 with description("dw.map"):
 
@@ -205,6 +619,580 @@ with description("dw.map"):
         l = [x for x in m]
         assert_that(l, equal_to([0, 2, 4, 6, 8, 10, 12, 14, 16, 18]))
 
+    @it("maps records in a pool of workers, in order or as batches finish")
+    def _(self):
+        for executor in ("thread", "process"):
+            m = range(-500, 500) | map(abs, workers=3, batch_size=10, executor=executor)
+            assert_that([x for x in m], equal_to([abs(x) for x in range(-500, 500)]))
+            m = range(-500, 500) | map(abs, workers=3, batch_size=10, ordered=False, executor=executor)
+            assert_that(builtins.sorted(m), equal_to(builtins.sorted(abs(x) for x in range(-500, 500))))
+        assert_that(calling(list).with_args(range(10) | map(abs, workers=2, executor="green")), raises(ValueError, "process, fork and thread"))
+
+
+with description("dw.grep"):
+
+    @it("selects records that match any of the patterns")
+    def _(self):
+        m = ["apple", "Banana", "cherry", "date"] | grep("an", "^d")
+        assert_that([x for x in m], equal_to(["Banana", "date"]))
+        m = ["apple", "Banana", "cherry", "date"] | grep("^b", i=True, n=True)
+        assert_that([x for x in m], equal_to([[1, "Banana"]]))
+        m = ["apple", "Banana", "cherry", "date"] | grep("an", v=True)
+        assert_that([x for x in m], equal_to(["apple", "cherry", "date"]))
+
+    @it("gives the same result as searching each pattern in turn")
+    def _(self):
+        import random, re
+        random.seed(0)
+        records = ["".join(random.choice("abcAB. ") for _ in range(random.randint(0, 12))) for _ in range(300)]
+        pattern_sets = [["ab"], ["ab", "c.A", "^B"], ["(a)\\1", "bc"], ["(?i)ab", "cc"], [], [""]]
+        pattern_sets.append(["".join(random.choice("abcAB.") for _ in range(4)) for _ in range(600)])
+
+        def reference(patterns, ignore_case, invert_match, fixed_strings):
+            compiled = [re.compile(re.escape(p) if fixed_strings else p, re.IGNORECASE if ignore_case else 0) for p in patterns]
+            return [[idx, r] for idx, r in enumerate(records) if any(bool(c.search(r)) != invert_match for c in compiled)]
+
+        for patterns in pattern_sets:
+            for options in [dict(i=i, v=v, F=F) for i in (False, True) for v in (False, True) for F in (False, True)]:
+                expected = reference(patterns, options["i"], options["v"], options["F"])
+                assert_that(list(records | grep(*patterns, n=True, **options)), equal_to(expected))
+                bytes_records = [r.encode() for r in records]
+                assert_that(list(bytes_records | grep(*[p.encode() for p in patterns], **options)), equal_to([r.encode() for _, r in expected]))
+
+    @it("selects records in a pool of workers with the same line numbers")
+    def _(self):
+        records = [f"line {x}" for x in range(1000)]
+        for executor in ("thread", "process"):
+            m = records | grep("7$", n=True, workers=2, batch_size=100, executor=executor)
+            assert_that([x for x in m], equal_to([x for x in (records | grep("7$", n=True))]))
+
+
+with description("dw.index.TrigramIndex"):
+
+    @it("lets grep read only the blocks of indexed files that can match")
+    def _(self):
+        import os, tempfile
+        from dw.index import TrigramIndex, query
+        with tempfile.TemporaryDirectory() as d:
+            paths = [os.path.join(d, f"{name}.log") for name in ("a", "b")]
+            for idx, path in enumerate(paths):
+                with open(path, "w") as f:
+                    for x in range(5000):
+                        f.write(f"{x} {'ERROR timeout' if x == 1234 + idx else 'INFO ok'} Straße id{x % 7}\n")
+            index_path = os.path.join(d, "logs.dwindex")
+            index = TrigramIndex(index_path, block_size=4096)
+            assert_that(index.update(*paths), equal_to(True))
+            index.save()
+            assert_that(index.update(*paths), equal_to(False))
+
+            alternatives = query(["ERROR.*timeout"], 0, False, False, "utf-8")
+            assert_that(alternatives, equal_to([[b"ERROR", b"timeout"]]))
+            ranges = index.candidate_ranges(paths[0], alternatives)
+            assert_that(len(ranges), equal_to(1))
+            assert_that(ranges[0][1] - ranges[0][0], less_than(5000))
+            assert_that(query(["a.c", "(foo|ba)r"], 0, False, False, "utf-8"), equal_to(None))
+            assert_that(query(["(foo|bar)baz"], 0, False, False, "utf-8"), equal_to([[b"foo", b"baz"], [b"bar", b"baz"]]))
+
+            for patterns, options in ((["ERROR.*timeout"], {}), (["error"], dict(i=True)), (["id[0-3]"], {}),
+                                      (["(straße|timeout)"], dict(i=True)), (["ok", "x.y"], dict(F=True)),
+                                      (["INFO"], dict(v=True)), (["STRASSE"], dict(i=True))):
+                expected = list(cat(*paths) | grep(*patterns, **options))
+                for index_arg in (index, index_path):
+                    assert_that(list(cat(*paths, index=index_arg) | grep(*patterns, **options)), equal_to(expected))
+            assert_that(list(cat(*paths, b=True, index=index) | grep(b"timeout")),
+                        equal_to(list(cat(*paths, b=True) | grep(b"timeout"))))
+
+            # appended lines are found before and after the index is updated
+            with open(paths[1], "a") as f:
+                f.write("5000 ERROR timeout again\n")
+            expected = ["1235 ERROR timeout Straße id3", "5000 ERROR timeout again"]
+            assert_that(list(cat(paths[1], index=TrigramIndex(index_path)) | grep("timeout")), equal_to(expected))
+            blocks = len(index.files[os.path.abspath(paths[1])].blocks)
+            assert_that(index.update(paths[1]), equal_to(True))
+            assert_that(len(index.files[os.path.abspath(paths[1])].blocks), equal_to(blocks + 1))
+            assert_that(list(cat(paths[1], index=index) | grep("timeout")), equal_to(expected))
+
+    @it("does not drop lines of ASCII letters that match non ASCII letters under ignore case")
+    def _(self):
+        import os, tempfile
+        from dw.index import TrigramIndex
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "a.log")
+            with open(path, "w") as f:
+                f.write("x T\u0130MEOUT here\ny t\u0131meout there\nz \u212aelvin\n" + "INFO ok\n" * 2000)
+            index = TrigramIndex(os.path.join(d, "a.dwindex"), block_size=4096)
+            index.update(path)
+            for pattern in ("timeout", "kelvin"):
+                expected = list(cat(path) | grep(pattern, i=True))
+                assert_that(len(expected), equal_to(2 if pattern == "timeout" else 1))
+                assert_that(list(cat(path, index=index) | grep(pattern, i=True)), equal_to(expected))
+
+    @it("is not used when files are followed")
+    def _(self):
+        import os, tempfile
+        from dw.index import TrigramIndex
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "a.log")
+            with open(path, "w") as f:
+                f.write("1 ERROR timeout\n" + "INFO ok\n" * 2000)
+            index = TrigramIndex(os.path.join(d, "a.dwindex"), block_size=4096)
+            followed = iter(cat(path, follow=True, index=index, sleep_interval=0.01) | grep("timeout"))
+            assert_that(next(followed), equal_to("1 ERROR timeout"))
+            with open(path, "a") as f:
+                f.write("2 ERROR timeout\n")
+            assert_that(next(followed), equal_to("2 ERROR timeout"))
+            del followed
+
+
+with description("dw.scan"):
+
+    @it("runs leading stages on ranges of a file in workers and merges their results")
+    def _(self):
+        import os, tempfile
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "access.log")
+            with open(path, "w") as f:
+                for idx in range(20000):
+                    f.write(f"{idx % 7} {'ERROR' if idx % 13 == 0 else 'INFO'} {idx % 101}\r\n")
+            pipelines = [
+                (grep("ERROR"), map(lambda line: line.split()[2]), count()),
+                (map(lambda line: line.split()[0]), uniq(g=True)),
+                (filter(lambda line: "INFO" in line), grep("^3"), count(top=3)),
+                (grep("ERROR"), count_distinct()),
+                (grep("INFO"), head(5)),
+                (grep("^1", "^2"), sorted(reverse=True), head(3)),
+            ]
+            for stages in pipelines:
+                m = cat(path)
+                for stage in stages:
+                    m = m | stage
+                expected = list(m)
+                assert_that(list(scan(path, *stages, workers=3, split_size=10000)), equal_to(expected))
+                assert_that(list(scan(path, *stages, workers=1)), equal_to(expected))
+            assert_that(list(scan(path, grep(b"ERROR"), count(), b=True, workers=2)),
+                        equal_to(list(cat(path, b=True) | grep(b"ERROR") | count())))
+
+
+with description("dw.sh"):
+
+    @it("streams records through a command")
+    def _(self):
+        assert_that(list(["b", "c", "a"] | sh("sort")), equal_to(["a", "b", "c"]))
+        assert_that(list([] | sh(["printf", "%s\\n"], "x y", "z")), equal_to(["x y", "z"]))
+        assert_that(list([b"a", "b"] | pipe_through("cat", b=True)), equal_to([b"a", b"b"]))
+        assert_that(sum(1 for _ in range(200000) | sh("cat") | sh(["cat"])), equal_to(200000))
+
+    @it("propagates the exit status unless the pipeline stops early")
+    def _(self):
+        import itertools, subprocess
+        assert_that(calling(list).with_args([] | sh("exit 3")), raises(subprocess.CalledProcessError))
+        assert_that(list([] | sh("exit 3", check=False)), equal_to([]))
+        assert_that(list(itertools.count() | sh("cat") | head(3)), equal_to(["0", "1", "2"]))
+
+    @it("stops and joins its feeder thread when the pipeline is closed early")
+    def _(self):
+        import itertools, threading, time
+        closed = []
+
+        def numbers():
+            try:
+                for x in itertools.count():
+                    time.sleep(0.001)
+                    yield x
+            finally:
+                closed.append(True)
+
+        records = iter(numbers() | sh("cat", flush_size=1))
+        assert_that(next(records), equal_to("0"))
+        records.close()
+        assert_that(closed, equal_to([True]))
+        assert_that([thread for thread in threading.enumerate() if thread.name == "dw.sh"], equal_to([]))
+
+    @it("passes args to execute_command")
+    def _(self):
+        assert_that(dw.execute_command("echo", ["a", "b"]), equal_to((0, b"a b\n", b"")))
+
+
+with description("dw.aio"):
+
+    @it("runs pipelines over async iterables with |, > and >>")
+    def _(self):
+        import asyncio, os, tempfile
+        import dw.aio
+
+        async def numbers(n):
+            for x in range(n):
+                await asyncio.sleep(0)
+                yield str(x)
+
+        async def main(d):
+            path = os.path.join(d, "out.txt")
+            seen = []
+            result = await (dw.aio.cat(numbers(30), ["a1"]) | dw.aio.grep("1") | dw.aio.tee(seen) | dw.aio.head(3) > [])
+            assert_that(result, equal_to(["1", "10", "11"]))
+            assert_that(seen, equal_to(["1", "10", "11"]))
+            await (numbers(3) | dw.aio.map(int) > path)
+            await (["x"] | dw.aio.grep("x", n=True) >> path)
+            assert_that(await (dw.aio.cat(path) > []), equal_to(["0", "1", "2", "[0, 'x']"]))
+
+            process = await asyncio.create_subprocess_exec(sys.executable, "-c", "print('a'); print('b')", stdout=asyncio.subprocess.PIPE)
+            assert_that(await (dw.aio.cat(process.stdout) > []), equal_to(["a", "b"]))
+            await process.wait()
+
+        with tempfile.TemporaryDirectory() as d:
+            asyncio.run(main(d))
+
+    @it("awaits async callables of map with a concurrency limit")
+    def _(self):
+        import asyncio, random
+        import dw.aio
+
+        running, peak = [0], [0]
+
+        async def slow_square(x):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(random.random() / 1000)
+            running[0] -= 1
+            return x * x
+
+        async def main():
+            ordered = await (range(50) | dw.aio.map(slow_square, concurrency=4) > [])
+            unordered = await (range(50) | dw.aio.map(slow_square, concurrency=4, ordered=False) > [])
+            return ordered, unordered
+
+        ordered, unordered = asyncio.run(main())
+        assert_that(ordered, equal_to([x * x for x in range(50)]))
+        assert_that(builtins.sorted(unordered), equal_to([x * x for x in range(50)]))
+        assert_that(peak[0], equal_to(4))
+
+    @it("closes upstream sources when the pipeline stops early or is cancelled")
+    def _(self):
+        import asyncio
+        import dw.aio
+
+        closed = []
+
+        async def forever(name):
+            try:
+                while True:
+                    await asyncio.sleep(0)
+                    yield name
+            finally:
+                closed.append(name)
+
+        async def main():
+            assert_that(await (forever("head") | dw.aio.map(str.upper, concurrency=2) | dw.aio.head(2) > []), equal_to(["HEAD", "HEAD"]))
+            assert_that(closed, equal_to(["head"]))
+
+            task = asyncio.ensure_future(forever("cancel") | dw.aio.grep("c") > dw.DEV_NULL)
+            await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            assert_that(closed, equal_to(["head", "cancel"]))
+
+        asyncio.run(main())
+
+
+with description("dw.csv"):
+
+    @it("reads compact rows that convert their fields when they are accessed")
+    def _(self):
+        import csv, io, os, pickle, tempfile
+        import dw.csv
+        text = 'a,b,c\n1,"x, ""y""",3\n2,"multi\nline",\n3,short\n'
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "abc.csv")
+            with open(path, "w", newline="") as f:
+                f.write(text)
+            rows = list(dw.csv.cat(path, types={"a": int, 2: float}))
+            assert_that([row.to_dict() for row in rows], equal_to([{"a": 1, "b": 'x, "y"', "c": 3.0},
+                                                                   {"a": 2, "b": "multi\nline", "c": None},
+                                                                   {"a": 3, "b": "short", "c": None}]))
+            assert_that(rows[0].b, equal_to('x, "y"'))
+            assert_that(rows[0][-1], equal_to(3.0))
+            assert_that(rows[0].field(0), equal_to("1"))
+            assert_that(type(rows[0]).header, equal_to(type(rows[2]).header))
+            assert_that(pickle.loads(pickle.dumps(rows)), equal_to(rows))
+            assert_that(calling(lambda: rows[0].d), raises(AttributeError))
+
+            lines = list(dw.csv.cat(path) | dw.csv.format())
+            assert_that(list(csv.reader(io.StringIO("\n".join(lines) + "\n"))),
+                        equal_to(list(csv.reader(io.StringIO(text.replace("3,short", "3,short,"))))))
+            assert_that(list(text.splitlines() | dw.csv.parse(types=[int])), equal_to(rows))
+            assert_that(list([{"a": 1, "b": None}, {"a": 2}] | dw.csv.format()), equal_to(["a,b", "1,", "2,"]))
+            assert_that(list([[1, 2]] | dw.csv.format(header=["x", "y"])), equal_to(["x,y", "1,2"]))
+            assert_that(list([["a", "b"], ("c", "d")] | dw.csv.format()), equal_to(["a,b", "c,d"]))
+
+    @it("formats rows as a Markdown table")
+    def _(self):
+        import dw.csv
+        assert_that(list("a,b\n1,10\n2,|" | dw.csv.parse() | dw.csv.to_markdown()),
+                    equal_to(["| a    | b    |", "| ---- | ---- |", "| 1    | 10   |", "| 2    | \\|   |"]))
+
+
+with description("dw.pivot"):
+
+    @it("aggregates groups by formulas, with and without NumPy and through spills")
+    def _(self):
+        import contextlib, io, random
+        from dw.pivot import parse_formula, pivot
+        rng = random.Random(0)
+        records = [{"g": rng.randrange(30), "i": rng.choice([None, rng.randrange(-100, 100)]), "f": rng.random(),
+                    "s": rng.choice(["a", "b", None])} for _ in range(5000)]
+        formulas = ["sum(i)", "sum(f)", "n=count()", "count(i)", "min(i)", "max(f)", "mean(i)", "distinct(s)", "min(s)"]
+        expected = []
+        for g in builtins.list(builtins.dict.fromkeys(record["g"] for record in records)):
+            group = [record for record in records if record["g"] == g]
+            i = [record["i"] for record in group if record["i"] is not None]
+            expected.append({"g": g, "sum_i": builtins.sum(i), "n": len(group), "count_i": len(i), "min_i": builtins.min(i),
+                             "mean_i": builtins.sum(i) / len(i), "distinct_s": len({record["s"] for record in group} - {None}),
+                             "min_s": builtins.min(record["s"] for record in group if record["s"] is not None)})
+        for options in (dict(vectorize=False), {}, dict(batch_size=100), dict(batch_size=100, S=5)):
+            result = list(records | pivot("g", formulas=formulas, **options))
+            if "S" in options:
+                result = builtins.sorted(result, key=lambda record: [e["g"] for e in expected].index(record["g"]))
+            assert_that([{k: v for k, v in record.items() if k not in ("sum_f", "max_f")} for record in result], equal_to(expected))
+            for record in result:
+                f = [r["f"] for r in records if r["g"] == record["g"]]
+                assert_that(abs(record["sum_f"] - builtins.sum(f)), less_than(1e-9))
+                assert_that(record["max_f"], equal_to(builtins.max(f)))
+        assert_that(list(records | pivot("g", formulas=formulas, batch_size=100, vectorize=False)),
+                    equal_to(list(records | pivot("g", formulas=formulas, batch_size=100))))
+        assert_that(list([(1, 2), (1, 3), (2, 4)] | pivot(formulas=["mean(1)"])), equal_to([{"mean_1": 3.0}]))
+        records = [{"k": "a", "v": -2**63}, {"k": "a", "v": -1}]
+        assert_that(list(records | pivot("k", formulas=["s=sum(v)"])), equal_to([{"k": "a", "s": -2**63 - 1}]))
+        assert_that(list(records | pivot("k", formulas=["s=sum(v)"], vectorize=False)), equal_to([{"k": "a", "s": -2**63 - 1}]))
+        for zeros in ([0.0, -0.0], [-0.0, 0.0]):
+            records = [{"k": "a", "v": zero} for zero in zeros]
+            result = list(records | pivot("k", formulas=["min(v)", "max(v)"]))
+            assert_that(repr(result), equal_to(repr(list(records | pivot("k", formulas=["min(v)", "max(v)"], vectorize=False)))))
+            assert_that(repr(result), equal_to(repr([{"k": "a", "min_v": zeros[0], "max_v": zeros[0]}])))
+        assert_that(calling(parse_formula).with_args("median(c)"), raises(ValueError))
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            assert_that(dw.main_cli(["csv", "pivot", "--field", "a", "--formula", "sum_c=sum(c)", "--csv", "a,c\n1,1\n2,3\n1,2\n"]), equal_to(0))
+        assert_that(out.getvalue(), equal_to("a,sum_c\n1,3\n2,3\n"))
+        err = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(err):
+            assert_that(dw.main_cli(["csv", "pivot", "--field", "a", "--formula", "sum(c)", "a,c\n1,1\n2,x\n"]), equal_to(2))
+        assert_that(err.getvalue(), contains_string("cannot aggregate"))
+
+        from dw.profile import Profiler
+        records = [{"g": idx % 30, "v": idx} for idx in range(300)]
+        profiler = Profiler()
+        result = list(IterableMonad(records, profiler=profiler) | pivot("g", formulas=["sum(v)"], S=5, batch_size=1000))
+        # spilled groups are printed a partition at a time
+        assert_that(builtins.sorted(result, key=lambda record: record["g"]), equal_to(list(records | pivot("g", formulas=["sum(v)"]))))
+        assert_that(profiler.report()[1]["peak_buffered"], equal_to(5))
+
+
+with description("dw.batch"):
+
+    @it("runs stages on batches, with and without NumPy, and converts records at the boundaries")
+    def _(self):
+        import random
+        import dw.batch
+        rng = random.Random(0)
+        lines = [str(rng.randrange(100)) for _ in range(5000)]
+        numbers = [int(line) for line in lines]
+        for vectorize in (None, False):
+            def batches():
+                return lines | dw.batch.batches(700, vectorize=vectorize)
+            assert_that(list(batches() | dw.batch.map(int) | dw.batch.filter(lambda x: x > 50) | dw.batch.sorted(reverse=True)),
+                        equal_to(builtins.sorted([x for x in numbers if x > 50], reverse=True)))
+            assert_that(list(batches() | dw.batch.map(int) | dw.batch.count()), equal_to(list(numbers | dw.count())))
+            assert_that(list(batches() | dw.batch.count(top=3)), equal_to(list(lines | dw.count(top=3))))
+            assert_that(list(batches() | dw.batch.head(1000) | dw.batch.tail(3)), equal_to(lines[997:1000]))
+            assert_that(list(batches() | dw.batch.sample(10, seed=1)), equal_to(list(lines | dw.sample(10, seed=1))))
+            assert_that(list(batches() | dw.batch.map(lambda s: s + "!") | dw.head(2)), equal_to([lines[0] + "!", lines[1] + "!"]))
+            assert_that(calling(list).with_args(batches() | dw.batch.sample(5001)), raises(ValueError))
+
+            records = [{"i": idx, "x": x} for idx, x in enumerate(numbers)]
+            by_x = records | dw.batch.batches(700, vectorize=vectorize) | dw.batch.sorted(key="x") | dw.batch.filter(lambda c: c["x"] < 3)
+            assert_that(list(by_x), equal_to(builtins.sorted([r for r in records if r["x"] < 3], key=lambda r: r["x"])))
+        assert_that(list(range(5) | dw.batch.map(lambda x: x * 2)), equal_to([0, 2, 4, 6, 8]))
+        assert_that(list(range(5) | dw.batch.map(lambda x: x * 2, vectorized=True)), equal_to([0, 2, 4, 6, 8]))
+        assert_that(list(range(5) | dw.batch.filter(lambda x: x % 2 == 0, vectorized=True)), equal_to([0, 2, 4]))
+
+    @it("calls functions with each record unless vectorized, as dw.map does")
+    def _(self):
+        import dw.batch
+        for records, f in ((["abc", "xyz", "pq"], lambda s: s[::-1]), (["abcdef", "ghijkl"], lambda s: s[:3]),
+                           ([2 ** 40, 3], lambda x: x ** 2)):
+            assert_that(list(records | dw.batch.map(f)), equal_to(list(records | dw.map(f))))
+            assert_that(list(records | dw.batch.sorted(key=f)), equal_to(list(records | dw.sorted(key=f))))
+        assert_that((range(5) | dw.batch.head(2)) > [], equal_to([0, 1]))
+
+    @it("keeps dicts with different keys, records of other types and Rows as they are")
+    def _(self):
+        import dw.batch
+        from dw.csv import Header
+        for records in ([{"a": 1}, {"a": 2, "b": 3}], [{"a": 1}, "x", ["y"]], [{"a": 2, "b": 1}, {"b": 3, "a": 0}],
+                        [Header(["a", "b"]).row_class(["1", "2"]), Header(["a", "b"]).row_class(["3", "4"])]):
+            for vectorize in (None, False):
+                batches = records | dw.batch.batches(2, vectorize=vectorize)
+                assert_that(list(batches | dw.batch.head(2)), equal_to(list(records | dw.head(2))))
+                assert_that([type(record) for record in records | dw.batch.batches(2, vectorize=vectorize) | dw.batch.head(2)],
+                            equal_to([type(record) for record in records[:2]]))
+        records = [{"a": 2, "b": 1}, {"a": 0}]
+        assert_that(list(records | dw.batch.sorted(key="a")), equal_to(list(records | dw.sorted(key=lambda r: r["a"]))))
+
+
+with description("dw.cache"):
+
+    @it("replays the output of pipelines over unchanged files, and bypasses nondeterministic stages")
+    def _(self):
+        import os, tempfile, types
+        from dw.cache import ResultCache
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "a.log")
+            with open(path, "w") as f:
+                f.write("b ERROR\na ok\nc ERROR\nb ERROR\n")
+            cache = ResultCache(os.path.join(d, "cache"))
+
+            def report(pattern="ERROR"):
+                return dw.cat(path, cache=cache) | dw.grep(pattern) | dw.map(str.lower) | dw.sorted() | dw.uniq()
+
+            assert_that(list(report()), equal_to(["b error", "c error"]))
+            assert_that((cache.hits, cache.misses), equal_to((0, 1)))
+            assert_that(report() > [], equal_to(["b error", "c error"]))
+            assert_that(list(report("ok")), equal_to(["a ok"]))
+            assert_that((cache.hits, cache.misses), equal_to((1, 2)))
+
+            # the output of a pipeline that is not read to the end is not kept
+            assert_that(next(iter(report("b"))), equal_to("b error"))
+            assert_that(list(report("b")), equal_to(["b error"]))
+            assert_that((cache.hits, cache.misses), equal_to((1, 4)))
+
+            os.utime(path, ns=(0, 0))
+            assert_that(list(report()), equal_to(["b error", "c error"]))
+            assert_that((cache.hits, cache.misses), equal_to((1, 5)))
+
+            other = os.path.join(d, "other.txt")
+            for idx in range(2):
+                list(dw.cat(path, cache=cache) | dw.shuffle())
+                list(dw.cat(path, cache=cache) | dw.sample(2) | dw.sorted())
+                with open(other, "w") as f:
+                    f.write(f"{idx}\n")
+                assert_that(list(dw.cat(path, cache=cache) | dw.sh("cat", other)), equal_to([str(idx)]))
+            assert_that(cache.bypasses, equal_to(6))
+            assert_that(list(dw.cat(path, cache=cache) | dw.filter(lambda line: line < "b")), equal_to(["a ok"]))
+            assert_that(list(dw.cat(path, cache=cache) | dw.filter(lambda line: line < "c")), equal_to(["b ERROR", "a ok", "b ERROR"]))
+
+            cfg = types.ModuleType("cfg")
+            globals()["_cache_spec_cfg"] = cfg
+            for limit, expected in ((6, ["b ERROR", "c ERROR", "b ERROR"]), (7, [])):
+                cfg.LIMIT = limit
+                assert_that(list(dw.cat(path, cache=cache) | dw.filter(lambda line: len(line) > _cache_spec_cfg.LIMIT)),
+                            equal_to(expected))
+            bypasses = cache.bypasses
+            assert_that(list(dw.cat(path, cache=cache) | dw.map(lambda line: getattr(_cache_spec_cfg, "LIMIT"))), equal_to([7] * 4))
+            assert_that(cache.bypasses, equal_to(bypasses + 1))
+
+            assert_that(cache.invalidate(report()), equal_to(2))
+            assert_that(cache.invalidate(file_name=path), equal_to(6))
+            assert_that(cache.size(), equal_to(0))
+
+    @it("streams records downstream while it writes them")
+    def _(self):
+        import os, tempfile
+        from dw.cache import ResultCache
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "a.log")
+            with open(path, "w") as f:
+                f.write("".join(f"{idx}\n" for idx in range(3000)))
+            cache = ResultCache(os.path.join(d, "cache"))
+            read = []
+            records = iter(dw.cat(path, cache=cache) | dw.map(lambda line: read.append(line) or line))
+            assert_that(next(records), equal_to("0"))
+            assert_that(len(read), equal_to(1))
+            records.close()
+
+            followed = iter(dw.cat(path, cache=cache) | dw.tail(2, follow=True))
+            assert_that([next(followed), next(followed)], equal_to(["2998", "2999"]))
+            followed.close()
+            assert_that(cache.bypasses, equal_to(1))
+
+    @it("evicts the least recently used outputs beyond max_bytes")
+    def _(self):
+        import os, tempfile, time
+        from dw.cache import ResultCache
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "numbers.txt")
+            with open(path, "w") as f:
+                f.write("\n".join(str(idx) for idx in range(1000)))
+            cache = ResultCache(os.path.join(d, "cache"))
+
+            def run(n):
+                list(dw.cat(path, cache=cache) | dw.map(int) | dw.map(lambda x: x * n))
+                # the mtime of an output tells when it was used last
+                time.sleep(0.01)
+
+            run(1)
+            size = cache.size()
+            # room for two outputs
+            cache.max_bytes = size * 5 // 2
+            for n in (2, 1, 3):
+                run(n)
+            assert_that((cache.hits, cache.misses), equal_to((1, 3)))
+            assert_that(cache.size(), less_than(cache.max_bytes + 1))
+            run(1)
+            run(2)
+            assert_that((cache.hits, cache.misses), equal_to((2, 4)))
+
+
+with description("dw.main_cli"):
+
+    @it("runs stages as subcommands, importing only what they need")
+    def _(self):
+        import contextlib, io, os, subprocess, sys, tempfile
+        from dw.cli import UsageError, parse_args
+        options = ((("-n", "--lines"), "n", int), (("-e",), "patterns", list), (("-i",), "i", bool), (("-v",), "v", bool))
+        assert_that(parse_args(["-iv", "-n5", "a", "-e", "x", "--lines=7", "-e", "y", "--", "-i"], options),
+                    equal_to(({"i": True, "v": True, "n": 7, "patterns": ["x", "y"]}, ["a", "-i"])))
+        assert_that(calling(parse_args).with_args(["-n", "x"], options), raises(UsageError))
+        assert_that(calling(parse_args).with_args(["--no"], options), raises(UsageError))
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "a.txt")
+            with open(path, "w") as f:
+                f.write("".join(f"{x}\n" for x in (3, 1, 2, 10, 1)))
+            for args, expected in ((["head", "-n", "2", path], "3\n1\n"),
+                                   (["sort", "-n", "-r", "-u", path], "10\n3\n2\n1\n"),
+                                   (["grep", "-v", "1", path], "3\n2\n"),
+                                   (["count", "--top", "1", path], "2\t1\n")):
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    assert_that(dw.main_cli(args), equal_to(0))
+                assert_that(out.getvalue(), equal_to(expected))
+            with contextlib.redirect_stderr(io.StringIO()):
+                assert_that(dw.main_cli(["head", "-x"]), equal_to(2))
+                assert_that(dw.main_cli(["cat", os.path.join(d, "missing")]), equal_to(1))
+
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+            script = "import sys, dw; status = dw.main_cli(); print(sorted({'re', 'random', 'csv'} & set(sys.modules)), file=sys.stderr); sys.exit(status)"
+            result = subprocess.run([sys.executable, "-c", script, "head", path], capture_output=True, text=True, env=env)
+            assert_that((result.returncode, result.stdout, result.stderr), equal_to((0, "3\n1\n2\n10\n1\n", "[]\n")))
+            script = "import dw, logging, re; print(dw._LOGGER is logging.getLogger('dw'), dw.logging is logging, dw.re is re)"
+            result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env)
+            assert_that(result.stdout, equal_to("True True True\n"))
+
+            # the reader of stdout goes away
+            with open(path, "w") as f:
+                f.write("line\n" * 200000)
+            p = subprocess.Popen([sys.executable, "-c", "import sys, dw; sys.exit(dw.main_cli())", "cat", path],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+            assert_that(p.stdout.readline(), equal_to(b"line\n"))
+            p.stdout.close()
+            assert_that(p.wait(), equal_to(141))
+            assert_that(p.stderr.read(), equal_to(b""))
+            p.stderr.close()
+
 
 if __name__ == '__main__':
     import unittest